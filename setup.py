@@ -42,5 +42,8 @@ setup(
          'lxml',
          'future'
     ],
+    extras_require={
+         'numpy': ['numpy'], # vectorized timecode conversion
+    },
     packages=find_packages(),
 )
@@ -0,0 +1,104 @@
+# encoding: utf-8
+# Compare the time and memory of XmemlParser with the default parser and
+# with a low-memory ParserProfile, over parsing and the iterators.
+#
+# Run with an xmeml file:
+#   PYTHONPATH=. python test/benchmark.py export.xml
+# or without one, to generate a big Premiere-like file from the sample:
+#   PYTHONPATH=. python test/benchmark.py
+#
+# Each variant runs in its own process, so its peak memory
+# is measured on its own.
+
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from xmeml.iter import ParserProfile, XmemlParser
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'xmemlfiles', 'sample.xml')
+VARIANTS = ('default', 'lowmemory', 'release') # release: lowmemory, and release the clips
+
+# the kind of blocks Premiere adds to each clipitem
+PREMIEREBLOCKS = '''<logginginfo><description>{0}</description><scene></scene><shottake></shottake>
+<lognote>{0}</lognote><good></good></logginginfo>
+<itemhistory>{1}</itemhistory>
+<!-- {0} -->
+<appspecificdata><appname>Final Cut Pro</appname><appmanufacturer>Apple Inc.</appmanufacturer>
+<data><fcpimageprocessing>{2}</fcpimageprocessing></data></appspecificdata>
+'''
+
+def generate(filename, copies=500):
+    "Write a big file with the tracks of the sample repeated, and Premiere's extra blocks in each clip"
+    from lxml import etree
+    tree = etree.parse(SAMPLE)
+    seq = tree.getroot().find('sequence')
+    blocks = PREMIEREBLOCKS.format('x' * 200, '<uuid>abcdef</uuid>' * 50, '<enabled>TRUE</enabled>' * 50)
+    for track in seq.iterfind('media/*/track'):
+        clips = track.findall('clipitem')
+        for n in range(copies):
+            for clip in clips:
+                copy = etree.fromstring(etree.tostring(clip))
+                copy.set('id', '{}-{}'.format(clip.get('id'), n))
+                for el in copy.iterchildren('start', 'end'):
+                    if el.text == '-1': # no transitions next to the copies
+                        el.text = copy.findtext('in') if el.tag == 'start' else copy.findtext('out')
+                    el.text = str(int(el.text) + 500 * (n + 1))
+                for el in copy.iter('file'):
+                    del el[:] # a reference to the file defined in the original
+                for block in etree.fromstring('<x>{}</x>'.format(blocks)):
+                    copy.append(block)
+                track.append(copy)
+    tree.write(filename, xml_declaration=True, encoding='UTF-8')
+
+def memory(field='VmHWM'):
+    """Peak (VmHWM) or current (VmRSS) rss of this process in kB. ru_maxrss is kept
+    across exec on linux, so it is only used where there is no /proc"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run(filename, variant):
+    "Parse and iterate, and print seconds, and peak and current memory in kB"
+    logging.disable(logging.WARNING)
+    started = time.time()
+    profile = ParserProfile() if variant in ('lowmemory', 'release') else None
+    release = variant == 'release'
+    xmeml = XmemlParser(filename, profile=profile)
+    parsed = time.time()
+    clips = sum(1 for c in xmeml.itervideoclips(release=release))
+    for clip in xmeml.iteraudioclips(release=release):
+        clip.audibleframes()
+        clips += 1
+    done = time.time()
+    print(variant, clips, parsed - started, done - parsed, memory(), memory('VmRSS'))
+    xmeml.close()
+
+def main(args):
+    if len(args) > 1 and args[1] == '--run':
+        return run(args[2], args[3])
+    if len(args) > 1:
+        filename = args[1]
+    else:
+        filename = os.path.join(tempfile.mkdtemp(), 'benchmark.xml')
+        generate(filename)
+    print('{}: {:.1f} MB'.format(filename, os.path.getsize(filename) / 1e6))
+    print('{:<10} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('variant', 'clips', 'parse s', 'iter s', 'peak MB', 'end MB'))
+    for variant in VARIANTS:
+        out = subprocess.check_output([sys.executable, __file__, '--run', filename, variant],
+                                      env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        name, clips, parse, iterate, peak, end = out.decode('utf-8').split()
+        print('{:<10} {:>7} {:>9.2f} {:>9.2f} {:>9.1f} {:>9.1f}'.format(
+            name, int(clips), float(parse), float(iterate), int(peak) / 1024.0, int(end) / 1024.0))
+
+if __name__ == '__main__':
+    main(sys.argv)
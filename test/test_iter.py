@@ -64,3 +64,777 @@ def test_xmemlsamples(datadir):
             continue
         assert load(xml)
 
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'xmemlfiles', 'sample.xml')
+
+def test_clipindex():
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    assert xmeml._index is None # built lazily
+    assert xmeml.getclip('clipitem-4').name == 'interview.mov'
+    assert xmeml.getclip('clipitem-13') is not None # clips on disabled tracks are indexed, too
+    assert xmeml.getclip('no-such-clip') is None
+    assert [c.id for c in xmeml.getclipsbyfile('file-1')] == ['clipitem-1', 'clipitem-4']
+    assert [c.id for c in xmeml.getclipsbypathurl('file://localhost/library/music/music.wav')] == ['clipitem-5', 'clipitem-12']
+    assert [c.id for c in xmeml.getclipsbyname('broll.mov')] == ['clipitem-2', 'clipitem-9']
+    assert [c.id for c in xmeml.getclipsbymasterclipid('masterclip-1')] == ['clipitem-1', 'clipitem-4']
+    index = xmeml.index
+    assert xmeml.index is index # not rebuilt
+
+def test_clipindexfromiteration(tmpdir):
+    clips = [_clipitem('v1', 0, 50, 0, 50, ''), _clipitem('v2', 50, 100, 0, 50, '')]
+    tmpdir.join('index.xml').write('<xmeml version="4">{}</xmeml>'.format(_sequence('seq', clips)))
+    xmeml = xmemliter.XmemlParser(str(tmpdir.join('index.xml')))
+    video = list(xmeml.itervideoclips())
+    audio = list(xmeml.iteraudioclips())
+    assert audio == []
+    # every clip was seen, so the index reuses them instead of traversing again
+    assert xmeml.getclip('v1') is video[0]
+    assert xmeml._indexed == {}
+    # a file with disabled clips gets its own traversal
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    list(xmeml.itervideoclips())
+    assert 'video' not in xmeml._indexed
+    assert xmeml.getclip('clipitem-13') is not None
+
+def test_linkgraph():
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    group = xmeml.linkgroup('clipitem-4')
+    assert sorted(c.id for c in group) == ['clipitem-1', 'clipitem-4']
+    assert xmeml.linkgroup(xmeml.getclip('clipitem-1')) is group
+    link = [l for l in xmeml.getclip('clipitem-4').linkedclips if l.linkclipref == 'clipitem-1'][0]
+    assert link.clip is xmeml.getclip('clipitem-1')
+    # sync sound from a separate audio file is linked to video, so it's not pure audio
+    assert xmeml.islinkedtovideo('clipitem-6')
+    assert not xmeml.islinkedtovideo('clipitem-5')
+    assert len(xmeml.linkgroup('clipitem-5')) == 1
+    assert [c.id for c in xmeml.iteraudioclips()] == ['clipitem-5', 'clipitem-12', 'clipitem-11']
+
+def test_linkedclipswithoutfile(tmpdir):
+    def link(clipid):
+        return '<link><linkclipref>{}</linkclipref><mediatype>audio</mediatype></link>'.format(clipid)
+    clips = [_clipitem('a1', 0, 50, 0, 50, link('a1') + link('a2')),
+             _clipitem('a2', 50, 100, 0, 50, link('a1') + link('a2'))]
+    tmpdir.join('nofile.xml').write('<xmeml version="4">{}</xmeml>'.format(_sequence('seq', clips, 'audio')))
+    xmeml = xmemliter.XmemlParser(str(tmpdir.join('nofile.xml')))
+    assert xmeml.audibleranges() == ({}, {})
+    assert list(xmeml.iteraudioclips()) == []
+
+def test_markerindex():
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    assert [m.name for m in xmeml.itermarkers()] == ['Intro', 'Segment']
+    assert list(xmeml.itermarkers())[0] is list(xmeml.itermarkers())[0] # not rebuilt
+    # clip markers are translated to sequence time
+    answer = [m for m in xmeml.markers if m.name == 'Answer'][0]
+    assert answer.source == 'clipitem'
+    assert answer.clip.id == 'clipitem-1'
+    assert (answer.start, answer.end) == (50, 50)
+    assert [m.name for m in xmeml.markersin(40, 100)] == ['Drop', 'Intro', 'Answer']
+    assert [m.name for m in xmeml.markersin(345, 500)] == ['Segment']
+    assert xmeml.markersin(100, 200) == []
+    assert xmeml.nearestmarker(290).name == 'Segment'
+    assert xmeml.nearestmarker(0).name == 'Drop'
+
+def test_markersofunlinkedclips(tmpdir):
+    marker = '<marker><in>10</in><out>-1</out></marker>'
+    sequence = _sequence('seq', [_clipitem('v1', 0, 50, 0, 50, marker)]).replace(
+        '</track>', '</track><track>{}</track>'.format(_clipitem('v2', 0, 50, 0, 50, marker)))
+    tmpdir.join('markers.xml').write('<xmeml version="4">{}</xmeml>'.format(sequence))
+    xmeml = xmemliter.XmemlParser(str(tmpdir.join('markers.xml')))
+    # the same unnamed marker at the same frame, on clips that are not linked
+    assert sorted(m.clip.id for m in xmeml.markers) == ['v1', 'v2']
+
+def test_nestedsequences():
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    # sequence-2 is nested twice, once in full and once by reference
+    video = [(c.id, c.start, c.end, c.inpoint, c.outpoint) for c in xmeml.itervideoclips()
+             if c.parent is not None]
+    assert video == [('clipitem-10', 150, 190, 10, 50), ('clipitem-10', 420, 440, 30, 50)]
+    audio = [(c.id, c.start, c.end, c.inpoint, c.outpoint) for c in xmeml.iteraudioclips()
+             if c.parent is not None]
+    assert audio == [('clipitem-11', 160, 200, 0, 40)]
+    assert {key[:2] for key in xmeml._nestedcache if key[2]} == {('sequence-2', 'video'), ('sequence-2', 'audio')}
+
+def _clipitem(clipid, start, end, inpoint, outpoint, inner):
+    return '''<clipitem id="{}"><name>{}</name><rate><timebase>25</timebase></rate>
+        <start>{}</start><end>{}</end><in>{}</in><out>{}</out>{}</clipitem>'''.format(
+            clipid, clipid, start, end, inpoint, outpoint, inner)
+
+def _sequence(seqid, clips, mediatype='video'):
+    return '''<sequence id="{0}"><name>{0}</name><rate><timebase>25</timebase><ntsc>FALSE</ntsc></rate>
+        <media><{1}><track>{2}</track></{1}></media></sequence>'''.format(seqid, mediatype, ''.join(clips))
+
+def test_deeplynestedsequences(tmpdir):
+    _file = '<file id="file-1"><name>a.mov</name><media><video/></media></file>'
+    inner = _sequence('inner', [_clipitem('leaf', 0, 100, 500, 600, _file)])
+    middle = _sequence('middle', [_clipitem('m1', 10, 60, 0, 50, inner),
+                                  _clipitem('m2', 60, 100, 50, 90, '<sequence id="inner"/>')])
+    top = _sequence('top', [_clipitem('t1', 1000, 1030, 20, 50, middle),
+                            _clipitem('t2', 2000, 2100, 0, 100, '<sequence id="middle"/>')])
+    xml = tmpdir.join('nested.xml')
+    xml.write('<xmeml version="4">{}</xmeml>'.format(top))
+    xmeml = xmemliter.XmemlParser(str(xml))
+    clips = [(c.start, c.end, c.inpoint, c.outpoint) for c in xmeml.itervideoclips()]
+    assert clips == [(1000, 1030, 510, 540), # t1 shows middle 20-50, i.e. m1 10-40
+                     (2010, 2060, 500, 550), (2060, 2100, 550, 590)]
+    # each nested sequence is expanded once
+    assert sorted(key[:3] for key in xmeml._nestedcache) == [('inner', 'video', True), ('middle', 'video', True)]
+
+def test_itersequences(tmpdir):
+    _file = ('<file id="file-{0}"><name>{0}.wav</name><media><audio/></media></file>'
+             '<sourcetrack><mediatype>audio</mediatype></sourcetrack>')
+    first = _sequence('first', [_clipitem('a', 0, 100, 0, 100, _file.format('a'))], 'audio')
+    second = _sequence('second', [_clipitem('b', 0, 50, 0, 50, _file.format('b'))], 'audio')
+    third = _sequence('third', [_clipitem('c', 10, 20, 0, 10, _file.format('c'))], 'audio')
+    xml = tmpdir.join('project.xml')
+    xml.write('<xmeml version="4"><project><children>{}<bin><children>{}{}'
+              '<sequence id="first"/></children></bin></children></project></xmeml>'.format(first, second, third))
+    xmeml = xmemliter.XmemlParser(str(xml))
+    sequences = list(xmeml.itersequences())
+    assert [seq.id for seq in sequences] == ['first', 'second', 'third']
+    assert sequences[0] is xmeml
+    assert list(xmeml.itersequences())[1] is sequences[1] # views are reused
+    assert [seq.id for seq in xmeml.itersequences(names=['third'])] == ['third']
+    assert [seq.id for seq in xmeml.itersequences(ids=['second', 'first'])] == ['first', 'second']
+    assert list(sequences[2].audibleranges()[0]) == ['c']
+    serial = [(seq.id, {k: v.r for k, v in clips.items()})
+              for seq, (clips, files) in xmeml.analyzesequences()]
+    parallel = [(seq.id, {k: v.r for k, v in clips.items()})
+                for seq, (clips, files) in xmeml.analyzesequences(workers=3)]
+    assert serial == parallel
+    assert serial[1] == ('second', {'b': [xmemliter.Range((0, 50))]})
+
+def test_nestedcachethreads(monkeypatch):
+    import threading, time
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    expansions = []
+    iterclips = xmemliter.XmemlSequence._iterclips
+    def slow(self, mediatype, enabledonly=True, sequence=None, *args, **kwargs):
+        if sequence is not None:
+            expansions.append(sequence.get('id'))
+            time.sleep(0.01) # let the other threads in
+        return iterclips(self, mediatype, enabledonly, sequence, *args, **kwargs)
+    monkeypatch.setattr(xmemliter.XmemlSequence, '_iterclips', slow)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(xmeml._nestedclips('sequence-2', 'audio')))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert expansions == ['sequence-2']
+    assert all(r is results[0] for r in results)
+
+def test_edit(tmpdir):
+    from lxml import etree
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    editor = xmeml.edit()
+    editor.relink('file://localhost/library/music/music.wav', 'file://archive/music.wav')
+    editor.relink('file-6', 'file://archive/sync.wav')
+    editor.setlevels('clipitem-12', keyframes=[(400, 0.5), (450, 0.0)])
+    editor.setlevels(xmeml.getclip('clipitem-5'), value=0.0)
+    editor.settiming('clipitem-6', start=160, inpoint=10)
+    editor.removeclip('clipitem-9')
+    editor.removetrack('audio', 4)
+    with pytest.raises(xmemliter.XmemlError):
+        editor.removetrack('video', 9)
+    out = tmpdir.join('edited.xml')
+    assert editor.write(str(out)) == 7
+    edited = xmemliter.XmemlParser(str(out))
+    assert edited.getclip('clipitem-5').file.pathurl == 'file://archive/music.wav'
+    assert edited.getclip('clipitem-6').file.pathurl == 'file://archive/sync.wav'
+    assert edited.getclip('clipitem-9') is None
+    assert edited.getclip('clipitem-13') is None
+    assert (edited.getclip('clipitem-6').start, edited.getclip('clipitem-6').inpoint) == (160, 10)
+    assert list(edited.getclip('clipitem-12').getlevels().parameters) == [(400, 0.5), (450, 0.0)]
+    assert edited.getclip('clipitem-5').getlevels().value == 0.0
+    # untouched elements are written as they were, and the source tree is not changed
+    assert etree.tostring(edited.getclip('clipitem-4').tree) == etree.tostring(xmeml.getclip('clipitem-4').tree)
+    assert xmeml.getclip('clipitem-5').file.pathurl == 'file://localhost/library/music/music.wav'
+    assert out.read().startswith("<?xml version='1.0' encoding='UTF-8'?>\n<!DOCTYPE xmeml>")
+    # an Audio Levels effect without a parameter gets one, not a second effect
+    levels = '<filter><effect><name>Audio Levels</name><effectid>audiolevels</effectid></effect></filter>'
+    tmpdir.join('levels.xml').write('<xmeml version="4">{}</xmeml>'.format(
+        _sequence('seq', [_clipitem('a1', 0, 50, 0, 50, levels)], 'audio')))
+    editor = xmemliter.XmemlParser(str(tmpdir.join('levels.xml'))).edit()
+    editor.setlevels('a1', value=0.5)
+    editor.write(str(out))
+    clip = xmemliter.XmemlParser(str(out)).getclip('a1')
+    assert len(clip.tree.findall('filter/effect')) == 1
+    assert clip.getlevels().value == 0.5
+    # released clips have no element left to edit
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    released = list(xmeml.iteraudioclips(release=True))
+    with pytest.raises(xmemliter.XmemlError):
+        xmeml.edit().setlevels(released[0], value=0.0)
+
+def test_snapshot(tmpdir):
+    import struct
+    from xmeml import snapshot
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    out = str(tmpdir.join('sample.snap'))
+    clips = [ci for mediatype in ('video', 'audio') for ci in xmeml._iterclips(mediatype)]
+    assert xmeml.writesnapshot(out) == len(clips)
+    with snapshot.Snapshot(out) as snap:
+        assert len(snap.clips) == len(clips)
+        assert [snap.string(i) for i in snap.clips['id']] == [ci.id for ci in clips]
+        assert list(snap.clips['start']) == [ci.start for ci in clips]
+        assert list(snap.clips['tracknumber']) == [ci.tracknumber for ci in clips]
+        row = [ci.id for ci in clips].index('clipitem-4')
+        effect = snap.clips['firsteffect'][row]
+        assert snap.string(snap.effects['effectid'][effect]) == 'audiolevels'
+        first = snap.effects['firstkeyframe'][effect]
+        assert list(snap.keyframes['when'][first:first + snap.effects['keyframecount'][effect]]) == [200, 240, 270]
+        music = snap.clips['file'][[ci.id for ci in clips].index('clipitem-5')]
+        assert snap.string(snap.files['pathurl'][music]) == 'file://localhost/library/music/music.wav'
+        assert [snap.string(i) for i in snap.clips['masterclipid']] == [ci.masterclipid for ci in clips]
+        assert sorted(snap.string(i) for i in snap.markers['name']) == sorted(m.name for m in xmeml.markers)
+        # clipitem-10 is repeated through the nested sequence, markers still point at their own clip
+        assert [ci.id for ci in clips].count('clipitem-10') > 1
+        for i, marker in enumerate(xmeml.markers):
+            if marker.clip is not None:
+                assert snap.string(snap.clips['id'][snap.markers['clip'][i]]) == marker.clip.id
+    # a column still in use doesn't stop the file from being closed
+    snap = snapshot.Snapshot(out)
+    starts = memoryview(snap.clips['start'])
+    snap.close()
+    assert snap._file.closed and list(starts) == [ci.start for ci in clips]
+    del starts
+    # files from another format version are refused
+    with open(out, 'r+b') as f:
+        f.seek(8)
+        f.write(struct.pack('<I', snapshot.VERSION + 1))
+    with pytest.raises(snapshot.SnapshotVersionError):
+        snapshot.Snapshot(out)
+
+@pytest.mark.parametrize('usenumpy', [True, False])
+def test_timecode(monkeypatch, usenumpy):
+    from xmeml import timecode
+    if not usenumpy:
+        monkeypatch.setattr(timecode, 'numpy', None)
+    elif timecode.numpy is None:
+        pytest.skip('numpy is not installed')
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    tc = xmeml.timecode
+    assert (tc.timebase, tc.dropframe, tc.offset) == (25, False, 900000)
+    assert tc.format(50) == '10:00:02:00'
+    assert tc.parse('10:00:02:00') == 50
+    ranges = xmemliter.Ranges(xmemliter.Range((0, 150)), framerate=25)
+    assert tc.formatranges(ranges) == [('10:00:00:00', '10:00:06:00')]
+    # 29.97 drop-frame skips frame numbers 0 and 1 each minute, except every tenth
+    df = timecode.TimecodeFormat(30, dropframe=True)
+    frames = [0, 1799, 1800, 17981, 17982, 107892]
+    timecodes = ['00:00:00;00', '00:00:59;29', '00:01:00;02', '00:09:59;29', '00:10:00;00', '01:00:00;00']
+    assert [str(s) for s in df.formatmany(frames)] == timecodes
+    assert [int(f) for f in df.parsemany(timecodes)] == frames
+    assert [df.parse(s) for s in timecodes] == frames
+    assert [int(h) for h in df.split(frames)[0]] == [0, 0, 0, 0, 0, 1]
+    df60 = timecode.TimecodeFormat(60, dropframe=True)
+    assert df60.format(3600) == '00:01:00;04'
+    with pytest.raises(ValueError):
+        timecode.TimecodeFormat(25, dropframe=True)
+    with pytest.raises(ValueError):
+        df.parsemany(['00:00:00;00', '00:0x:00;00'])
+
+def test_exactframerates():
+    from fractions import Fraction
+    assert xmemliter.getframerate(30, True) == (Fraction(30000, 1001), 'NTSC/HD')
+    assert xmemliter.getframerate(24, True)[0] == Fraction(24000, 1001)
+    assert xmemliter.getframerate(25, True) == (Fraction(25), 'PAL')
+    assert xmemliter.getframerate(48, False) == (Fraction(48), None)
+    assert xmemliter.getframerate(None, False) == (None, None)
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    clip = xmeml.getclip('clipitem-2')
+    # frames are ints, also when resolved from a transition
+    assert (clip.start, clip.end) == (100, 200)
+    assert all(isinstance(c.start, int) and isinstance(c.end, int) for c in xmeml.index.byid.values())
+    ranges = xmemliter.Ranges(xmemliter.Range((0, 1001)), framerate=xmemliter.getframerate(30, True)[0])
+    assert ranges.seconds() == Fraction(1001 * 1001, 30000)
+    assert [list(a) for a in ranges.arrays()] == [[0], [1001]]
+
+def test_diff(tmpdir):
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    editor = xmeml.edit()
+    editor.settiming('clipitem-6', start=160, end=210)
+    editor.settiming('clipitem-12', inpoint=410)
+    editor.setlevels('clipitem-5', value=0.0)
+    editor.relink('file-7', 'file://archive/scratch.wav')
+    editor.removeclip('clipitem-9')
+    out = str(tmpdir.join('edited.xml'))
+    editor.write(out)
+    edited = xmemliter.XmemlParser(out)
+    d = xmeml.diff(edited)
+    assert [c.id for c in d.removed] == ['clipitem-9'] and d.added == []
+    assert [c.new.id for c in d.moved] == ['clipitem-6']
+    assert [c.new.id for c in d.retimed] == ['clipitem-12']
+    assert [c.new.id for c in d.levelchanged] == ['clipitem-5']
+    assert [c.new.id for c in d.sourcechanged] == ['clipitem-13']
+    # windows of changed clips, merged where they overlap or touch
+    assert [r.get() for r in d.windows] == [(0, 210), (300, 400)]
+    # the clips of the old file still point at the old files
+    assert xmeml.getclip('clipitem-13').file.pathurl != 'file://archive/scratch.wav'
+    # no changes, also for the clips of the nested sequence that is used twice
+    assert not xmemliter.XmemlParser(SAMPLE).diff(SAMPLE)
+    reverse = edited.diff(SAMPLE)
+    assert [c.id for c in reverse.added] == ['clipitem-9']
+
+def test_fingerprint(tmpdir):
+    from xmeml import fingerprint
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    fp = xmeml.fingerprint()
+    assert len(fp.tracks) == 6
+    # a copy with other ids and a new uuid is the same sequence
+    with open(SAMPLE) as f:
+        copy = f.read().replace('clipitem-', 'item-').replace('<name>sequence-1', '<name>resaved')
+    tmpdir.join('copy.xml').write(copy)
+    copyfp = xmemliter.XmemlParser(str(tmpdir.join('copy.xml'))).fingerprint()
+    assert copyfp == fp and copyfp.similarity(fp) == 1.0
+    assert fingerprint.prefingerprint(SAMPLE) == fingerprint.prefingerprint(str(tmpdir.join('copy.xml')))
+    # renamed clips are the same sequence, for both
+    tmpdir.join('renamed.xml').write(copy.replace('<name>music.wav', '<name>song.wav'))
+    assert xmemliter.XmemlParser(str(tmpdir.join('renamed.xml'))).fingerprint() == fp
+    assert fingerprint.prefingerprint(SAMPLE) == fingerprint.prefingerprint(str(tmpdir.join('renamed.xml')))
+    # a small edit changes one clip and one track
+    editor = xmeml.edit()
+    editor.setlevels('clipitem-5', value=0.0)
+    editor.write(str(tmpdir.join('edited.xml')))
+    editedfp = xmemliter.XmemlParser(str(tmpdir.join('edited.xml'))).fingerprint()
+    assert editedfp != fp
+    assert [t for t in fp.tracks if fp.tracks[t] != editedfp.tracks[t]] == [('audio', 2)]
+    assert 0.8 < editedfp.similarity(fp) < 1.0
+    other = tmpdir.join('other.xml')
+    _file = '<file id="file-1"><name>a.mov</name><media><video/></media></file>'
+    other.write('<xmeml version="4">{}</xmeml>'.format(_sequence('sequence-9', [_clipitem('clipitem-1', 0, 10, 0, 10, _file)])))
+    otherfp = xmemliter.XmemlParser(str(other)).fingerprint()
+    assert fingerprint.prefingerprint(str(other)) != fingerprint.prefingerprint(SAMPLE)
+    index = fingerprint.FingerprintIndex()
+    assert index.add('sample', fp) is None
+    assert index.add('other', otherfp) is None
+    assert index.add('copy', copyfp) == 'sample'
+    assert index.add('edited', editedfp) is None
+    similar = index.similar(editedfp, threshold=0.8)
+    assert similar[0] == (1.0, 'edited') and set(key for _s, key in similar) == {'edited', 'sample', 'copy'}
+    assert index.groups(threshold=0.8) == [['sample', 'copy', 'edited'], ['other']]
+    # a clip inserted at the head moves every clip after it, but they stay the same clips
+    shots = [(n * 10, n * 10 + 10, n * 100) for n in range(10)]
+    def edit(shots):
+        clips = [_clipitem('c{}'.format(n), start, end, inpoint, inpoint + 10, _file if n == 0 else '<file id="file-1"/>')
+                 for n, (start, end, inpoint) in enumerate(shots)]
+        tmpdir.join('ripple.xml').write('<xmeml version="4">{}</xmeml>'.format(_sequence('s', clips)))
+        return xmemliter.XmemlParser(str(tmpdir.join('ripple.xml'))).fingerprint()
+    before = edit(shots)
+    after = edit([(0, 10, 5000)] + [(start + 10, end + 10, inpoint) for start, end, inpoint in shots])
+    assert after != before
+    assert after.similarity(before) >= 10 / 11.0
+
+def test_parserprofile(tmpdir):
+    from lxml import etree
+    def summary(xmeml):
+        return ([(c.id, c.start, c.end, c.file and c.file.pathurl) for c in xmeml.itervideoclips()],
+                [(c.id, list(c.audibleframes())) for c in xmeml.iteraudioclips()],
+                [(m.name, m.start) for m in xmeml.markers])
+    default = xmemliter.XmemlParser(SAMPLE)
+    lowmemory = xmemliter.XmemlParser(SAMPLE, profile=xmemliter.ParserProfile())
+    assert summary(lowmemory) == summary(default)
+    assert default.tree.find('.//logginginfo') is not None
+    assert lowmemory.tree.find('.//logginginfo') is None
+    # comments and whitespace are dropped, and the pruned tags are configurable
+    with open(SAMPLE) as f:
+        xml = f.read().replace('<logginginfo>', '<!-- comment --><logginginfo>')
+    tmpdir.join('commented.xml').write(xml)
+    profile = xmemliter.ParserProfile(prune=['marker'])
+    with tmpdir.join('commented.xml').open('rb') as f:
+        pruned = xmemliter.XmemlParser(f, profile=profile)
+    assert pruned.tree.find('.//logginginfo') is not None
+    assert list(pruned.itermarkers()) == []
+    assert not any(isinstance(el, etree.CommentBase) for el in pruned.tree.iter())
+    assert all(el.tail is None for el in pruned.tree.iter('clipitem'))
+    assert pruned.tree.docinfo.doctype == default.tree.docinfo.doctype
+    # editing a pruned file would silently lose what was pruned
+    editor = lowmemory.edit()
+    editor.setlevels('clipitem-5', value=0.0)
+    with pytest.raises(xmemliter.XmemlError):
+        editor.write(str(tmpdir.join('edited.xml')))
+    assert editor.write(str(tmpdir.join('edited.xml')), lossy=True) == 1
+    assert not xmemliter.ParserProfile(prune=(), remove_comments=False).lossy
+
+def test_release():
+    def summary(clips):
+        return [(c.id, c.start, c.end, c.tracknumber, [e.effectid for e in c.getfilters()]) for c in clips]
+    expected = summary(xmemliter.XmemlParser(SAMPLE).itervideoclips())
+    expectedaudio = summary(xmemliter.XmemlParser(SAMPLE).iteraudioclips())
+    expectedranges = xmemliter.XmemlParser(SAMPLE).audibleranges()[0]
+    with xmemliter.XmemlParser(SAMPLE) as xmeml:
+        clips = list(xmeml.itervideoclips(release=True))
+        assert summary(clips) == expected
+        # clips of nested sequences are shared, and not released
+        assert all((c.tree is None) == (c.parent is None) for c in clips)
+        # the video clipitems are gone from the tree, the nested sequence is still there
+        assert [c.get('id') for c in xmeml.sequence.find('media/video').iter('clipitem')] == []
+        # no ClipItem is kept for the links, and what needs all clips is refused
+        assert xmeml._index is None and xmeml._linkgraph is None
+        assert summary(xmeml.iteraudioclips(release=True)) == expectedaudio
+        assert list(xmeml.iteraudioclips()) == []
+        for released in (lambda: xmeml.getclip('clipitem-1'), lambda: xmeml.linkgroup('clipitem-5'),
+                         lambda: xmeml.markers, lambda: list(xmeml.iteraudioclips(start=0))):
+            with pytest.raises(xmemliter.XmemlError):
+                released()
+    assert xmeml.closed and xmeml.tree is None and xmeml.filelist == {}
+    for closed in (lambda: list(xmeml.itervideoclips()), lambda: list(xmeml.itersequences()),
+                   lambda: xmeml.sequencedefinitions):
+        with pytest.raises(xmemliter.XmemlError):
+            closed()
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    # the scan also has the clips holding nested sequences, which are not in the index
+    assert xmeml._scanvideolinks() & set(xmeml.index.byid) == \
+        {clipid for clipid, group in xmeml.linkgraph.groups.items() if group.hasvideo}
+    # the clips outlive the parser
+    assert clips[0].file.pathurl is not None
+    with xmemliter.XmemlParser(SAMPLE) as xmeml:
+        ranges = xmeml.audibleranges(release=True)[0]
+    assert {name: [r.get() for r in rs] for name, rs in ranges.items()} == \
+        {name: [r.get() for r in rs] for name, rs in expectedranges.items()}
+
+def test_clipfilter(monkeypatch, tmpdir):
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    built = []
+    init = xmemliter.ClipItem.__init__
+    def counting(self, tree, *args, **kwargs):
+        built.append(tree.get('id'))
+        init(self, tree, *args, **kwargs)
+    monkeypatch.setattr(xmemliter.ClipItem, '__init__', counting)
+    music = xmemliter.ClipFilter(tracks=range(2, 4), pathurl=r'/library/music/')
+    assert [c.id for c in xmeml.iteraudioclips(where=music)] == ['clipitem-5', 'clipitem-12', 'clipitem-11']
+    # the clips on other tracks and of other files are never built
+    assert 'clipitem-4' not in built and 'clipitem-6' not in built
+    del built[:]
+    assert [c.id for c in xmeml.itervideoclips(where=xmemliter.ClipFilter(name='^broll'))] == \
+        ['clipitem-2', 'clipitem-9']
+    assert 'clipitem-1' not in built
+    # nested clips are matched by their own file, and the track of their parent
+    assert [c.id for c in xmeml.itervideoclips(where=xmemliter.ClipFilter(fileid='file-1'))] == ['clipitem-1']
+    assert len(list(xmeml.itervideoclips(where=xmemliter.ClipFilter(mediatype='video', tracks=[2])))) == 2
+    assert list(xmeml.itervideoclips(where=xmemliter.ClipFilter(mediatype='audio'))) == []
+    ranges = xmeml.audibleranges(where=music)[0]
+    assert sorted(ranges) == ['jingle.wav', 'music.wav']
+    # disabled clips only
+    _file = '<file id="file-1"><name>a.wav</name><media><audio/></media></file>'
+    clips = [_clipitem('a1', 0, 50, 0, 50, _file), _clipitem('a2', 50, 100, 0, 50, '<enabled>FALSE</enabled><file id="file-1"/>')]
+    tmpdir.join('disabled.xml').write('<xmeml version="4">{}</xmeml>'.format(_sequence('seq', clips, 'audio')))
+    disabled = xmemliter.XmemlParser(str(tmpdir.join('disabled.xml')))
+    assert [c.id for c in disabled.iteraudioclips(where=xmemliter.ClipFilter(enabled=False))] == ['a2']
+    assert [c.id for c in disabled.iteraudioclips(where=xmemliter.ClipFilter(enabled=True))] == ['a1']
+    assert [c.id for c in disabled.iteraudioclips(where=xmemliter.ClipFilter(enabled=False), start=0)] == ['a2']
+    assert list(disabled.audibleranges(where=xmemliter.ClipFilter(enabled=False), workers=2)[0]) == ['a2']
+    assert [r.get() for r in ranges['music.wav']] == [r.get() for r in xmeml.audibleranges()[0]['music.wav']]
+    # linked stereo music: the links are read from the xml, not from a ClipItem of every clip
+    tree = xmemliter.etree.parse(SAMPLE)
+    for clipid in ('clipitem-5', 'clipitem-12'):
+        clip = tree.find('.//clipitem[@id="{}"]'.format(clipid))
+        for ref in ('clipitem-5', 'clipitem-12'):
+            link = xmemliter.etree.SubElement(clip, 'link')
+            xmemliter.etree.SubElement(link, 'linkclipref').text = ref
+            xmemliter.etree.SubElement(link, 'mediatype').text = 'audio'
+    tree.write(str(tmpdir.join('linked.xml')))
+    linked = xmemliter.XmemlParser(str(tmpdir.join('linked.xml')))
+    del built[:]
+    assert [c.id for c in linked.iteraudioclips(where=music)] == ['clipitem-5', 'clipitem-12', 'clipitem-11']
+    # clipitem-8 holds the nested sequence with clipitem-11
+    assert sorted(built) == ['clipitem-11', 'clipitem-12', 'clipitem-5', 'clipitem-8']
+    assert linked._linkgraph is None and linked._index is None
+
+def test_windows():
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    def summary(clips):
+        return [(c.id, c.start, c.end, c.inpoint, c.outpoint) for c in clips]
+    assert summary(xmeml.itervideoclips(start=90, end=160)) == \
+        [('clipitem-1', 90, 100, 290, 300), ('clipitem-2', 100, 160, 0, 60), ('clipitem-10', 150, 160, 10, 20)]
+    assert summary(xmeml.iteraudioclips(start=350)) == [('clipitem-12', 350, 400, 450, 500)]
+    assert summary(xmeml.iteraudioclips(end=10)) == [('clipitem-5', 0, 10, 0, 10)]
+    assert list(xmeml.iteraudioclips(start=200, end=300)) == []
+    # the index is built once, and clips within the window are not copied
+    index = xmeml._windows['audio', True]
+    clip = list(xmeml.iteraudioclips(start=0, end=1000))[0]
+    assert any(clip is c for c in xmeml._windows['audio', True].window(0, 1))
+    assert xmeml._windows['audio', True] is index
+    ranges = xmeml.audibleranges(start=100, end=350)[0]
+    assert {name: [r.get() for r in rs] for name, rs in ranges.items()} == \
+        {'music.wav': [(100, 150), (300, 350)], 'jingle.wav': [(160, 200)]}
+    parallel = xmeml.audibleranges(start=100, end=350, workers=2)[0]
+    assert {name: [r.get() for r in rs] for name, rs in parallel.items()} == \
+        {name: [r.get() for r in rs] for name, rs in ranges.items()}
+    music = xmemliter.ClipFilter(name='^music')
+    assert list(xmeml.audibleranges(start=100, end=350, where=music)[0]) == ['music.wav']
+    with pytest.raises(xmemliter.XmemlError):
+        list(xmeml.itervideoclips(release=True, start=0))
+
+def test_iteraudibleranges():
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    expected = {name: [r.get() for r in rs] for name, rs in xmeml.audibleranges()[0].items()}
+    stream = xmeml.iteraudibleranges()
+    clip, _file, ranges = next(stream)
+    assert (clip.id, _file.id, [r.get() for r in ranges]) == ('clipitem-5', clip.file.id, [(0, 150)])
+    assert [c.id for c, f, r in stream] == ['clipitem-12', 'clipitem-11']
+    # a name is merged and returned after its last clip
+    grouped = [(name, [r.get() for r in rs]) for name, f, rs in xmeml.iteraudibleranges(grouped=True)]
+    assert grouped == [('music.wav', expected['music.wav']), ('jingle.wav', expected['jingle.wav'])]
+    assert xmeml._countaudionames() == {'interview.mov': 1, 'music.wav': 2, 'sync.wav': 1, 'jingle.wav': 1}
+    grouped = xmeml.iteraudibleranges(grouped=True, start=100, end=350)
+    assert [(name, [r.get() for r in rs]) for name, f, rs in grouped] == \
+        [('music.wav', [(100, 150), (300, 350)]), ('jingle.wav', [(160, 200)])]
+
+def _plainranges(result):
+    clips, files = result
+    return ({name: [r.get() for r in ranges] for name, ranges in clips.items()},
+            {name: f and f.id for name, f in files.items()})
+
+@pytest.mark.parametrize('kwargs', [{}, {'release': True}, {'start': 100, 'end': 350},
+                                    {'where': xmemliter.ClipFilter(name='^music')}])
+def test_parallelaudibleranges(kwargs):
+    serial = xmemliter.XmemlParser(SAMPLE).audibleranges(**kwargs)
+    parallel = xmemliter.XmemlParser(SAMPLE).audibleranges(workers=3, **kwargs)
+    assert _plainranges(parallel) == _plainranges(serial)
+    assert list(parallel[0]) == list(serial[0])
+    assert all(parallel[0][name].framerate == serial[0][name].framerate for name in serial[0])
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    assert xmemliter.audibleframes(xmeml.getclip('clipitem-4').audiopayload()).r == \
+        xmeml.getclip('clipitem-4').audibleframes().r
+
+@pytest.mark.parametrize('kwargs', [{}, {'release': True}, {'start': 100, 'end': 350},
+                                    {'where': xmemliter.ClipFilter(name='^music')}])
+def test_processaudibleranges(kwargs):
+    serial = xmemliter.XmemlParser(SAMPLE).audibleranges(**kwargs)
+    # the workers parse the file again by its name
+    parallel = xmemliter.XmemlParser(SAMPLE).audibleranges(workers=2, processes=True, **kwargs)
+    assert _plainranges(parallel) == _plainranges(serial)
+    assert list(parallel[0]) == list(serial[0])
+    # a file object can't be parsed again, so the workers get the AudioPayloads
+    with open(SAMPLE, 'rb') as f:
+        xmeml = xmemliter.XmemlParser(f)
+    assert xmeml.filename is None
+    parallel = xmeml.audibleranges(workers=2, processes=True, **kwargs)
+    assert _plainranges(parallel) == _plainranges(serial)
+    assert list(parallel[0]) == list(serial[0])
+
+@pytest.mark.parametrize('useinotify', [True, False])
+def test_watcher(tmpdir, useinotify):
+    import json
+    from xmeml import watch
+    folder = tmpdir.mkdir('exports')
+    folder.join('old.xml').write_binary(open(SAMPLE, 'rb').read())
+    folder.join('notes.txt').write('not xmeml')
+    sink = watch.JsonLinesSink(str(tmpdir.join('results.jsonl')))
+    def records():
+        return [json.loads(line) for line in tmpdir.join('results.jsonl').readlines()]
+    def settle(watcher, count):
+        for _ in range(50):
+            if watcher.step(timeout=0.05):
+                count -= 1
+            if count == 0:
+                break
+        watcher.drain()
+    with watch.Watcher(str(folder), sink, workers=2, settle=0.05, interval=0.05,
+                       useinotify=useinotify) as watcher:
+        assert useinotify or watcher.inotify is None
+        settle(watcher, 1)
+        assert [os.path.basename(r['path']) for r in records()] == ['old.xml']
+        report = records()[0]['result'][0]
+        assert report['sequence'] == 'sequence-1'
+        assert {c['name']: c['ranges'] for c in report['clips']}['music.wav'] == [[0, 150], [300, 400]]
+        # a copy is skipped by its digest, a broken file is reported, and nothing is read twice
+        folder.join('copy.xml').write_binary(open(SAMPLE, 'rb').read())
+        folder.join('broken.xml').write('<xmeml><sequence>')
+        settle(watcher, 2)
+        assert [os.path.basename(r['path']) for r in records()] == ['old.xml', 'broken.xml']
+        assert 'error' in records()[1]
+        assert watcher.step(timeout=0.05) == 0
+        # a changed file is analyzed again
+        folder.join('copy.xml').write_binary(open(SAMPLE, 'rb').read().replace(b'Intro', b'Opening'))
+        settle(watcher, 1)
+        assert [os.path.basename(r['path']) for r in records()][-1] == 'copy.xml'
+        metrics = watcher.metrics.summary()
+        assert (metrics['seen'], metrics['processed'], metrics['skipped'], metrics['failed']) == (4, 2, 1, 1)
+        assert metrics['latency_max'] >= metrics['latency_median'] > 0
+
+def test_watcheroverflow(tmpdir):
+    from xmeml import watch
+    folder = tmpdir.mkdir('exports')
+    records = []
+    with watch.Watcher(str(folder), records.append, settle=0, existing=False) as watcher:
+        if watcher.inotify is None:
+            pytest.skip('inotify is not available')
+        # the events of this file are lost in an overflow of the kernel queue
+        os.close(watcher.inotify.fd)
+        watcher.inotify.fd, events = os.pipe()
+        folder.join('lost.xml').write_binary(open(SAMPLE, 'rb').read())
+        os.write(events, watch._EVENT.pack(-1, watch.IN_Q_OVERFLOW, 0, 0))
+        assert watcher.step(timeout=1) == 1
+        assert not watcher.inotify.overflowed
+        watcher.drain()
+        os.close(events)
+    assert [os.path.basename(r['path']) for r in records] == ['lost.xml']
+
+def test_watcherbounds(tmpdir):
+    from xmeml import watch
+    metrics = watch.WatcherMetrics(window=3)
+    for latency in (5.0, 1.0, 2.0, 3.0, 4.0):
+        metrics.add('processed', latency)
+    summary = metrics.summary()
+    assert len(metrics.latencies) == 3
+    assert (summary['latency_mean'], summary['latency_median'], summary['latency_max']) == (3.0, 3.0, 5.0)
+    folder = tmpdir.mkdir('exports')
+    data = open(SAMPLE, 'rb').read()
+    for n in range(4):
+        folder.join('export{}.xml'.format(n)).write_binary(data + '<!-- {} -->'.format(n).encode('utf-8'))
+    with watch.Watcher(str(folder), lambda record: None, settle=0, useinotify=False, history=2) as watcher:
+        assert watcher.step(timeout=0) == 4
+        watcher.drain()
+        assert len(watcher.digests) == 2
+
+def test_watcher_parallel(tmpdir):
+    from xmeml import watch
+    folder = tmpdir.mkdir('exports')
+    data = open(SAMPLE, 'rb').read()
+    for n in range(40):
+        # different content, so no file is skipped by its digest
+        folder.join('export{}.xml'.format(n)).write_binary(data + '<!-- {} -->'.format(n).encode('utf-8'))
+    expected = watch.analyze(SAMPLE)
+    records = []
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with watch.Watcher(str(folder), records.append, workers=4, settle=0, useinotify=False) as watcher:
+            assert watcher.step(timeout=0) == 40
+            watcher.drain()
+    finally:
+        sys.setswitchinterval(interval)
+    assert len(records) == 40
+    assert all(r['result'] == expected for r in records)
+
+def test_service(tmpdir):
+    from xmeml import service
+    path = str(tmpdir.join('xmeml.sock'))
+    with open(SAMPLE) as f:
+        xml = f.read()
+    with service.AnalysisService(path, workers=2, pipeline=2, cachesize=4) as server:
+        server.start()
+        with service.ServiceClient(path, timeout=10) as client:
+            assert client.request(analysis='ping')['result'] == 'pong'
+            first = client.request(path=SAMPLE)
+            assert first['ok'] and not first['cached'] and first['id'] == 2
+            assert first['result'] == [xmemliter.XmemlParser(SAMPLE).audiblereport()]
+            assert client.request(path=SAMPLE)['cached']
+            # more requests than the pipeline depth, answered in order
+            requests = [dict(xml=xml, analysis='clips'), dict(path=SAMPLE, analysis='fingerprint'),
+                        dict(path=str(tmpdir.join('missing.xml'))), dict(xml=xml, analysis='nothing'),
+                        dict(xml=xml, analysis='report', threshold=0.9)]
+            responses = client.pipeline(requests)
+            assert [r['id'] for r in responses] == [4, 5, 6, 7, 8]
+            assert [r['ok'] for r in responses] == [True, True, False, False, True]
+            assert [r['sequence'] for r in responses[0]['result']] == \
+                [seq.id for seq in xmemliter.XmemlParser(SAMPLE).itersequences()]
+            assert responses[0]['result'][0]['clips'][0]['id'] == 'clipitem-1'
+            assert responses[1]['result']['sequence'] == xmemliter.XmemlParser(SAMPLE).fingerprint().sequence
+            assert 'FileNotFoundError' in responses[2]['error'] or 'OSError' in responses[2]['error']
+        # another client shares the cache
+        with service.ServiceClient(path, timeout=10) as client:
+            assert client.request(xml=xml, analysis='clips')['cached']
+    assert not os.path.exists(path)
+    # closing a service that never served doesn't wait for it
+    with service.AnalysisService(path) as server:
+        assert server.answer({'analysis': 'ping'})['result'] == 'pong'
+    assert not os.path.exists(path)
+
+def test_servicesocket(tmpdir):
+    import socket
+    from xmeml import service
+    path = str(tmpdir.join('xmeml.sock'))
+    # a file that is not a socket is never removed
+    tmpdir.join('xmeml.sock').write('notes')
+    with pytest.raises(service.ServiceError):
+        service.AnalysisService(path)
+    assert tmpdir.join('xmeml.sock').read() == 'notes'
+    os.unlink(path)
+    # nor is the socket of a running service
+    with service.AnalysisService(path) as server:
+        server.start()
+        with pytest.raises(service.ServiceError):
+            service.AnalysisService(path)
+        with service.ServiceClient(path, timeout=10) as client:
+            assert client.request(analysis='ping')['result'] == 'pong'
+    # a socket nobody listens on is stale, and replaced
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = service.AnalysisService(path)
+    # close() leaves a socket it didn't make alone
+    os.unlink(path)
+    other = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    other.bind(path)
+    server.close()
+    assert os.path.exists(path)
+    other.close()
+
+def test_serviceclipswithouttrack(monkeypatch):
+    from lxml import etree
+    from xmeml import service
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    # a clip outside of a track has no tracktype
+    loose = xmemliter.ClipItem(etree.fromstring(_clipitem('loose', 0, 50, 0, 50, '')), None)
+    assert loose.tracktype is None
+    monkeypatch.setattr(xmemliter.XmemlSequence, 'itervideoclips', lambda self: iter([loose]))
+    result = service.ANALYSES['clips'](xmeml, {})
+    assert result[0]['clips'][0]['track'] == '?'
+
+def test_service_concurrentclients(tmpdir):
+    import threading
+    from xmeml import service
+    path = str(tmpdir.join('xmeml.sock'))
+    with open(SAMPLE) as f:
+        xml = f.read()
+    expected = service.ANALYSES['clips'](xmemliter.XmemlParser(SAMPLE), {})
+    results = []
+    def client(n):
+        with service.ServiceClient(path, timeout=30) as c:
+            # a different document every time, so nothing comes from the cache
+            requests = [dict(xml=xml + '<!-- {} {} -->'.format(n, i), analysis='clips') for i in range(30)]
+            results.extend(c.pipeline(requests))
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with service.AnalysisService(path, workers=4, pipeline=8) as server:
+            server.start()
+            threads = [threading.Thread(target=client, args=(n,)) for n in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert len(results) == 120
+    assert all(r['ok'] and not r['cached'] for r in results)
+    assert all(r['result'] == expected for r in results)
+
+def test_visiblesegments(tmpdir):
+    xmeml = xmemliter.XmemlParser(SAMPLE)
+    segments = [(start, end, clip.id) for start, end, clip in xmeml.visiblesegments()]
+    # V2 has the nested sequence-2 over V1, and nothing is on screen at 200-300
+    assert segments == [(0, 100, 'clipitem-1'), (100, 150, 'clipitem-2'), (150, 190, 'clipitem-10'),
+                        (190, 200, 'clipitem-2'), (300, 400, 'clipitem-9'), (420, 440, 'clipitem-10')]
+    assert xmeml.visiblesegments()[2][2].layers == (2, 1)
+    _file = '<file id="file-1"><name>a.mov</name><media><video/></media></file>'
+    opacity = ('<filter><effect><name>Opacity</name><effectid>opacity</effectid>'
+               '<parameter><parameterid>opacity</parameterid><value>{}</value></parameter></effect></filter>')
+    tracks = [
+        [_clipitem('bottom', 0, 100, 0, 100, _file)],
+        [_clipitem('hidden', 10, 30, 0, 20, _file + opacity.format(0)),
+         _clipitem('half', 40, 60, 0, 20, _file + opacity.format(50)),
+         _clipitem('disabled', 70, 80, 0, 10, _file + '<enabled>FALSE</enabled>')],
+        [_clipitem('offtrack', 0, 100, 0, 100, _file)],
+    ]
+    xml = '<xmeml version="4"><sequence id="s"><rate><timebase>25</timebase></rate><media><video>{}</video></media></sequence></xmeml>'.format(
+        ''.join('<track>{}{}</track>'.format(''.join(clips), '<enabled>FALSE</enabled>' if n == 2 else '')
+                for n, clips in enumerate(tracks)))
+    tmpdir.join('layers.xml').write(xml)
+    segments = xmemliter.XmemlParser(str(tmpdir.join('layers.xml'))).visiblesegments()
+    assert [(start, end, clip.id) for start, end, clip in segments] == [
+        (0, 40, 'bottom'), (40, 60, 'half'), (60, 100, 'bottom')]
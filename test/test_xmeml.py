@@ -0,0 +1,139 @@
+# encoding: utf-8
+# tests of the VideoSequence api
+
+import os
+
+import lxml.etree as etree
+
+from xmeml import VideoSequence # remember to run this test with amended python path, like this
+# PYTHONPATH=. py.test test
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'xmemlfiles', 'sample.xml')
+
+def test_parse():
+    v = VideoSequence(file=SAMPLE)
+    assert v.id == 'sequence-1'
+    assert v.rate == 25.0
+    assert v.timecode_zero == 900000
+    assert [t.type for t in v.tracks][:2] == ['video', 'video']
+    items = dict((t.id, t) for t in v.track_items if t.type == 'clipitem')
+    assert items['clipitem-5'].file.pathurl == 'file://localhost/library/music/music.wav'
+    assert items['clipitem-5'].file.mediatype == 'audio'
+    # parsed views are built lazily
+    assert items['clipitem-4']._parsed is None
+    assert items['clipitem-4'].getfilter('audiolevels') == [('200', '1'), ('240', '0.00001'), ('270', '1')]
+    assert items['clipitem-4'].parsed['name'] == 'interview.mov'
+
+def test_parse_string():
+    with open(SAMPLE, 'rb') as f:
+        v = VideoSequence(xml_string=f.read())
+    assert len(v.track_items) == 14
+
+def test_clips2dom():
+    v = VideoSequence(file=SAMPLE)
+    clip1 = v.clip(0, 150, units='frames')
+    clip2 = v.clip(12, 16, units='seconds')
+    assert clip2.start_frame == 300
+    xmldom, newuuid = v.clips2dom([clip1, clip2])
+    doc = etree.fromstring(xmldom.toxml().encode('utf-8'))
+    seq = doc.find('sequence')
+    assert seq.findtext('uuid') == newuuid
+    assert seq.findtext('duration') == str(150 + 100)
+    ids = [c.get('id') for c in seq.iter('clipitem')]
+    assert ids.count('clipitem-5') == 1
+    assert ids.count('clipitem-12') == 1
+    # each file is defined once, and referenced after that
+    music = [f for f in seq.iter('file') if f.get('id') == 'file-2']
+    assert len(music) == 2
+    assert music[0].findtext('pathurl') == 'file://localhost/library/music/music.wav'
+    assert len(music[1]) == 0
+
+def test_keyedarray():
+    from copy import deepcopy
+    from xmeml import KeyedArray
+    ka = KeyedArray([('name', 'a'), ('filter', 'f1'), ('file', ['file-1']), ('filter', 'f2')])
+    assert ka['filter'] == 'f2'
+    assert ka.getall('filter') == ['f1', 'f2']
+    assert ka.getall('nothing') == []
+    assert list(ka.items()) == [('name', 'a'), ('filter', 'f1'), ('file', ['file-1']), ('filter', 'f2')]
+    assert len(ka) == 4 and 'file' in ka
+    ka.update({'name': 'b', 'filter': 'f3', 'in': 0})
+    assert list(ka.items()) == [('name', 'b'), ('filter', 'f3'), ('file', ['file-1']), ('in', 0)]
+    del ka['name']
+    assert list(ka.keys()) == ['filter', 'file', 'in']
+    assert ka.get('name') is None
+    nested = KeyedArray([('effect', ka)])
+    copied = deepcopy(nested)
+    copied['effect']['file'].append('x')
+    copied['effect'].update({'in': 10})
+    assert ka['file'] == ['file-1'] and ka['in'] == 0
+    assert copied['effect']['in'] == 10
+
+def test_writeclips(tmpdir):
+    v = VideoSequence(file=SAMPLE)
+    clips = [v.clip(300, 400, units='frames'), v.clip(0, 100, units='frames'), v.clip(300, 400, units='frames')]
+    out = tmpdir.join('compilation.xml')
+    newuuid = v.writeclips(clips, str(out))
+    doc = etree.parse(str(out)).getroot()
+    seq = doc.find('sequence')
+    assert [el.tag for el in seq][:3] == ['uuid', 'out', 'duration']
+    assert seq.findtext('uuid') == newuuid
+    assert seq.findtext('in') == '0'
+    # the source tracks are kept, and clips are laid out after each other
+    videotracks = seq.findall('media/video/track')
+    assert len(videotracks) == 2
+    assert [(c.get('id'), c.findtext('start')) for c in videotracks[0].findall('clipitem')] == [
+        ('clipitem-1', '0'), ('clipitem-9', '0'),
+        ('clipitem-1', '100'), ('clipitem-2', '100'),
+        ('clipitem-1', '200'), ('clipitem-9', '200')]
+    assert videotracks[0].findtext('enabled') == 'TRUE'
+    # the <file> is defined once, and referenced after that
+    broll = [f for f in seq.iter('file') if f.get('id') == 'file-3']
+    assert [len(f) > 0 for f in broll] == [True, False, False]
+    # the output is the same as clips2dom builds in memory
+    xmldom, _ = v.clips2dom(clips)
+    assert len(list(xmldom.iter('clipitem'))) == len(list(seq.iter('clipitem')))
+
+def test_clip_index():
+    v = VideoSequence(file=SAMPLE)
+    windows = [(0, 50), (300, 400), (120, 130), (460, 600), (150, 150)]
+    def scan(b, e): # the plain scan over all items
+        c = {'start_frame': b, 'end_frame': e}
+        return [t for t in v.track_items if t.splice_match(c)]
+    for b, e in windows:
+        assert v.clip(b, e, units='frames').track_items == scan(b, e)
+    batch = v.clips(windows, units='frames')
+    assert [(c.start_frame, c.end_frame) for c in batch] == windows
+    assert [c.track_items for c in batch] == [scan(b, e) for b, e in windows]
+
+def test_trackitem_neighbours():
+    v = VideoSequence(file=SAMPLE)
+    track = v.tracks[0]
+    assert [t.position for t in track.clips] == list(range(len(track.clips)))
+    assert track.clips[1].prev is track.clips[0] and track.clips[1].next is track.clips[2]
+    interview, transition, broll = track.clips[:3]
+    # -1 frames are resolved from the neighbouring transition
+    assert interview.end() == 110 and interview.transitions['following'] is transition
+    assert broll.start() == 90 and broll.transitions['preceeding'] is transition
+    assert broll._start == 90 # cached
+    assert interview.start() == 0 and broll.end() == 200
+
+def test_frame_timecode():
+    v = VideoSequence(file=SAMPLE)
+    # the sequence starts at 10:00:00:00
+    assert v.frame('10:00:12:00', units='timecode') == 300
+    assert v.clip('10:00:12:00', '10:00:16:00', units='timecode').start_frame == 300
+    assert v.timecode.format(300) == '10:00:12:00'
+
+def test_exactrates():
+    from fractions import Fraction
+    v = VideoSequence(file=SAMPLE)
+    assert isinstance(v.rate, Fraction) and v.rate == 25
+    assert v.frame(0.1, units='seconds') == 2 # 2.5 frames, rounded to even
+    items = dict((t.id, t) for t in v.track_items if t.type == 'clipitem')
+    assert (items['clipitem-5'].timebase, items['clipitem-5'].rate) == (25, Fraction(25))
+    with open(SAMPLE) as f:
+        ntsc = f.read().replace('<timebase>25</timebase>', '<timebase>30</timebase><ntsc>TRUE</ntsc>', 1)
+    v = VideoSequence(xml_string=ntsc.encode('utf-8'))
+    assert v.rate == Fraction(30000, 1001)
+    assert v.frame(1001, units='seconds') == 30000
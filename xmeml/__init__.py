@@ -1,7 +1,14 @@
 #-*- encoding:utf8 -*-
-import xml.dom.minidom as dom
+from builtins import str  # be py2+py3 proof. pip install future
+import lxml.etree as etree
 from uuid import uuid1
 from copy import deepcopy
+from io import BytesIO
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
+
+from .iter import getframerate, toframe
+from .timecode import TimecodeFormat
 
 """
 from xmeml import VideoSequence
@@ -26,47 +33,62 @@ print xmldom2.toxml()
 ####
 
 ###XML methods for stupid-XML structures like <clipitem> and <file>
+
+class XmemlElement(etree.ElementBase):
+    "lxml element with the serialization methods of the old minidom api"
+    def toxml(self, encoding=None):
+        if encoding is None:
+            return u'<?xml version="1.0" ?>' + etree.tostring(self, encoding='unicode')
+        return etree.tostring(self, encoding=encoding, xml_declaration=True)
+
+    def toprettyxml(self, indent='\t', encoding=None):
+        _copy = deepcopy(self)
+        etree.indent(_copy, space=indent)
+        return _copy.toxml(encoding)
+
+# parser and element factory for new xmeml documents, see dict2xml
+xmemlparser = etree.XMLParser()
+xmemlparser.set_element_class_lookup(
+    etree.ElementDefaultClassLookup(element=XmemlElement))
+
 def xmltextkey(domnode, key):
     "xmltextkey(domnode, 'foo') for <domnode><foo>bar</foo></domnode> will yield u'bar' "
-    try:
-        return getFirstChild(domnode, key).firstChild.data
-    except:
+    if domnode is None:
         return None
+    return domnode.findtext(key)
 
 def xml2dict(domnode, go_deep=False, drop=tuple()):
     "only works for trees without attributes except @id which then drops children"
-    if not go_deep and hasattr(domnode,'getAttribute') \
-            and domnode.getAttribute('id'):
-        return [ domnode.getAttribute('id') ]
-    elif domnode.childNodes.length == 1 and domnode.firstChild.nodeType==3:
-        return domnode.firstChild.data #textnode with data
-    elif domnode.childNodes.length == 0:
-        return None
+    if not go_deep and domnode.get('id'):
+        return [ domnode.get('id') ]
+    elif len(domnode) == 0:
+        return domnode.text #textnode with data, or None
     else: #tree
         #see bottom of file for KeyedArray
-        return KeyedArray([( n.tagName, xml2dict(n, drop=drop) ) 
-                     for n in domnode.childNodes 
-                     if (n.nodeType==1 and n.tagName not in drop)])
-    
+        return KeyedArray([( n.tag, xml2dict(n, drop=drop) )
+                     for n in domnode.iterchildren(tag=etree.Element)
+                     if n.tag not in drop])
+
 def dict2xml(dic, doc, parentTag):
-    "only works for trees without attributes except @id which then drops children"
-    p = doc.createElement(parentTag)
+    """only works for trees without attributes except @id which then drops children
+
+    doc is the element factory, e.g. xmemlparser or an element of the new document"""
+    p = doc.makeelement(parentTag)
     if isinstance(dic, list):
-        p.setAttribute('id',dic[0]) 
+        p.set('id',dic[0])
     elif isinstance(dic, dict) or isinstance(dic,KeyedArray):
         for k,v in dic.items():
             if v is not None:
-                p.appendChild(dict2xml(v, doc, k))
+                p.append(dict2xml(v, doc, k))
     else: #string or unicode
-        p.appendChild(doc.createTextNode(unicode(dic)))
+        p.text = str(dic)
     return p
 
 def getFirstChild(dom, tagname):
     "Get the first child element whose name matches 'tagname'"
-    for n in dom.childNodes:
-        if n.nodeType == n.ELEMENT_NODE and n.tagName == tagname:
-            return n
-    return None
+    if dom is None:
+        return None
+    return dom.find(tagname)
 
 
 ## XMEML objects
@@ -93,8 +115,8 @@ class Track(object):
     def __init__(self,dom=None,source=None):
         self.clips = []
 
-        if dom:
-            self.type = dom.parentNode.tagName #audio/video
+        if dom is not None:
+            self.type = dom.getparent().tag #audio/video
             self.children = {
                 'enabled':xmltextkey(dom, 'enabled'),
                 'locked':xmltextkey(dom, 'locked'),
@@ -117,55 +139,93 @@ class TrackItem(object):
         self.transitions = {'preceeding':None,
                            'following':None}
         self.track = track
+        # place in track.clips, and the neighbouring items. Set by VideoSequence.parse
+        self.position = None
+        self.prev = self.next = None
+        self._start = self._end = None # resolved start() and end()
         self.source_files = source_files
-        self.mediatype = track.type
-        if source and inout and not dom:
+        self.mediatype = track.type if track else None
+        self.dom = None
+        self._parsed = None
+        self._filters = None
+        if source and inout and dom is None:
             self.source = source
-        elif dom:
+        elif dom is not None:
             self.parse(dom)
         else:
-            raise Error('TrackItem init arguments must be [dom] xor [source, inout]')
+            raise ValueError('TrackItem init arguments must be [dom] xor [source, inout]')
+
+    @property
+    def parsed(self):
+        "the <clipitem> as a KeyedArray, built from the dom on first access"
+        if self._parsed is None and self.dom is not None:
+            self._parsed = xml2dict(self.dom, go_deep=True)
+        return self._parsed
+
+    @parsed.setter
+    def parsed(self, value):
+        self._parsed = value
+
+    @property
+    def filters(self):
+        if self._filters is None:
+            if self.type != 'clipitem':
+                return []
+            self._filters = [ItemFilter(f) for f in self.parsed.getall('filter')]
+        return self._filters
 
     def parse(self, dom):
-        self.parsed = xml2dict(dom, go_deep=True)
-        self.type = dom.tagName
+        self.dom = dom
+        self.type = dom.tag
         if self.type not in ('transitionitem','clipitem'):
-            raise Error('track item only supports clipitem and transitionitem and not %s'
+            raise ValueError('track item only supports clipitem and transitionitem and not %s'
                         % self.type)
-        self.id=(dom.getAttribute('id') or None) #only for clipitem
-        self.start_frame = int(self.parsed['start'])
-        self.end_frame = int(self.parsed['end'])
+        self.id=(dom.get('id') or None) #only for clipitem
+        self.start_frame = int(dom.findtext('start'))
+        self.end_frame = int(dom.findtext('end'))
         rate = getFirstChild(dom, 'rate')
         self.ntsc = xmltextkey(rate, 'ntsc') == u'TRUE'
-        self.timebase = float(xmltextkey(rate, 'timebase'))
+        self.timebase = toframe(xmltextkey(rate, 'timebase'))
+        self.rate = getframerate(self.timebase, self.ntsc)[0] # exact, as a Fraction
         if self.type=='clipitem':
-            self.name = self.parsed.get('name',None)
-            self.in_frame = int(self.parsed.get('in',-1))
-            self.out_frame = int(self.parsed.get('out',-1))
+            self.name = dom.findtext('name')
+            self.in_frame = int(dom.findtext('in', -1))
+            self.out_frame = int(dom.findtext('out', -1))
             self.duration = self.out_frame - self.in_frame
             firstfile = getFirstChild(dom, 'file')
-            file_id = firstfile and firstfile.getAttribute('id')
-            if file_id and self.source_files.has_key(file_id):
+            file_id = firstfile.get('id') if firstfile is not None else None
+            if file_id and file_id in self.source_files:
                 self.file = self.source_files[file_id]
             else:
                 self.file = XmemlFileRef(firstfile)
-            self.filters = [ItemFilter(f) for (k, f) in self.parsed.items() if k == 'filter']
-           
+
     def start(self):
         if self.start_frame != -1:
             return self.start_frame
-        else:
-            t = self.track.clips[self.track.clips.index(self)-1]
+        elif self._start is None:
+            if self.position is None: # not linked to its neighbours
+                t = self.track.clips[self.track.clips.index(self)-1]
+            else:
+                t = self.prev
+            if t is None:
+                return self.start_frame
             self.transitions['preceeding'] = t
-            return t.start_frame
+            self._start = t.start_frame
+        return self._start
 
     def end(self):
         if self.end_frame != -1:
             return self.end_frame
-        else:
-            t = self.track.clips[self.track.clips.index(self)+1]
+        elif self._end is None:
+            if self.position is None: # not linked to its neighbours
+                t = self.track.clips[self.track.clips.index(self)+1]
+            else:
+                t = self.next
+            if t is None:
+                return self.end_frame
             self.transitions['following'] = t
-            return t.end_frame
+            self._end = t.end_frame
+        return self._end
 
     def getfilter(self, filtername):
         for f in self.filters:
@@ -202,26 +262,33 @@ class TrackItem(object):
                      )
                  ]
 
+    def cliptiming(self, clip, start=0):
+        "returns the <start>, <end>, <in>, <out> and <duration> of this item laid out at start"
+        duration = clip['end_frame']-clip['start_frame']
+        in_frame, out_frame = self.clipitem_splice(self,clip)
+        return {
+                'start':start,
+                'end':start+duration,
+                'in':in_frame,
+                'out':out_frame,
+                'duration':duration,
+                }
+
     def clip(self, clip, start=0):
         ti = TrackItem(source=self, inout=clip)
         #TODO: a lot of this should be in the __init__
         ti.parsed = deepcopy(self.parsed)
-        ti.start_frame = start
-        ti.duration = clip['end_frame']-clip['start_frame']
-        ti.end_frame = start+ti.duration
-        ti.in_frame, ti.out_frame = self.clipitem_splice(self,clip)
+        timing = self.cliptiming(clip, start)
+        ti.start_frame = timing['start']
+        ti.duration = timing['duration']
+        ti.end_frame = timing['end']
+        ti.in_frame, ti.out_frame = timing['in'], timing['out']
 
         ti.type = self.type
         ti.track = Track(source=self.track)
         ti.id = self.id
 
-        ti.parsed.update({
-                'start':ti.start_frame,
-                'end':ti.end_frame,
-                'in':ti.in_frame,
-                'out':ti.out_frame,
-                'duration':ti.duration,
-                })
+        ti.parsed.update(timing)
         return ti
     
     def transitionitem_splice_movein(self, source, clip):
@@ -247,7 +314,7 @@ class TrackItem(object):
             threshold = threshold.gain
         f = []
         audiolevels = self.getfilter('audiolevels')
-        if isinstance(audiolevels, basestring): # single value = single level for whole clip
+        if isinstance(audiolevels, str): # single value = single level for whole clip
             if(float(audiolevels) > threshold):
                 return [(self.start(), self.end()),]
         else: # audiolevels is a list of (keyframe, level) tuples
@@ -272,48 +339,58 @@ class TrackItem(object):
         _f = {}
         for _e in f:
             _f[_e] = 1
-        ff = _f.keys()
-        ff.sort()
-        return ff
+        return sorted(_f)
 
 class XmemlFileRef(object):
     """object representation of <file> in <xmeml>"""
     def __init__(self, dom=None, ):
         self.mediatype = None
-        if dom:
-            self.id = dom.getAttribute('id')
+        self.dom = dom
+        self._parsed = None
+        if dom is not None:
+            self.id = dom.get('id')
             self.source = 'dom'
-
-            self.parsed = xml2dict(dom, go_deep=True)
-            if not self.parsed: return # empty node
+            if not len(dom): return # empty node
 
             #redundant
             self.pathurl = xmltextkey(dom, 'pathurl')
             self.name = xmltextkey(dom, 'name')
             try:
-                self.timebase = float(xmltextkey(getFirstChild(dom, 'rate'), 'timebase'))
-                self.duration = float(xmltextkey(dom, 'duration'))
-            except IndexError:
+                self.timebase = toframe(xmltextkey(getFirstChild(dom, 'rate'), 'timebase'))
+                self.duration = toframe(xmltextkey(dom, 'duration'))
+            except (TypeError, ValueError):
                 # not in this xmeml version
                 self.timebase = self.duration = None
-            m = self.parsed.get('media', KeyedArray())
-            if m.get('video', None):
+            if len(dom.xpath('media/video[* or text()]')):
                 self.mediatype = 'video'
-            elif m.get('audio', None):
+            elif len(dom.xpath('media/audio[* or text()]')):
                 self.mediatype = 'audio'
 
+    @property
+    def parsed(self):
+        "the <file> as a KeyedArray, built from the dom on first access"
+        if self._parsed is None and self.dom is not None:
+            self._parsed = xml2dict(self.dom, go_deep=True)
+        return self._parsed
+
+    @parsed.setter
+    def parsed(self, value):
+        self._parsed = value
 
 
 class VideoSequence(object):
     def __init__(self, file=None, xml_string=None, clip_list=None):
         self.dom = None
         self.timecode_zero = 0 
-        self.rate = 29.97
+        self.rate = Fraction(30000, 1001) # exact frames per second, see iter.getframerate()
+        self._timecode = None
+        self.clip_list = clip_list
+        self._parsed = None
         if file:
-            self.dom = dom.parse(file)
+            self.dom = etree.parse(file)
             self.parse(self.dom)
         elif xml_string:
-            self.dom = dom.parseString(xml_string)
+            self.dom = etree.ElementTree(etree.fromstring(xml_string))
             self.parse(self.dom)
         elif clip_list:
             pass
@@ -321,104 +398,177 @@ class VideoSequence(object):
 
     def frame(self,t,units):
         if units=='frames': return t
-        elif units=='seconds': return round(self.rate * t)
+        elif units=='seconds': return int(round(self.rate * Fraction(str(t))))
         elif units=='timecode':
-            parts = t.split(';')
-            hms = parts[0].split(':')
-            frames = 0 if len(parts)<2 else int(parts[1])
-            u = 1
-            for x in hms:
-                frames += (hms.pop() * self.rate)
-                u=u*60
-            return frames-self.timecode_zero
+            return self.timecode.parse(t)
 
     
+    @property
+    def timecode(self):
+        "the TimecodeFormat of the sequence, from its <timecode> if there is one"
+        if self._timecode is None:
+            seq = None if self.dom is None else getFirstChild(self.dom.getroot(), 'sequence')
+            if seq is not None and seq.find('rate/timebase') is not None:
+                self._timecode = TimecodeFormat.fromsequence(seq)
+            else:
+                self._timecode = TimecodeFormat(self.rate, offset=self.timecode_zero)
+        return self._timecode
+
     def toxml(self):
-        if self.dom:
+        if self.dom is not None:
             return self.dom
         elif self.clip_list:
             self.dom, self.uuid = self.clips2dom(self.clip_list)
             return self.dom
 
     def clips2dom(self, clip_list):
-        newuuid = unicode( uuid1() )
-        impl = dom.getDOMImplementation()
-        #setup document
-        newdom = impl.createDocument(None, 'xmeml', None)
-        newdom.documentElement.setAttribute('version','4')
-
-        #base stupid stuff off of first clip
-        seq_data = deepcopy(clip_list[0].sequence.parsed)
-        del seq_data['duration']
-        del seq_data['out']
-        seq_data['in'] = 0
-
-        seq = dict2xml(seq_data, newdom, 'sequence')
-        newdom.documentElement.appendChild(seq)
-
-        #lay tracks from each clip
-        sections = {
-            'audio': newdom.getElementsByTagName('audio')[0],
-            'video': newdom.getElementsByTagName('video')[0],
-            }
-        tracks = {}
+        "returns (xmeml element, uuid) of a new sequence laid out from clip_list. See writeclips"
+        out = BytesIO()
+        newuuid = self.writeclips(clip_list, out)
+        return (etree.fromstring(out.getvalue(), xmemlparser), newuuid)
+
+    def writeclips(self, clip_list, output):
+        """Writes a new <xmeml> sequence laid out from clip_list to output, and returns its uuid.
+
+        output is a filename or a file-like object, e.g. socket.makefile('wb').
+        The xml is streamed with lxml.etree.xmlfile, one <clipitem> at a time, so
+        memory use does not grow with the length of the sequence. Each <file> is
+        written in full the first time, and referenced by id after that.
+        """
+        newuuid = str( uuid1() )
+        #lay tracks from each clip, by the track they come from
+        tracks = {'video':[], 'audio':[]}
+        items = {}
         frame_index = 0
-        files = {}
         for clip in clip_list:
-            #TODO: should we append these to self.track_items?
-            track_items = clip.lay_tracks(start = frame_index)
-            
-            for ti in track_items:
-                tr_dom = None
-
-                #we key off track.source because that's what they shared
-                if ti.track.source in tracks:
-                    tr_dom = tracks[ti.track.source]
-                else:
-                    tr_dom = dict2xml(ti.track.children, newdom,'track')
-                    tracks[ti.track.source] = tr_dom
-                    sections[ti.track.type].appendChild(tr_dom)
-
-                ti_dom = dict2xml(ti.parsed,newdom,'clipitem')
-                tr_dom.appendChild(ti_dom)
-                if ti.id: #also needs cross-file conflict avoidance
-                    ti_dom.setAttribute('id',ti.id)
-                file = ti_dom.getElementsByTagName('file')[0]
-                fid = file.getAttribute('id')
-                if fid not in files:
-                    newfile = dict2xml(clip.sequence.source_files[fid].parsed,
-                                       newdom,'file')
-                    ti_dom.replaceChild(newfile, file)
-
-                    #TODO: make sure cross-file ids don't conflict
-                    newfile.setAttribute('id',fid)
-                    files[fid] = (newfile, clip.sequence.source_files[fid])
-
+            for t in clip.track_items:
+                #we key off the source track because that's what they share
+                if t.track not in items:
+                    items[t.track] = []
+                    tracks[t.track.type].append(t.track)
+                items[t.track].append( (clip, t, frame_index) )
             frame_index += clip.duration
+        files = set()
+
+        def write_track(xf, track):
+            with xf.element('track'):
+                for k,v in track.children.items():
+                    if v is not None:
+                        xf.write(dict2xml(v, xmemlparser, k))
+                for clip, t, start in items[track]:
+                    clipdict = {'start_frame':clip.start_frame,'end_frame':clip.end_frame}
+                    xf.write(self._clipitem2xml(t, t.cliptiming(clipdict, start),
+                                                files, clip.sequence.source_files))
+
+        def write_section(xf, section, data):
+            with xf.element(section):
+                if isinstance(data, KeyedArray):
+                    for k,v in data.items():
+                        if v is not None:
+                            xf.write(dict2xml(v, xmemlparser, k))
+                for track in tracks[section]:
+                    write_track(xf, track)
+
+        def write_media(xf, media):
+            with xf.element('media'):
+                sections = set()
+                if isinstance(media, KeyedArray):
+                    for k,v in media.items():
+                        if k in tracks:
+                            sections.add(k)
+                            write_section(xf, k, v)
+                        elif v is not None:
+                            xf.write(dict2xml(v, xmemlparser, k))
+                for section in ('video', 'audio'):
+                    if section not in sections:
+                        write_section(xf, section, None)
 
-
-        #except <uuid>,<duration> Should we do the same with <name>?
-        seq.insertBefore(dict2xml(frame_index,newdom,'duration'), seq.firstChild)
-        seq.insertBefore(dict2xml(frame_index,newdom,'out'), seq.firstChild)
-        seq.insertBefore(dict2xml(newuuid,newdom,'uuid'), seq.firstChild)
-
-        return (newdom, newuuid)
-        
+        #base stupid stuff off of first clip
+        seq_data = clip_list[0].sequence.parsed
+        with etree.xmlfile(output, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element('xmeml', version='4'):
+                with xf.element('sequence'):
+                    #except <uuid>,<duration> Should we do the same with <name>?
+                    xf.write(dict2xml(newuuid, xmemlparser, 'uuid'))
+                    xf.write(dict2xml(frame_index, xmemlparser, 'out'))
+                    xf.write(dict2xml(frame_index, xmemlparser, 'duration'))
+                    if 'in' not in seq_data:
+                        xf.write(dict2xml(0, xmemlparser, 'in'))
+                    wrote_media = False
+                    for k,v in seq_data.items():
+                        if k in ('duration', 'out'):
+                            continue
+                        elif k == 'in':
+                            v = 0
+                        elif k == 'media':
+                            write_media(xf, v)
+                            wrote_media = True
+                            continue
+                        if v is not None:
+                            xf.write(dict2xml(v, xmemlparser, k))
+                    if not wrote_media:
+                        write_media(xf, None)
+        return newuuid
+
+    def _clipitem2xml(self, t, timing, files, source_files):
+        "returns the <clipitem> of TrackItem t with new timing, see writeclips"
+        #don't keep the parsed view of every item around while writing
+        parsed = t._parsed if t._parsed is not None else xml2dict(t.dom, go_deep=True)
+        ti_dom = xmemlparser.makeelement('clipitem')
+        if t.id: #also needs cross-file conflict avoidance
+            ti_dom.set('id',t.id)
+        timing = dict(timing)
+        for k,v in parsed.items():
+            if k in timing:
+                v = timing.pop(k)
+            if v is None:
+                continue
+            if k == 'file' and isinstance(v, list):
+                fid = v[0]
+                if fid not in files and fid in source_files:
+                    #TODO: make sure cross-file ids don't conflict
+                    files.add(fid)
+                    newfile = dict2xml(source_files[fid].parsed, xmemlparser, 'file')
+                    newfile.set('id', fid)
+                    ti_dom.append(newfile)
+                    continue
+            ti_dom.append(dict2xml(v, xmemlparser, k))
+        for k in ('start', 'end', 'in', 'out', 'duration'):
+            if k in timing: #not in the source item
+                ti_dom.append(dict2xml(timing[k], xmemlparser, k))
+        return ti_dom
 
     def clip(self, beginning, ending, units):
-        "units possibilities are 'seconds' and 'frames', and 'timecodes'"
+        "units possibilities are 'seconds' and 'frames', and 'timecode'"
         c = {'start_frame':self.frame(beginning, units),
              'end_frame':self.frame(ending, units),
              'base_sequence':self,
              'track_items':[],
              }
 
-        c['track_items'] = []
-        for t in self.track_items:
-            if t.splice_match(c):
-                c['track_items'].append(t)
+        c['track_items'] = self.item_index.intersecting(c['start_frame'], c['end_frame'])
         return Clip(**c)
 
+    def clips(self, windows, units):
+        """clip() for a list of (beginning, ending) windows at once, with
+        one sweep over the track items. Returns a list of Clips, in the order of windows"""
+        frames = [(self.frame(b, units), self.frame(e, units)) for (b, e) in windows]
+        return [Clip(start_frame=b, end_frame=e, base_sequence=self, track_items=items)
+                for (b, e), items in zip(frames, self.item_index.intersecting_many(frames))]
+
+    @property
+    def parsed(self):
+        "the <sequence> without tracks as a KeyedArray, built from the dom on first access"
+        if self._parsed is None and self.dom is not None:
+            self._parsed = xml2dict(self.dom.getroot().find('sequence'), go_deep=True,
+                                    drop=('track','uuid','duration'))
+        return self._parsed
+
+    @parsed.setter
+    def parsed(self, value):
+        self._parsed = value
+
     def parse(self, xmldom):
         """parses xml dom, to fill 
         self.track_points, self.track_markers, self.source_files
@@ -427,40 +577,35 @@ class VideoSequence(object):
 
         self.tracks = []
         self.track_items = []
-        seq = getFirstChild(xmldom.documentElement, 'sequence')
-        self.id = seq.getAttribute('id')
+        seq = getFirstChild(xmldom.getroot(), 'sequence')
+        self.id = seq.get('id')
         self.uuid = xmltextkey(seq, 'uuid')
         self.name = xmltextkey(seq, 'name')
-        self.parsed = xml2dict(seq, go_deep=True, 
-                               drop=('track','uuid','duration'))
 
-        rate = self.parsed['rate'] #double
-        if rate['ntsc'] == 'TRUE':
-            self.rate = (29.97/30) * float(rate['timebase'])
-        else:
-            self.rate = float(rate['timebase'])
+        self.rate = getframerate(toframe(seq.findtext('rate/timebase')),
+                                 seq.findtext('rate/ntsc') == 'TRUE')[0]
 
-        try:
-            self.timecode_zero = int(self.parsed['timecode']['frame']) #double
-        except KeyError:
-            pass # older versions of xmeml dont have timecode
+        if seq.find('timecode/frame') is not None:
+            self.timecode_zero = int(seq.findtext('timecode/frame')) #double
+        # older versions of xmeml dont have timecode
 
-        files = seq.getElementsByTagName('file')
-        for f in files:
-            if f.childNodes.length: #not just pointer
-                id = f.getAttribute('id')
+        for f in seq.iter('file'):
+            if len(f): #not just pointer
+                id = f.get('id')
                 self.source_files[id] = XmemlFileRef(dom=f)
                 
-        tracks = seq.getElementsByTagName('track')
-        track_index = 0
-        for t in tracks:
+        for t in seq.iter('track'):
             my_track = Track(dom=t)
             self.tracks.append(my_track)
-            for n in t.childNodes:
-                if n.nodeType==1 and n.tagName in ('clipitem','transitionitem'):
-                    my_track_item = TrackItem(dom=n, track=my_track, source_files=self.source_files)
-                    self.track_items.append( my_track_item )
-                    my_track.clips.append( my_track_item )
+            for n in t.iterchildren('clipitem', 'transitionitem'):
+                my_track_item = TrackItem(dom=n, track=my_track, source_files=self.source_files)
+                self.track_items.append( my_track_item )
+                my_track_item.position = len(my_track.clips)
+                if my_track.clips:
+                    my_track_item.prev = my_track.clips[-1]
+                    my_track.clips[-1].next = my_track_item
+                my_track.clips.append( my_track_item )
+        self.item_index = TrackItemIndex(self.track_items)
 
     def get_track_clipitems(self, mediatype=None):
         for i in self.track_items:
@@ -469,7 +614,58 @@ class VideoSequence(object):
             yield i
 
     def freemem(self):
-        self.dom.unlink()
+        self.dom = None
+        self._parsed = None
+        for t in self.track_items:
+            t.dom = t._parsed = t._filters = None
+
+class TrackItemIndex(object):
+    """Interval index of the <clipitem>s of a sequence, sorted by start frame.
+
+    Finds the items that TrackItem.splice_match() a clip without looking at the others.
+    An unknown (-1) start or end frame matches any clip, like in TrackItem.intersects()
+    """
+    def __init__(self, track_items):
+        entries = []
+        for position, t in enumerate(track_items):
+            if t.type != 'clipitem': continue
+            start = float('-inf') if t.start_frame == -1 else t.start_frame
+            end = float('inf') if t.end_frame == -1 else t.end_frame
+            entries.append( (start, position, end, t) )
+        entries.sort(key=lambda e: e[:2])
+        self.entries = entries
+        self.starts = [e[0] for e in entries]
+        #running maximum of the end frames, to find the first item reaching into a clip
+        self.maxends = []
+        for e in entries:
+            self.maxends.append(max(e[2], self.maxends[-1]) if self.maxends else e[2])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def intersecting(self, start_frame, end_frame):
+        "returns the items intersecting start_frame-end_frame, in sequence order"
+        lo = bisect_left(self.maxends, start_frame)
+        hi = bisect_right(self.starts, end_frame)
+        return [e[3] for e in sorted((e for e in self.entries[lo:hi] if e[2] >= start_frame),
+                                     key=lambda e: e[1])]
+
+    def intersecting_many(self, windows):
+        """returns a list of intersecting items for each (start_frame, end_frame) in windows,
+        with one sweep over the items"""
+        results = [None] * len(windows)
+        active = []
+        i = 0
+        for w in sorted(range(len(windows)), key=lambda w: windows[w][0]):
+            start_frame, end_frame = windows[w]
+            while i < len(self.entries) and self.starts[i] <= end_frame:
+                active.append(self.entries[i])
+                i += 1
+            #the windows come in order of start, so items ending before it are done
+            active = [e for e in active if e[2] >= start_frame]
+            results[w] = [e[3] for e in sorted((e for e in active if e[0] <= end_frame),
+                                               key=lambda e: e[1])]
+        return results
 
 class ItemFilter(object):
   """<filter> object representation on <clip> and <clipitems>"""
@@ -485,8 +681,7 @@ class ItemFilter(object):
       self.id = self.effect.get('effectid', None)
       self.name = self.effect.get('name', None)
       self.mediatype = self.effect.get('mediatype', None)
-      self.parameters = [EffectParameter(pm) for (k, pm) in \
-             self.effect.items() if k == 'parameter']
+      self.parameters = [EffectParameter(pm) for pm in self.effect.getall('parameter')]
     except:
       raise
 
@@ -494,7 +689,7 @@ class EffectParameter(object):
   """<parameter> object representation"""
   def __str__(self):
     if self.values:
-      return '<Parameter: %s -- %s>' % (self.id, self.values.items())
+      return '<Parameter: %s -- %s>' % (self.id, self.values)
     else:
       return '<Parameter: %s -- %s>' % (self.id, self.value)
   def __init__(self, karray):
@@ -505,8 +700,7 @@ class EffectParameter(object):
     self.max = karray.get('valuemax', -1)
     self.value = karray.get('value', -1)
     self.values = []
-    for k,v in karray.items():
-      if k != 'keyframe': continue
+    for v in karray.getall('keyframe'):
       when = v.get('when', None)
       value = v.get('value', None)
       if when and value:
@@ -518,43 +712,88 @@ class KeyedArray(object):
   """A list which can also be set and got like a dictionary
   This might not be the most intuitive interface, but it was the easiest
   way to add multiple elements of the same tagname support to the XML methods
+
+  It's an ordered multimap: setting a key adds a (key, value) pair, 
+  self[k] gets the last value of k, and getall(k) all of them, in order.
+  Key lookups and deletes are O(1), and items() iterates without building a list.
   """
+  __slots__ = ('_entries', '_bykey', '_deleted')
+
   def __init__(self, dict=None):
-    self.dic = {}
-    self.key_array = []
-    self.val_array = []
+    self._entries = [] # [key, value] pairs, in order. Deleted pairs get key _DELETED
+    self._bykey = {}   # key -> list of the pairs with that key
+    self._deleted = 0
     if isinstance(dict,list):
         for k,v in dict: self[k]=v
 
   def __getitem__(self,k):
-    return self.dic[k]
+    return self._bykey[k][-1][1]
   def __setitem__(self,k,val):
-    self.key_array.append(k)
-    self.val_array.append(val)
-    self.dic[k] = val
+    entry = [k, val]
+    self._entries.append(entry)
+    self._bykey.setdefault(k, []).append(entry)
   def __delitem__(self,k):
-    if self.has_key(k):
-        i = self.key_array.index(k)
-        self.key_array.pop(i)
-        self.val_array.pop(i)
-        del self.dic[k]
-
-  def get(self,k,default):
-      return (default if not (k in self.dic) else self[k])
+    "deletes all values of k"
+    for entry in self._bykey.pop(k, ()):
+      self._delete(entry)
+  def __contains__(self,k):
+    return k in self._bykey
+  def __len__(self):
+    return len(self._entries) - self._deleted
+  def __iter__(self):
+    return self.keys()
+  def __repr__(self):
+    return 'KeyedArray(%r)' % list(self.items())
+
+  def __deepcopy__(self, memo):
+    new = KeyedArray()
+    for k,v in self.items():
+      if isinstance(v, KeyedArray):
+        v = v.__deepcopy__(memo)
+      elif isinstance(v, list): # [id]
+        v = list(v)
+      elif v is not None and not isinstance(v, str):
+        v = deepcopy(v, memo)
+      new[k] = v
+    return new
+
+  def _delete(self, entry):
+    entry[0] = _DELETED
+    entry[1] = None
+    self._deleted += 1
+    if self._deleted > len(self._entries) // 2:
+      # compact
+      self._entries = [e for e in self._entries if e[0] is not _DELETED]
+      self._deleted = 0
+
+  def get(self,k,default=None):
+      entries = self._bykey.get(k)
+      return entries[-1][1] if entries else default
+  def getall(self,k):
+      "all values of k, in order"
+      return [e[1] for e in self._bykey.get(k, ())]
   def has_key(self,k):
-      return (k in self.dic)
+      return (k in self._bykey)
+  def keys(self):
+      return (e[0] for e in self._entries if e[0] is not _DELETED)
   def values(self):
-      return self.val_array
+      return (e[1] for e in self._entries if e[0] is not _DELETED)
   def items(self):
-      return [(self.key_array[i],self.val_array[i]) for i in range(len(self.key_array))]
+      return ((e[0], e[1]) for e in self._entries if e[0] is not _DELETED)
   def update(self,dict):
+    "set the values of the keys of dict, like dict.update(). Duplicate keys are replaced"
     for k in dict.keys():
       val = dict[k]
-      if k in self.dic:
-        self.val_array[self.key_array.index(k)]=val
-        self.dic[k] = val
+      entries = self._bykey.get(k)
+      if entries:
+        entries[0][1] = val
+        for entry in entries[1:]:
+          self._delete(entry)
+        del entries[1:]
       else:
-        self.dic[k] = dict[k]
+        self[k] = val
+
+_DELETED = object() # marks deleted pairs in a KeyedArray
 
 class Volume(object):
     """Helper class to convert to and from gain and dB.
@@ -0,0 +1,170 @@
+# -*- encoding: utf-8 -*-
+#
+# Structural diff of two versions of a sequence parsed with xmeml.iter.
+#
+# Clips of the old and the new version are paired by id, then by
+# masterclipid, then by file, and each pair is compared by the
+# content hashes of ClipItem.digest(). Everything is done with dict
+# lookups in one pass over each version, plus a sort of the affected
+# frame windows.
+#
+# (C) 2011-2020 havard.gulldahl@nrk.no
+# License: BSD
+
+from builtins import str  # be py2+py3 proof. pip install future
+import logging
+
+from .iter import Range, XmemlParser
+
+
+class ClipChange(object):
+    """A clip that is in both versions, but has changed.
+
+    .old and .new are the two ClipItems, and .kinds is a list of what changed:
+    'moved', 'retimed', 'levelchanged' and/or 'sourcechanged'.
+    """
+
+    def __init__(self, old, new, kinds):
+        self.old = old
+        self.new = new
+        self.kinds = kinds
+
+    def __repr__(self):
+        return "<ClipChange {}: {}>".format(self.new.id, ", ".join(self.kinds))
+
+
+class SequenceDiff(object):
+    """The differences between two versions of a sequence.
+
+    .added and .removed are lists of ClipItems, and .moved, .retimed,
+    .levelchanged and .sourcechanged are lists of ClipChanges. A clip is
+    moved if its track or position changed and its in and out points did not,
+    and retimed if its in or out points changed (a trim or a slip).
+    .windows is a sorted list of the merged frame Ranges of the new version
+    that may look or sound different.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.moved = []
+        self.retimed = []
+        self.levelchanged = []
+        self.sourcechanged = []
+        self.unchanged = 0
+        self.windows = []
+
+    def __repr__(self):
+        return "<SequenceDiff: {} added, {} removed, {} moved, {} retimed, {} levels, {} sources>".format(
+            len(self.added),
+            len(self.removed),
+            len(self.moved),
+            len(self.retimed),
+            len(self.levelchanged),
+            len(self.sourcechanged),
+        )
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.windows)
+
+    __nonzero__ = __bool__  # py2
+
+    def changes(self):
+        "Iterator to get all ClipChanges, each one once"
+        seen = set()
+        for change in self.moved + self.retimed + self.levelchanged + self.sourcechanged:
+            if id(change) not in seen:
+                seen.add(id(change))
+                yield change
+
+
+def _clipkey(clip):
+    "The id of a clip, qualified by the ids of the clips it is nested in"
+    key = (clip.id,)
+    while clip.parent is not None:
+        clip = clip.parent
+        key = (clip.id,) + key
+    return key
+
+
+def _clips(sequence):
+    for mediatype in ("video", "audio"):
+        for clip in sequence._iterclips(mediatype, enabledonly=False):
+            yield clip
+
+
+def _pair(old, new, key):
+    """Pair the clips of old and new with the same key(clip), in order.
+    Returns the pairs and the leftovers of old and new."""
+    candidates = {}
+    for clip in old:
+        k = key(clip)
+        if k is not None:
+            candidates.setdefault(k, []).append(clip)
+    for clips in candidates.values():
+        clips.reverse()  # to pop() them in order
+    pairs = []
+    unpaired = []
+    for clip in new:
+        k = key(clip)
+        if candidates.get(k):
+            pairs.append((candidates[k].pop(), clip))
+        else:
+            unpaired.append(clip)
+    paired = set(id(o) for o, n in pairs)
+    return pairs, [clip for clip in old if id(clip) not in paired], unpaired
+
+
+def _mergewindows(windows):
+    "Merge overlapping and adjacent (start, end) windows into a sorted list of Range"
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1].end:
+            if end > merged[-1].end:
+                merged[-1].end = end
+        else:
+            merged.append(Range((start, end)))
+    return merged
+
+
+def diff(old, new):
+    """Compare two versions of a sequence, given as XmemlSequences (or
+    XmemlParsers) or filenames. Returns a SequenceDiff."""
+    if isinstance(old, str):
+        old = XmemlParser(old)
+    if isinstance(new, str):
+        new = XmemlParser(new)
+    result = SequenceDiff()
+    pairs, oldclips, newclips = _pair(list(_clips(old)), list(_clips(new)), _clipkey)
+    for key in (
+        lambda clip: clip.masterclipid,
+        lambda clip: clip.file.id if clip.file is not None else None,
+    ):
+        _pairs, oldclips, newclips = _pair(oldclips, newclips, key)
+        pairs.extend(_pairs)
+    result.removed = oldclips
+    result.added = newclips
+    windows = [(c.start, c.end) for c in oldclips + newclips]
+    for o, n in pairs:
+        od, nd = o.digest(), n.digest()
+        if od == nd:
+            result.unchanged += 1
+            continue
+        change = ClipChange(o, n, [])
+        if od.position != nd.position and od.timing == nd.timing:
+            change.kinds.append("moved")
+            result.moved.append(change)
+        if od.timing != nd.timing:
+            change.kinds.append("retimed")
+            result.retimed.append(change)
+        if od.levels != nd.levels:
+            change.kinds.append("levelchanged")
+            result.levelchanged.append(change)
+        if od.source != nd.source:
+            change.kinds.append("sourcechanged")
+            result.sourcechanged.append(change)
+        windows.append((o.start, o.end))
+        windows.append((n.start, n.end))
+    result.windows = _mergewindows(windows)
+    logging.info("diff: %r", result)
+    return result
@@ -0,0 +1,230 @@
+# -*- encoding: utf-8 -*-
+#
+# Batched edits of xmeml files parsed with xmeml.iter.
+#
+# Edits are collected first, and applied while the file is written
+# out in one pass with lxml's incremental writer: untouched subtrees
+# are serialized as they are, and only the edited elements are copied
+# and changed. The parsed tree itself is never modified.
+#
+# (C) 2011-2020 havard.gulldahl@nrk.no
+# License: BSD
+
+from builtins import str  # be py2+py3 proof. pip install future
+import lxml.etree as etree
+import logging
+import copy
+
+from .iter import XmemlError
+
+
+class XmemlEditor(object):
+    """Collect edits to the clips, tracks and files of an XmemlParser, and write
+    the edited file with write().
+
+    Clips are given as ClipItem objects or clip ids. Note that a clip from a
+    nested sequence is edited in the nested sequence, i.e. for all its instances.
+
+        editor = XmemlEditor(xmeml)
+        for clip in xmeml.getclipsbypathurl(oldurl):
+            editor.setlevels(clip, value=0.0)
+        editor.relink(oldurl, newurl)
+        editor.write("edited.xml")
+
+    The file is written from the parsed tree, so a parser with a lossy
+    ParserProfile (one that prunes elements or drops comments) would write a
+    file without them. write() refuses that, unless lossy=True is given.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self._edits = {}  # element -> list of functions changing a copy of it
+        self._removed = set()  # elements to leave out
+        self._relinks = {}  # pathurl or file id -> new pathurl
+
+    def __len__(self):
+        return len(self._edits) + len(self._removed) + len(self._relinks)
+
+    def _element(self, clip):
+        if isinstance(clip, str):
+            _clip = self.parser.getclip(clip)
+            if _clip is None:
+                raise XmemlError("No clipitem with id {!r}".format(clip))
+            clip = _clip
+        if clip.tree is None:
+            raise XmemlError(
+                "Clip {!r} was released from the tree, and can't be edited".format(clip.id)
+            )
+        return clip.tree
+
+    def _edit(self, element, function):
+        self._edits.setdefault(element, []).append(function)
+
+    def setlevels(self, clip, value=None, keyframes=None):
+        """Set the Audio Levels of a clip to one gain value, and/or a list of
+        (when, gain) keyframes. Existing keyframes are replaced."""
+
+        def setlevels(el):
+            effects = el.xpath("filter/effect[effectid='audiolevels']")
+            if effects:
+                effect = effects[0]
+            else:
+                _filter = etree.SubElement(el, "filter")
+                effect = etree.SubElement(_filter, "effect")
+                for tag, text in (
+                    ("name", "Audio Levels"),
+                    ("effectid", "audiolevels"),
+                    ("effectcategory", "audiolevels"),
+                    ("effecttype", "audiolevels"),
+                    ("mediatype", "audio"),
+                ):
+                    etree.SubElement(effect, tag).text = text
+            parameter = effect.find("parameter")
+            if parameter is None:
+                parameter = etree.SubElement(effect, "parameter")
+                etree.SubElement(parameter, "parameterid").text = "level"
+                etree.SubElement(parameter, "name").text = "Level"
+                etree.SubElement(parameter, "valuemin").text = "0"
+                etree.SubElement(parameter, "valuemax").text = "3.98109"
+            if value is not None:
+                _settext(parameter, "value", value)
+            elif parameter.find("value") is None:
+                _settext(parameter, "value", 1)
+            if keyframes is not None:
+                for keyframe in parameter.findall("keyframe"):
+                    parameter.remove(keyframe)
+                for when, gain in keyframes:
+                    keyframe = etree.SubElement(parameter, "keyframe")
+                    etree.SubElement(keyframe, "when").text = str(when)
+                    etree.SubElement(keyframe, "value").text = str(gain)
+
+        self._edit(self._element(clip), setlevels)
+
+    def settiming(self, clip, inpoint=None, outpoint=None, start=None, end=None):
+        """Set the <in>, <out>, <start> and/or <end> frames of a clip."""
+        timing = [
+            (tag, frame)
+            for tag, frame in (
+                ("in", inpoint),
+                ("out", outpoint),
+                ("start", start),
+                ("end", end),
+            )
+            if frame is not None
+        ]
+
+        def settiming(el):
+            for tag, frame in timing:
+                _settext(el, tag, frame)
+
+        self._edit(self._element(clip), settiming)
+
+    def removeclip(self, clip):
+        """Remove a clip from its track."""
+        self._removed.add(self._element(clip))
+
+    def removetrack(self, mediatype, number, sequence=None):
+        """Remove track number (from 1, like V1/A1) of 'video' or 'audio' from
+        sequence, an XmemlSequence. Defaults to the main sequence of the parser."""
+        if sequence is None:
+            sequence = self.parser
+        for _number, track in sequence._itertracks(mediatype, enabledonly=False):
+            if _number == number:
+                self._removed.add(track)
+                return
+        raise XmemlError("No {} track number {!r}".format(mediatype, number))
+
+    def relink(self, old, pathurl):
+        """Point a file, given by its old pathurl or its file id, to a new pathurl."""
+        self._relinks[old] = pathurl
+
+    def write(self, output, encoding=None, lossy=False):
+        """Write the edited file to output, a filename or a file-like object.
+
+        Raises XmemlError if the parser was parsed with a lossy ParserProfile,
+        unless lossy is True: the written file would lack what it pruned.
+        Returns the number of elements that were changed or removed.
+        """
+        profile = getattr(self.parser, "profile", None)
+        if profile is not None and profile.lossy:
+            if not lossy:
+                raise XmemlError(
+                    "The file was parsed with {!r}, so the written file would lack "
+                    "what it pruned. Parse without a profile, or give lossy=True".format(
+                        profile
+                    )
+                )
+            logging.warning("XmemlEditor.write: writing a file parsed with %r", profile)
+        tree = self.parser.tree
+        edits = dict(self._edits)
+        if self._relinks:
+            # one pass over the pathurls to find the <file> definitions to change
+            for el in tree.iter("pathurl"):
+                _file = el.getparent()
+                if _file.tag != "file":
+                    continue
+                pathurl = self._relinks.get(el.text, self._relinks.get(_file.get("id")))
+                if pathurl is not None:
+                    edits.setdefault(_file, []).append(
+                        lambda f, pathurl=pathurl: _settext(f, "pathurl", pathurl)
+                    )
+        changed = set(edits) | self._removed
+        # the elements that must be opened to get at the changed ones
+        ancestors = set()
+        for el in changed:
+            for ancestor in el.iterancestors():
+                if ancestor in ancestors:
+                    break
+                ancestors.add(ancestor)
+
+        def _editedcopy(el):
+            elcopy = copy.deepcopy(el)
+            if el in ancestors:
+                # apply the changes inside it, too
+                pairs = [
+                    (original, _copy)
+                    for original, _copy in zip(el.iterdescendants(), elcopy.iterdescendants())
+                    if original in changed
+                ]
+                for original, _copy in pairs:
+                    if original in self._removed:
+                        _copy.getparent().remove(_copy)
+                    else:
+                        for function in edits[original]:
+                            function(_copy)
+            for function in edits[el]:
+                function(elcopy)
+            return elcopy
+
+        def _write(xf, el):
+            if el in self._removed:
+                return
+            if el in edits:
+                xf.write(_editedcopy(el))
+            elif el in ancestors:
+                with xf.element(el.tag, dict(el.attrib)):
+                    if el.text:
+                        xf.write(el.text)
+                    for child in el:
+                        _write(xf, child)
+                if el.tail:
+                    xf.write(el.tail)
+            else:
+                xf.write(el)
+
+        docinfo = tree.docinfo
+        with etree.xmlfile(output, encoding=encoding or docinfo.encoding) as xf:
+            xf.write_declaration()
+            if docinfo.doctype:
+                xf.write_doctype(docinfo.doctype)
+            _write(xf, tree.getroot())
+        logging.info("XmemlEditor.write: %i elements changed", len(changed))
+        return len(changed)
+
+
+def _settext(el, tag, value):
+    "Set the text of the first <tag> child of el, adding one if needed"
+    child = el.find(tag)
+    if child is None:
+        child = etree.SubElement(el, tag)
+    child.text = str(value)
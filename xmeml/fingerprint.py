@@ -0,0 +1,199 @@
+# -*- encoding: utf-8 -*-
+#
+# Fingerprints of clips, tracks and sequences parsed with xmeml.iter,
+# to find sequences that were seen before and group near-duplicates.
+#
+# Fingerprints leave out ids, uuids and names of sequences, so re-saves
+# and copies of a sequence in other projects get the same fingerprint.
+# Clips are placed relative to the clip before them on their track, so a
+# ripple edit only changes the clips it touches, not every clip after it.
+# prefingerprint() reads only the start of a file, as a cheap hint to
+# bucket files before parsing them in full.
+#
+# (C) 2011-2020 havard.gulldahl@nrk.no
+# License: BSD
+
+from builtins import str  # be py2+py3 proof. pip install future
+import lxml.etree as etree
+import logging
+
+from .iter import _digest as _hash
+
+PREFINGERPRINTCLIPS = 20  # clipitems read by prefingerprint()
+
+
+def clipfingerprint(clip, previous=0):
+    """Return the fingerprint of a ClipItem: its timing, its file and its effects.
+
+    The clip is placed by its gap to previous, the end frame of the clip before
+    it on its track (0 for the first), not by its frames in the sequence."""
+    if clip.file is not None:
+        source = (clip.file.pathurl or clip.file.name, clip.file.duration)
+    else:
+        source = (clip.nestedsequenceid, clip.name)
+    effects = tuple(
+        (e.effectid, e.enabled, e.value, tuple(e.parameters)) for e in clip.getfilters()
+    )
+    return _hash(
+        clip.tracktype,
+        clip.start - previous,
+        clip.end - clip.start,
+        clip.inpoint,
+        clip.outpoint,
+        clip.enabled,
+        source,
+        effects,
+    )
+
+
+class SequenceFingerprint(object):
+    """The fingerprints of a sequence.
+
+    .clips is the set of clip fingerprints, .tracks maps (mediatype, number)
+    to the fingerprint of that track, with the frames of its clips in the
+    sequence, and .sequence is the fingerprint of all the tracks, in order.
+    """
+
+    def __init__(self, clips, tracks):
+        self.clips = frozenset(clips)
+        self.tracks = tracks
+        self.sequence = _hash(*sorted(tracks.items()))
+
+    def __repr__(self):
+        return "<SequenceFingerprint {}: {} tracks, {} clips>".format(
+            self.sequence, len(self.tracks), len(self.clips)
+        )
+
+    def __eq__(self, other):
+        return self.sequence == other.sequence
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.sequence)
+
+    def similarity(self, other):
+        "Jaccard similarity of the clips of the two sequences, from 0.0 to 1.0"
+        if not self.clips and not other.clips:
+            return 1.0
+        return len(self.clips & other.clips) / float(len(self.clips | other.clips))
+
+
+def fingerprint(sequence):
+    """Return the SequenceFingerprint of an XmemlSequence (or XmemlParser)."""
+    clips = []
+    tracks = {}
+    ends = {}  # the end frame of the last clip of each track
+    for mediatype in ("video", "audio"):
+        for clip in sequence._iterclips(mediatype, enabledonly=False):
+            track = (mediatype, clip.tracknumber)
+            fp = clipfingerprint(clip, ends.get(track, 0))
+            ends[track] = clip.end
+            clips.append(fp)
+            tracks.setdefault(track, []).append((fp, clip.start, clip.end))
+    return SequenceFingerprint(
+        clips, {track: _hash(*fps) for track, fps in tracks.items()}
+    )
+
+
+def prefingerprint(filename, clips=PREFINGERPRINTCLIPS):
+    """Return a cheap fingerprint of an xmeml file, from the timing of its first
+    clipitems. Only the start of the file is parsed.
+
+    Like fingerprint(), it leaves out ids and names. It is a hint to bucket or
+    order files before parsing them: the same sequence usually has the same
+    prefingerprint, and files with the same prefingerprint probably have the
+    same sequence. It is not proof either way (clips in transitions or nested
+    sequences are timed differently by fingerprint()), so confirm with
+    fingerprint(), and don't skip that because prefingerprints differ."""
+    values = []
+    context = etree.iterparse(filename, events=("end",), tag="clipitem")
+    for _event, el in context:
+        values.append(
+            tuple(el.findtext(tag) for tag in ("start", "end", "in", "out", "enabled"))
+        )
+        if len(values) >= clips:
+            break
+        el.clear()
+    del context
+    return _hash(*values)
+
+
+class FingerprintIndex(object):
+    """An index of SequenceFingerprints, to skip sequences that were seen
+    before and to find near-duplicates.
+
+        index = FingerprintIndex()
+        for filename in filenames:
+            xmeml = XmemlParser(filename)
+            if index.add(filename, xmeml.fingerprint()) is not None:
+                continue  # seen before
+            analyze(xmeml)
+        groups = index.groups(threshold=0.9)
+    """
+
+    def __init__(self):
+        self.fingerprints = {}  # key -> SequenceFingerprint
+        self.bysequence = {}  # sequence fingerprint -> first key
+        self.byclip = {}  # clip fingerprint -> set of keys
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, fingerprint):
+        return fingerprint.sequence in self.bysequence
+
+    def add(self, key, fingerprint):
+        """Add the fingerprint of key (e.g. a filename). Returns the key of an
+        identical sequence that was added before, or None."""
+        self.fingerprints[key] = fingerprint
+        for fp in fingerprint.clips:
+            self.byclip.setdefault(fp, set()).add(key)
+        seen = self.bysequence.setdefault(fingerprint.sequence, key)
+        return seen if seen != key else None
+
+    def similar(self, fingerprint, threshold=0.9):
+        """Get a list of (similarity, key) for the indexed sequences that are at
+        least threshold similar to fingerprint, the most similar first. Only the
+        sequences that share clips with it are compared."""
+        candidates = set()
+        for fp in fingerprint.clips:
+            candidates.update(self.byclip.get(fp, ()))
+        result = []
+        for key in candidates:
+            similarity = fingerprint.similarity(self.fingerprints[key])
+            if similarity >= threshold:
+                result.append((similarity, key))
+        result.sort(key=lambda r: -r[0])
+        return result
+
+    def groups(self, threshold=0.9):
+        """Group the indexed sequences into near-duplicates, i.e. sequences that
+        are connected by a similarity of at least threshold. Returns a list of
+        lists of keys, in the order they were added."""
+        order = {key: i for i, key in enumerate(self.fingerprints)}
+        parent = {key: key for key in self.fingerprints}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for key, fingerprint in self.fingerprints.items():
+            for _similarity, other in self.similar(fingerprint, threshold):
+                a, b = find(key), find(other)
+                if a != b:
+                    # the earliest key is the root, to keep the groups in order
+                    if order[a] < order[b]:
+                        parent[b] = a
+                    else:
+                        parent[a] = b
+        groups = {}
+        for key in self.fingerprints:
+            groups.setdefault(find(key), []).append(key)
+        logging.info(
+            "FingerprintIndex.groups: %i sequences in %i groups", len(self), len(groups)
+        )
+        return sorted(groups.values(), key=lambda g: order[g[0]])
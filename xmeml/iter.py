@@ -19,45 +19,116 @@
 from builtins import str  # be py2+py3 proof. pip install future
 import lxml.etree as etree
 import logging
+import copy
+import hashlib
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from heapq import heappop, heappush
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .timecode import TimecodeFormat
 
 AUDIOTHRESHOLD = 0.0001
 
 
+# the common video types, see getframerate()
+FRAMERATENAMES = {
+    (24, True): "24P",
+    (24, False): "Film",
+    (25, True): "PAL",
+    (25, False): "PAL",
+    (30, True): "NTSC/HD",
+    (30, False): "Video/HD",
+    (50, True): "HD (50Hz)",
+    (50, False): "HD (50Hz)",
+    (60, True): "HD (59.94Hz)",
+    (60, False): "HD (60Hz)",
+}
+
+# (timebase, ntsc) -> (exact framerate, common video type)
+# NTSC rates are timebase * 1000/1001, except for the PAL timebases, where <ntsc> is meaningless
+FRAMERATES = {
+    (timebase, ntsc): (
+        Fraction(timebase * 1000, 1001)
+        if ntsc and timebase not in (25, 50)
+        else Fraction(timebase),
+        FRAMERATENAMES.get((timebase, ntsc)),
+    )
+    for timebase in range(1, 241)
+    for ntsc in (True, False)
+}
+
+
 def getframerate(timebase, ntsc):
-    """Return a tuple(float, string): actual framerate and common video type. E.g. (23.976, '24P')
+    """Return a tuple(Fraction, string): exact framerate and common video type. E.g. (24000/1001, '24P')
 
     Note that actual framerate is not always the same as <timebase>, hence this method.
 
     Implemented as spec'ed on p. 160 at:
     https://developer.apple.com/library/mac/documentation/AppleApplications/Reference/FinalCutPro_XML/FinalCutPro_XML.pdf
     """
-    # print "getframerate: ", repr(timebase), repr(ntsc)
     if timebase is None:
         logging.debug("getframerate: timebase is None, returning None")
         return (None, None)
-    elif timebase == 24:
-        if ntsc:
-            return (23.976, "24P")
-        else:
-            return (24, "Film")
-    elif timebase == 25:
-        return (25, "PAL")
-    elif timebase == 30:
-        if ntsc:
-            return (29.97, "NTSC/HD")
-        else:
-            return (30, "Video/HD")
-    elif timebase == 50:
-        return (50, "HD (50Hz)")
-    elif timebase == 60:
-        if ntsc:
-            return (59.94, "HD (59.94Hz)")
-        else:
-            return (60, "HD (60Hz)")
-    else:
+    try:
+        return FRAMERATES[(int(timebase), bool(ntsc))]
+    except KeyError:
         logging.warning(
             "getframerate: got an unhandled timebase: %r (ntsc=%r)", timebase, ntsc
         )
+        return (Fraction(str(timebase)), None)
+
+
+def toframe(text):
+    """Return the frame number in the text of an element as an int. Tolerates
+    frames written as floats, like '100.0'."""
+    try:
+        return int(text)
+    except ValueError:
+        return int(round(float(text)))
+
+
+def isenabled(tree):
+    """Return True if the <enabled> subelement of tree is not FALSE.
+
+    From the spec:
+    Description   A Boolean value specifying whether or not the parent element is enabled.
+    Parents       track, clipitem, clip, generatoritem, sequence, filter
+    Notes         If you do not specify enabled, the default setting is TRUE.
+    """
+    _en = tree.findtext("enabled")
+    if _en is None:
+        return True
+    return str(_en).upper() != "FALSE"
+
+
+def _digest(*values):
+    "Return a short, stable hash of some plain values"
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()[:16]
+
+
+# what audibleframes() needs of a clip, see ClipItem.audiopayload()
+AudioPayload = namedtuple(
+    "AudioPayload",
+    "id name mediatype start end inpoint outpoint framerate levels gain",
+)
+
+# content hashes of a clip, see ClipItem.digest()
+ClipDigest = namedtuple("ClipDigest", "position timing source levels")
+
+
+def _itersiblings(el, tag):
+    """Iterator to get el and its following siblings with tag. Unlike
+    iterchildren(), this can go on when the current element is removed."""
+    while el is not None:
+        following = el.getnext()
+        if el.tag == tag:
+            yield el
+        el = following
 
 
 class XmemlError(Exception):
@@ -125,7 +196,7 @@ class Ranges(object):
         self.r = []
         if range is not None:
             self.extend(range)
-        self.framerate = float(framerate)
+        self.framerate = Fraction(framerate) if framerate is not None else None
 
     def __repr__(self):
         return "Ranges: " + repr(self.r)
@@ -158,11 +229,23 @@ class Ranges(object):
         return True
 
     def seconds(self):
-        try:
-            return float(len(self)) / self.framerate
-        except Exception:
-            raise
-            return None
+        "Returns the exact length in seconds, as a Fraction"
+        return Fraction(len(self)) / self.framerate
+
+    def arrays(self):
+        "Returns the start and end frames as two integer arrays"
+        return (array("q", [r.start for r in self.r]), array("q", [r.end for r in self.r]))
+
+    def within(self, start=None, end=None):
+        """Returns a new Ranges of the parts of these ranges within the frames
+        start-end. A bound of None is open."""
+        ranges = Ranges(framerate=self.framerate)
+        for r in self.r:
+            _start = r.start if start is None else max(r.start, start)
+            _end = r.end if end is None else min(r.end, end)
+            if _start < _end:
+                ranges.r.append(Range((_start, _end)))
+        return ranges
 
 
 class BaseObject(object):
@@ -171,7 +254,7 @@ class BaseObject(object):
     def __init__(self, tree):
         self.name = tree.findtext("name")
         try:
-            self.timebase = float(tree.findtext("rate/timebase"))
+            self.timebase = toframe(tree.findtext("rate/timebase"))
         except TypeError:
             self.timebase = None
 
@@ -181,8 +264,8 @@ class Item(BaseObject):
 
     def __init__(self, tree):
         super(Item, self).__init__(tree)
-        self.start = float(tree.findtext("start"))
-        self.end = float(tree.findtext("end"))
+        self.start = toframe(tree.findtext("start"))
+        self.end = toframe(tree.findtext("end"))
         self.id = tree.get("id")
         try:
             self.ntsc = tree.findtext("rate/ntsc") == "TRUE"
@@ -209,7 +292,7 @@ class TransitionItem(Item):
         self.alignment = tree.findtext("alignment")
         self.effect = Effect(tree.find("effect"))
         self.duration = self.end - self.start
-        self.centerframe = self.start + (self.duration / 2)
+        self.centerframe = self.start + (self.duration // 2)
 
 
 class ClipItem(Item):
@@ -230,19 +313,19 @@ class ClipItem(Item):
     """
 
     # (name | duration | rate | enabled | in  | out | start | end  | anamorphic | alphatype | alphareverse | compositemode | masterclipid  |  ismasterclip | labels | comments | stillframeoffset | sequence |  subclipinfo |  logginginfo | stillframe | timecode | syncoffset | file |  primarytimecode | marker  | filter |  sourcetrack | link | subframeoffset | pixelaspectratio | fielddominance)
-    def __init__(self, tree, sequenceframerate=None):
+    def __init__(self, tree, sequenceframerate=None, filelist=None):
         super(ClipItem, self).__init__(tree)
         self.tree = tree
         self.sequenceframerate = (
             sequenceframerate  # the framerate of the containing sequence
         )
-        self.inpoint = int(tree.findtext("in"))
-        self.outpoint = int(tree.findtext("out"))
+        self.inpoint = toframe(tree.findtext("in"))
+        self.outpoint = toframe(tree.findtext("out"))
         if self.inpoint > self.outpoint:
             # clip is reversed, just flip it back
             self.inpoint, self.outpoint = self.outpoint, self.inpoint
         self.duration = self.outpoint - self.inpoint
-        if self.start == -1.0:  # start is unkown, presumably within a transition
+        if self.start == -1:  # start is unkown, presumably within a transition
             try:
                 self.start = self.getprevtransition().centerframe
             except XmemlNoTransitionError:
@@ -250,7 +333,7 @@ class ClipItem(Item):
                     "Could not figure out start point of clip. Please double check this clip: %r"
                     % self.name
                 )
-        if self.end == -1.0:  # end is unknown, presumably within a transition
+        if self.end == -1:  # end is unknown, presumably within a transition
             try:
                 self.end = self.getfollowingtransition().centerframe
             except XmemlNoTransitionError:
@@ -259,28 +342,118 @@ class ClipItem(Item):
                     % self.name
                 )
         try:
-            self.file = File.filelist[tree.find("file").get("id")]
+            self.file = (File.filelist if filelist is None else filelist)[
+                tree.find("file").get("id")
+            ]
         except (AttributeError, KeyError):
             # print self.name
             self.file = None  # there might be a nested <sequence> instead of a file. Or the clip/file is disabled(Another Premiere CC thing?)
         self.mediatype = tree.findtext("sourcetrack/mediatype")
+        # the number (from 1) of the track this clip is on in the sequence, set by
+        # XmemlSequence, and its type: 'video' or 'audio'
+        self.tracknumber = None
+        # the track numbers from the top sequence down to this clip, set by
+        # XmemlSequence, e.g. (2, 1) for a clip on track 1 of a sequence nested on track 2
+        self.layers = None
+        try:
+            self.tracktype = tree.getparent().getparent().tag
+        except AttributeError:
+            self.tracktype = None
         self.trackindex = int(
             tree.findtext("sourcetrack/trackindex") or -1
         )  # might not have trackindex (Is this a Premiere CC thing?)
-        self.linkedclips = [Link(el) for el in tree.iter("link")]
-        self.isnestedsequence = tree.find("sequence/media") is not None
-        self.filters = []
-        # Determine if clipitem is enabled. From the docs:
-        # Description   A Boolean value specifying whether or not the parent element is enabled.
-        # Parents       track, clipitem, clip, generatoritem, sequence, filter
-        # Notes         If you do not specify enabled, the default setting is TRUE.
-        if tree.find("enabled") is None:
-            self.enabled = True
-        else:
-            self.enabled = str(tree.findtext("enabled")).upper() != "FALSE"
+        self.masterclipid = tree.findtext("masterclipid")
+        self.linkedclips = [Link(el) for el in tree.iterchildren(tag="link")]
+        # the nested <sequence> may be a full definition or just a reference by id
+        _nested = tree.find("sequence")
+        self.isnestedsequence = _nested is not None
+        self.nestedsequenceid = _nested.get("id") if _nested is not None else None
+        self.parent = None  # the clipitem of the nested sequence this clip is mapped from
+        self.filters = None  # list of Effect, read by getfilters()
+        self.enabled = isenabled(tree)
+        self._digest = None
+
+    def nestedin(self, parent):
+        """Return a copy of this clip from a nested sequence, mapped to sequence time
+        through the parent clipitem's start and in point, and trimmed to the
+        parent's in and out points. Returns None if nothing of it is used."""
+        start = max(self.start, parent.inpoint)
+        end = min(self.end, parent.outpoint)
+        if start >= end:
+            return None
+        ci = copy.copy(self)
+        ci.inpoint = self.inpoint + (start - self.start)
+        ci.outpoint = self.outpoint - (self.end - end)
+        ci.duration = ci.outpoint - ci.inpoint
+        ci.start = parent.start + (start - parent.inpoint)
+        ci.end = parent.start + (end - parent.inpoint)
+        ci.parent = parent
+        ci.layers = (parent.layers or (parent.tracknumber,)) + (
+            self.layers or (self.tracknumber,)
+        )
+        ci._digest = None
+        return ci
+
+    def trimmed(self, start=None, end=None):
+        """Return a copy of this clip trimmed to the sequence frames start-end, with
+        its in and out points moved along, or the clip itself if it is within them.
+        A bound of None is open. Returns None if nothing of the clip is within."""
+        _start = self.start if start is None else max(self.start, start)
+        _end = self.end if end is None else min(self.end, end)
+        if _start >= _end:
+            return None
+        if (_start, _end) == (self.start, self.end):
+            return self
+        ci = copy.copy(self)
+        ci.inpoint = self.inpoint + (_start - self.start)
+        ci.outpoint = self.outpoint - (self.end - _end)
+        ci.duration = ci.outpoint - ci.inpoint
+        ci.start, ci.end = _start, _end
+        ci._digest = None
+        return ci
+
+    def isvisible(self):
+        """Returns False if an enabled Opacity filter hides this clip: a value of 0,
+        or keyframes that are all 0. Doesn't check if the clip is enabled."""
+        for e in self.getfilters():
+            if not e.enabled:
+                continue
+            if "opacity" in (str(e.effectid).lower(), str(e.name).lower()):
+                if e.parameters:
+                    return any(value > 0 for when, value in e.parameters)
+                return e.value is None or e.value > 0
+        return True
+
+    def islinked(self):
+        "Returns True if this clip is linked to other clips (not just itself)"
+        return any(link.linkclipref != self.id for link in self.linkedclips)
+
+    def digest(self):
+        """Return a ClipDigest of hashes of the position (track, start, end), the
+        source timing (in, out), the source (file or nested sequence) and the
+        levels (audio levels, gain and enabled) of this clip. Two versions of a
+        clip differ in a part if the hashes of that part differ."""
+        if self._digest is None:
+            levels = self.getlevels()
+            gain = self.getgain()
+            if self.file is not None:
+                source = _digest(self.file.id, self.file.pathurl, self.file.name)
+            else:
+                source = _digest(self.nestedsequenceid, self.name)
+            self._digest = ClipDigest(
+                position=_digest(self.tracktype, self.tracknumber, self.start, self.end),
+                timing=_digest(self.inpoint, self.outpoint),
+                source=source,
+                levels=_digest(
+                    self.enabled,
+                    levels and (levels.value, levels.parameters),
+                    gain and gain.value,
+                ),
+            )
+        return self._digest
 
     def getfilters(self):
-        if len(self.filters) == 0:
+        if self.filters is None:
             self.filters = [
                 Effect(el) for el in self.tree.iterdescendants(tag="effect")
             ]
@@ -316,146 +489,197 @@ class ClipItem(Item):
     def getfollowingtransition(self):
         return self.gettransition("./following-sibling::transitionitem[1]")
 
-    def audibleframes(self, threshold=AUDIOTHRESHOLD):
-        "Returns list of (start, end) pairs of audible chunks"
-        if not self.mediatype == "audio":
-            return None  # is video
-        if isinstance(threshold, Volume) and threshold.gain is not None:
-            threshold = threshold.gain
+    def audiopayload(self):
+        """Return an AudioPayload: the plain values audibleframes() needs, to
+        analyze the clip without its xml, e.g. in another process."""
+        levels = self.getlevels()
+        gain = self.getgain()
         frate = self.getframerate()
         if frate is None:
             logging.warning(
                 'audibleframes: framerate is None for clip id "%r"', self.id
             )
-            _r = None
+        return AudioPayload(
+            self.id,
+            self.name,
+            self.mediatype,
+            self.start,
+            self.end,
+            self.inpoint,
+            self.outpoint,
+            frate[0] if frate is not None else None,
+            (levels.value, tuple(levels.parameters)) if levels is not None else None,
+            gain.value if gain is not None else None,
+        )
+
+    def audibleframes(self, threshold=AUDIOTHRESHOLD):
+        "Returns list of (start, end) pairs of audible chunks"
+        return audibleframes(self.audiopayload(), threshold)
+
+    def getframerate(self):
+        # reimplemented from Item to take self.sequenceframerate into account on audio clips
+        if self.file.mediatype == "audio":
+            return self.sequenceframerate
         else:
-            _r = frate[0]
-        levels = self.getlevels()
-        keyframelist = list(levels is not None and levels.parameters or [])
-        if not len(keyframelist):
-            # no list of params, use <value>
-            # logging.debug('audibleframes: clip "%s": no keyframes found, using one value: %s',
-            #              self.id, levels)
-            if levels is not None:
-                # logging.debug('comparing clip level :%r with threshold :%r', levels.value, threshold)
-                if levels.value > threshold:
-                    # the one level is above the threshold
-                    return Ranges(Range((self.start, self.end)), framerate=_r)
-                else:
-                    return Ranges(framerate=_r)  # return empty Ranges
-
-            # levels is None, check gain
-            _db = (
-                self.getgain()
-            )  # confusingly, premiere uses decibel in the Gain effect
-
-            if _db is not None:
-                vol = Volume(decibel=_db.value)
-                logging.info(
-                    'audibleframes() clip "%s" (from "%s"): no levels, but gain: %s',
-                    self.id,
-                    self.name,
-                    vol.gain,
-                )
-                if vol.gain > threshold:
-                    return Ranges(Range((self.start, self.end)), framerate=_r)
-                else:
-                    return Ranges(
-                        framerate=_r
-                    )  # gain is lower than threshold, return empty Ranges
+            return super(ClipItem, self).getframerate()
+
 
-            # by now, both the audio levels and gain have been None.
-            # testing show that  this means that the whole clip should be  audible
-            # Please file a bug if you disagree with this
+def audibleframes(clip, threshold=AUDIOTHRESHOLD):
+    """Returns the Ranges of audible frames of clip, an AudioPayload (see
+    ClipItem.audiopayload()), or None for video clips.
+
+    This only uses the plain values of the payload, so it can run anywhere."""
+    if not clip.mediatype == "audio":
+        return None  # is video
+    if isinstance(threshold, Volume) and threshold.gain is not None:
+        threshold = threshold.gain
+    _r = clip.framerate
+    levels = clip.levels  # (value, keyframes) or None
+    keyframelist = list(levels is not None and levels[1] or [])
+    if not len(keyframelist):
+        # no list of params, use <value>
+        # logging.debug('audibleframes: clip "%s": no keyframes found, using one value: %s',
+        #              clip.id, levels)
+        if levels is not None:
+            # logging.debug('comparing clip level :%r with threshold :%r', levels.value, threshold)
+            if levels[0] > threshold:
+                # the one level is above the threshold
+                return Ranges(Range((clip.start, clip.end)), framerate=_r)
+            else:
+                return Ranges(framerate=_r)  # return empty Ranges
 
+        # levels is None, check gain
+        _db = clip.gain  # confusingly, premiere uses decibel in the Gain effect
+
+        if _db is not None:
+            vol = Volume(decibel=_db)
             logging.info(
-                'No gain and no audio levels metadata for this clip ("%s"), guessing it should be audible',
-                self.name,
+                'audibleframes() clip "%s" (from "%s"): no levels, but gain: %s',
+                clip.id,
+                clip.name,
+                vol.gain,
             )
-            return Ranges(Range((self.start, self.end)), framerate=_r)
+            if vol.gain > threshold:
+                return Ranges(Range((clip.start, clip.end)), framerate=_r)
+            else:
+                return Ranges(
+                    framerate=_r
+                )  # gain is lower than threshold, return empty Ranges
 
-        # At this point, we have a keyframelist to go through
-        # add our subclip inpoint to the keyframelist if it's not in it already.
-        #
-        if self.inpoint < keyframelist[0][0]:
-            keyframelist.insert(0, (self.inpoint, keyframelist[0][1]))
-        else:
-            i = 0
-            while self.inpoint > keyframelist[i][0]:
-                try:
-                    if self.inpoint < keyframelist[i + 1][0]:
-                        # add inpoint keyframe with volume of next keyframe
-                        # print ' add inpoint keyframe with volume of next keyframe'
-                        # print 'keyframelist.insert(%s, (%s, %s))' %( i+1, self.inpoint, keyframelist[i+1][1])
-                        keyframelist.insert(
-                            i + 1, (self.inpoint, keyframelist[i + 1][1])
-                        )
-                except IndexError:
-                    # all keyframes in keyframelist are _before_ inpoint
-                    # print ' all keyframes in keyframelist are _before_ inpoint'
-                    keyframelist.append((self.inpoint, keyframelist[i][1]))
-                i = i + 1
-            del i
-
-        # print "keyfrmelist. ", keyframelist
-        # add our sublicp outpoint to the keyframelist, too
-        if self.outpoint > keyframelist[-1][0]:
-            # last existing keyframe is earlier than outpoint, add last keyframe volume
-            keyframelist.append((self.outpoint, keyframelist[-1][1]))
+        # by now, both the audio levels and gain have been None.
+        # testing show that  this means that the whole clip should be  audible
+        # Please file a bug if you disagree with this
+
+        logging.info(
+            'No gain and no audio levels metadata for this clip ("%s"), guessing it should be audible',
+            clip.name,
+        )
+        return Ranges(Range((clip.start, clip.end)), framerate=_r)
+
+    # At this point, we have a keyframelist to go through
+    # add our subclip inpoint to the keyframelist if it's not in it already.
+    #
+    if clip.inpoint < keyframelist[0][0]:
+        keyframelist.insert(0, (clip.inpoint, keyframelist[0][1]))
+    else:
+        i = 0
+        while clip.inpoint > keyframelist[i][0]:
+            try:
+                if clip.inpoint < keyframelist[i + 1][0]:
+                    # add inpoint keyframe with volume of next keyframe
+                    # print ' add inpoint keyframe with volume of next keyframe'
+                    # print 'keyframelist.insert(%s, (%s, %s))' %( i+1, clip.inpoint, keyframelist[i+1][1])
+                    keyframelist.insert(
+                        i + 1, (clip.inpoint, keyframelist[i + 1][1])
+                    )
+            except IndexError:
+                # all keyframes in keyframelist are _before_ inpoint
+                # print ' all keyframes in keyframelist are _before_ inpoint'
+                keyframelist.append((clip.inpoint, keyframelist[i][1]))
+            i = i + 1
+        del i
+
+    # print "keyfrmelist. ", keyframelist
+    # add our sublicp outpoint to the keyframelist, too
+    if clip.outpoint > keyframelist[-1][0]:
+        # last existing keyframe is earlier than outpoint, add last keyframe volume
+        keyframelist.append((clip.outpoint, keyframelist[-1][1]))
+    else:
+        i = len(keyframelist) - 1
+        while clip.outpoint < keyframelist[i][0]:
+            try:
+                if clip.outpoint > keyframelist[i - 1][0]:
+                    # add outpoint keyframe with volume of previous keyframe
+                    # print ' add outpoint keyframe with volume of previous keyframe'
+                    keyframelist.insert(i, (clip.outpoint, keyframelist[i][1]))
+            except IndexError:
+                # TODO: properly diagnose and fix this
+                # print clip.name, keyframelist, i
+                raise
+            i = i - 1
+        del i
+
+    # now, run through the keyframelist and keep the keyframes that are within
+    # our audible range (clip.inpoint - clip.outpoint), whose volume is
+    # at or above our current gain level ('threshold' method argument)
+    #
+    audible = False
+    ranges = Ranges(framerate=_r)
+    for keyframe, volume in keyframelist:
+        # discard everything outside .inpoint and .outpoint
+        if keyframe < clip.inpoint:
+            # keyframe falls outside of the current clip, to the left
+            continue
+        if keyframe > clip.outpoint:
+            # keyframe falls outside of the current clip, to the right
+            break  # we're finished
+        # store this frame, and translate the keyframe from local to the clip
+        # to global to the full sequence
+        thisframe = clip.start + (keyframe - clip.inpoint)
+        if volume >= threshold:
+            if audible is True:
+                continue  # previous frame was also audible
+            audible = True
+            prevframe = thisframe
         else:
-            i = len(keyframelist) - 1
-            while self.outpoint < keyframelist[i][0]:
-                try:
-                    if self.outpoint > keyframelist[i - 1][0]:
-                        # add outpoint keyframe with volume of previous keyframe
-                        # print ' add outpoint keyframe with volume of previous keyframe'
-                        keyframelist.insert(i, (self.outpoint, keyframelist[i][1]))
-                except IndexError:
-                    # TODO: properly diagnose and fix this
-                    # print self.name, keyframelist, i
-                    raise
-                i = i - 1
-            del i
-
-        # now, run through the keyframelist and keep the keyframes that are within
-        # our audible range (self.inpoint - self.outpoint), whose volume is
-        # at or above our current gain level ('threshold' method argument)
-        #
-        audible = False
-        ranges = Ranges(framerate=self.getframerate()[0])
-        for keyframe, volume in keyframelist:
-            # discard everything outside .inpoint and .outpoint
-            if keyframe < self.inpoint:
-                # keyframe falls outside of the current clip, to the left
-                continue
-            if keyframe > self.outpoint:
-                # keyframe falls outside of the current clip, to the right
-                break  # we're finished
-            # store this frame, and translate the keyframe from local to the clip
-            # to global to the full sequence
-            thisframe = self.start + (keyframe - self.inpoint)
-            if volume >= threshold:
-                if audible is True:
-                    continue  # previous frame was also audible
-                audible = True
-                prevframe = thisframe
-            else:
-                if audible is False:
-                    continue  # previous frame was also inaudible
-                # level has gone below threshold, write out range so far
-                ranges.extend(Range((prevframe, thisframe)))
-                audible = False
-        # write out the last frame if it hasn't been written
-        if audible is True:
+            if audible is False:
+                continue  # previous frame was also inaudible
+            # level has gone below threshold, write out range so far
             ranges.extend(Range((prevframe, thisframe)))
-        return ranges
+            audible = False
+    # write out the last frame if it hasn't been written
+    if audible is True:
+        ranges.extend(Range((prevframe, thisframe)))
+    return ranges
 
-    def getframerate(self):
-        # reimplemented from Item to take self.sequenceframerate into account on audio clips
-        if self.file.mediatype == "audio":
-            return self.sequenceframerate
-        else:
-            return super(ClipItem, self).getframerate()
+
+def _audibleframesmany(payloads, threshold):
+    "audibleframes() for a list of AudioPayloads, as one task for a process pool"
+    return [audibleframes(payload, threshold) for payload in payloads]
+
+
+_workerparser = None  # the XmemlParser of a process pool worker, see _initaudioworker()
+
+
+def _initaudioworker(filename, profile):
+    "Parse filename once in each process of the pool of audibleranges(processes=True)"
+    global _workerparser
+    _workerparser = XmemlParser(filename, profile)
+
+
+def _audibletrack(sequenceid, number, threshold, where, start, end):
+    """Analyze the pure audio clips of one audio track in a process pool worker.
+
+    Returns (name, file id, Ranges) per clip, in the order of the serial path."""
+    for sequence in _workerparser.itersequences(ids=[sequenceid]):
+        return [
+            (clip.name, clip.file.id, sequence._audibleframesin(clip, threshold, start, end))
+            for clip in sequence._iterclipsin(
+                "audio", where=where, start=start, end=end, tracks=(number,)
+            )
+            if sequence._ispureaudio(clip)
+        ]
+    return []
 
 
 class Link(object):
@@ -466,17 +690,84 @@ class Link(object):
         self.mediatype = tree.findtext("mediatype")
         self.trackindex = tree.findtext("trackindex")
         self.clipindex = tree.findtext("clipindex")
+        self.clip = None  # the target ClipItem, resolved by LinkGraph
+
+
+class LinkGroup(object):
+    """A connected component of linked clips, e.g. a video clip and its audio."""
+
+    def __init__(self, clips):
+        self.clips = tuple(clips)
+        self.hasvideo = any(c.tracktype == "video" for c in self.clips)
+        self.hasaudio = any(c.tracktype == "audio" for c in self.clips)
+
+    def __repr__(self):
+        return "LinkGroup" + repr(tuple(c.id for c in self.clips))
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __iter__(self):
+        return iter(self.clips)
+
+    def __contains__(self, clip):
+        return any(c is clip or c.id == clip for c in self.clips)
+
+
+class LinkGraph(object):
+    """The resolved <link> graph of a sequence.
+
+    Every Link.clip is pointed to its target ClipItem, and every clip id is
+    mapped to its LinkGroup, so group lookups are O(1).
+    """
+
+    def __init__(self, index):
+        parent = {}
+
+        def find(clipid):
+            root = clipid
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while parent[clipid] != root:  # path compression
+                parent[clipid], clipid = root, parent[clipid]
+            return root
+
+        for clipid, clip in index.byid.items():
+            find(clipid)
+            for link in clip.linkedclips:
+                link.clip = index.byid.get(link.linkclipref)
+                if link.clip is None:
+                    logging.warning(
+                        "Clip %s links to unknown clip %r", clipid, link.linkclipref
+                    )
+                    continue
+                parent[find(clipid)] = find(link.linkclipref)
+        components = {}
+        for clipid, clip in index.byid.items():
+            components.setdefault(find(clipid), []).append(clip)
+        self.groups = {}
+        for clips in components.values():
+            group = LinkGroup(clips)
+            for clip in clips:
+                self.groups[clip.id] = group
+
+    def __len__(self):
+        return len(set(map(id, self.groups.values())))
+
+    def group(self, clip):
+        """Get the LinkGroup of a ClipItem or clip id."""
+        return self.groups.get(getattr(clip, "id", clip))
 
 
 class File(BaseObject):
     # <!ELEMENT file (name | rate | duration | media | timecode | pathurl | width | height | mediaSource)*>
-    filelist = {}
+    filelist = {}  # the files of the last parsed file, for ClipItems without a filelist
 
-    def __init__(self, tree):
+    def __init__(self, tree, filelist=None):
         super(File, self).__init__(tree)
         self.id = tree.get("id")
-        self.filelist[self.id] = self
-        self.duration = float(
+        (File.filelist if filelist is None else filelist)[self.id] = self
+        self.duration = toframe(
             tree.findtext("duration") or -1
         )  # file might be a still image / graphics, with no duration
         self.pathurl = tree.findtext("pathurl")
@@ -484,6 +775,8 @@ class File(BaseObject):
             self.mediatype = "video"
         else:
             self.mediatype = "audio"
+        # markers in the media time of the file
+        self.markers = [Marker(el) for el in tree.iterchildren(tag="marker")]
 
 
 class Effect(object):
@@ -500,34 +793,28 @@ class Effect(object):
     def __init__(self, tree):
         self.name = tree.findtext("name")
         self.effectid = tree.findtext("effectid")
-        # Determine if an Effect is enabled. From the docs:
-        # Description   A Boolean value specifying whether or not the parent element is enabled.
-        # Parents       track, clipitem, clip, generatoritem, sequence, filter
-        # Notes         If you do not specify enabled, the default setting is TRUE.
-        _en = tree.getparent().findtext("enabled")
-        if _en is None:
-            self.enabled = True
-        else:
-            self.enabled = str(_en).upper() != "FALSE"
+        # Determine if an Effect is enabled. The <enabled> flag lives on the parent <filter>
+        self.enabled = isenabled(tree.getparent())
 
         self.value = None
         self.max = None
         self.min = None
+        self.parameters = []  # list of (when, value) keyframes
 
         params = tree.find("parameter")
         if params is not None:
-            self.parameters = self.getparameters(params)
+            self.parameters = list(self.getparameters(params))
             try:
                 self.value = float(params.findtext("value", 0.0))
                 self.max = float(tree.findtext("parameter/valuemax"))
                 self.min = float(tree.findtext("parameter/valuemin"))
-            except ValueError:
+            except (TypeError, ValueError):
                 # element not present
                 pass
 
     def getparameters(self, tree):
         for el in tree.iterchildren(tag="keyframe"):
-            yield (float(el.findtext("when")), float(el.findtext("value")))
+            yield (toframe(el.findtext("when")), float(el.findtext("value")))
 
     def __str__(self):
         return "<Effect: %(name)s. Value: %(value)s. Max/min: %(max)s/%(min)s>" % (
@@ -580,24 +867,1123 @@ class Marker(object):
 
     Parents clip, clipitem, sequence
     Subelements +*name, +in, +out,*marker, *comment, color
+
+    .inpoint and .outpoint are the raw values, in the time of the parent.
+    .start and .end are in sequence time, see Marker.onclip(). An <out> of -1
+    means the marker is a single point, so .end == .start.
     """
 
     def __init__(self, tree):
-        self.inpoint = int(tree.findtext("in"))
-        self.outpoint = int(tree.findtext("out"))
+        self.inpoint = toframe(tree.findtext("in"))
+        self.outpoint = toframe(tree.findtext("out"))
         self.name = tree.findtext("name")
         self.comment = tree.findtext("comment")
+        self.source = tree.getparent().tag  # sequence, clipitem or file
+        self.clip = None
+        self.start = self.inpoint
+        self.end = self.outpoint if self.outpoint != -1 else self.inpoint
 
     def __str__(self):
-        return "<Marker: {:s} <{:i}-{:i}>".format(
-            self.name, self.inpoint, self.outpoint
+        return "<Marker: {} <{}-{}>".format(self.name, self.start, self.end)
+
+    def onclip(self, clip):
+        """Return a copy of a clip or file marker, translated to sequence time
+        using the clip's start and in point. Returns None if the marker is
+        outside the used part of the clip."""
+        if self.inpoint > clip.outpoint or self.end < clip.inpoint:
+            return None
+        marker = copy.copy(self)
+        marker.clip = clip
+        marker.start = clip.start + (max(self.inpoint, clip.inpoint) - clip.inpoint)
+        marker.end = clip.start + (min(self.end, clip.outpoint) - clip.inpoint)
+        return marker
+
+
+class MarkerIndex(object):
+    """All markers of a sequence, sorted by start frame.
+
+    Supports O(log n) range and nearest-marker queries.
+    """
+
+    def __init__(self, markers):
+        self.markers = sorted(markers, key=lambda m: (m.start, m.end))
+        self.starts = [m.start for m in self.markers]
+        # running maximum of the end frames, to find the first marker reaching into a window
+        self.maxends = []
+        _max = None
+        for m in self.markers:
+            if _max is None or m.end > _max:
+                _max = m.end
+            self.maxends.append(_max)
+
+    def __len__(self):
+        return len(self.markers)
+
+    def __iter__(self):
+        return iter(self.markers)
+
+    def window(self, start, end):
+        """Get a list of the markers that overlap the frames start-end (inclusive)."""
+        lo = bisect_left(self.maxends, start)
+        hi = bisect_right(self.starts, end)
+        return [m for m in self.markers[lo:hi] if m.end >= start]
+
+    def nearest(self, frame):
+        """Get the marker starting nearest to frame, or None if there are no markers."""
+        i = bisect_left(self.starts, frame)
+        candidates = self.markers[max(i - 1, 0) : i + 1]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda m: abs(m.start - frame))
+
+
+class ClipWindowIndex(object):
+    """The clips of a sequence, sorted by start frame.
+
+    Like MarkerIndex, a window query costs O(log n) and the clips it returns.
+    """
+
+    def __init__(self, clips):
+        # keep the position of each clip, to return them in sequence order
+        self.clips = sorted(enumerate(clips), key=lambda c: (c[1].start, c[1].end))
+        self.starts = [ci.start for _i, ci in self.clips]
+        # running maximum of the end frames, to find the first clip reaching into a window
+        self.maxends = []
+        _max = None
+        for _i, ci in self.clips:
+            if _max is None or ci.end > _max:
+                _max = ci.end
+            self.maxends.append(_max)
+
+    def __len__(self):
+        return len(self.clips)
+
+    def window(self, start=None, end=None):
+        """Get a list of the clips that overlap the frames start-end (end not
+        included), in sequence order. A bound of None is open."""
+        lo = 0 if start is None else bisect_right(self.maxends, start)
+        hi = len(self.clips) if end is None else bisect_left(self.starts, end)
+        return [
+            ci
+            for _i, ci in sorted(
+                c for c in self.clips[lo:hi] if start is None or c[1].end > start
+            )
+        ]
+
+
+class ClipIndex(object):
+    """Hash indexes of the clips in a sequence.
+
+    Clips are looked up by id, file id, pathurl, name and masterclipid in O(1).
+    The lists hold the clips in sequence order, video tracks first.
+    """
+
+    def __init__(self):
+        self.byid = {}
+        self.byfileid = {}
+        self.bypathurl = {}
+        self.byname = {}
+        self.bymasterclipid = {}
+
+    def __len__(self):
+        return len(self.byid)
+
+    def add(self, clip):
+        # the first clip wins if an id is repeated (e.g. in reused nested sequences)
+        self.byid.setdefault(clip.id, clip)
+        self.byname.setdefault(clip.name, []).append(clip)
+        if clip.masterclipid is not None:
+            self.bymasterclipid.setdefault(clip.masterclipid, []).append(clip)
+        if clip.file is not None:
+            self.byfileid.setdefault(clip.file.id, []).append(clip)
+            if clip.file.pathurl is not None:
+                self.bypathurl.setdefault(clip.file.pathurl, []).append(clip)
+
+
+class ClipFilter(object):
+    """A declarative filter of clips, for the where argument of itervideoclips(),
+    iteraudioclips() and audibleranges(). A clip matches if it matches all the
+    conditions given:
+
+      tracks     track numbers (from 1) in the sequence, e.g. range(3, 7) for A3-A6
+      enabled    True for enabled clips only, False for disabled clips only
+      fileid     a file id, or a collection of them
+      pathurl    a regular expression, searched for in the pathurl of the file
+      name       a regular expression, searched for in the clip name
+      mediatype  'video' or 'audio', the media type of the file
+
+    The conditions are compiled once per file into checks of the raw <clipitem>,
+    so tracks and clips that don't match are skipped before any ClipItem is built:
+
+        music = ClipFilter(tracks=range(3, 7), pathurl=r'/Music Library/')
+        for clip in xmeml.iteraudioclips(where=music):
+            ...
+
+    Clips of nested sequences are matched by the track of their parent clip,
+    and by their own name and file.
+    """
+
+    def __init__(
+        self, tracks=None, enabled=None, fileid=None, pathurl=None, name=None, mediatype=None
+    ):
+        self.tracks = frozenset(tracks) if tracks is not None else None
+        self.enabled = enabled
+        if fileid is None or isinstance(fileid, (str, bytes)):
+            self.fileids = frozenset([fileid]) if fileid is not None else None
+        else:
+            self.fileids = frozenset(fileid)
+        self.pathurl = re.compile(pathurl) if pathurl is not None else None
+        self.name = re.compile(name) if name is not None else None
+        self.mediatype = mediatype
+        self._compiled = None  # (filelist, checks, file ids)
+
+    def __getstate__(self):
+        # the compiled checks are closures, compile() again where it's unpickled
+        state = self.__dict__.copy()
+        state["_compiled"] = None
+        return state
+
+    @property
+    def enabledonly(self):
+        """False if the filter asks for disabled clips, which the iterators skip
+        otherwise. Disabled tracks are included then, too."""
+        return self.enabled is not False
+
+    def matchestrack(self, number):
+        "Returns True if clips on track number may match"
+        return self.tracks is None or number in self.tracks
+
+    def _fileids(self, filelist):
+        # the ids of the files that match, or None if any file (or none) does
+        if self.pathurl is None and self.mediatype is None:
+            return self.fileids
+        pathurl, mediatype = self.pathurl, self.mediatype
+        ids = frozenset(
+            fileid
+            for fileid, f in filelist.items()
+            if (pathurl is None or (f.pathurl and pathurl.search(f.pathurl)))
+            and (mediatype is None or f.mediatype == mediatype)
         )
+        return ids if self.fileids is None else ids & self.fileids
+
+    def compile(self, filelist):
+        """Return the checks of a <clipitem> element for the files in filelist
+        (the File registry of an XmemlParser), as a list of functions that must
+        all return True for the clip to match."""
+        if self._compiled is not None and self._compiled[0] is filelist:
+            return self._compiled[1]
+        checks = []
+        if self.enabled is not None:
+            enabled = self.enabled
+            checks.append(lambda el: isenabled(el) == enabled)
+        if self.name is not None:
+            search = self.name.search
+            checks.append(lambda el: search(el.findtext("name") or "") is not None)
+        fileids = self._fileids(filelist)
+        if fileids is not None:
+
+            def checkfile(el):
+                f = el.find("file")
+                return f is not None and f.get("id") in fileids
+
+            checks.append(checkfile)
+        self._compiled = (filelist, checks, fileids)
+        return checks
+
+    def matches(self, clip):
+        """Returns True if a ClipItem matches, but for its track. Call compile()
+        first."""
+        _filelist, _checks, fileids = self._compiled
+        if self.enabled is not None and clip.enabled != self.enabled:
+            return False
+        if self.name is not None and self.name.search(clip.name or "") is None:
+            return False
+        if fileids is not None and (clip.file is None or clip.file.id not in fileids):
+            return False
+        return True
+
 
+class XmemlSequence(object):
+    """A lightweight view of one <sequence>, with the clip iterators and the
+    audibleranges API.
+
+    XmemlParser is the view of the first sequence in a file, get the others
+    from XmemlParser.itersequences(). Nothing is extracted until it's asked for.
+    """
 
-class XmemlParser(object):
-    def __init__(self, filename):
+    def __init__(self, document, sequence):
+        self.document = document  # the XmemlParser of the file
+        self.sequence = sequence  # the <sequence> element
+        self.id = sequence.get("id")
+        self.name = sequence.findtext("name")
+        self._index = None
+        self._indexed = {}  # mediatype: all its clips, from a complete _iterclips() pass
+        self._linkgraph = None
+        self._markers = None
+        self._sequencemarkers = None
+        self._timecode = None
+        self._windows = {}
+        self._released = False  # clips have been released, see _release()
+        self._videolinks = None  # ids of clips linked to video, see _linkedtovideo()
+
+    def _clearcaches(self):
+        self._index = None
+        self._indexed = {}
+        self._windows = {}
+        self._linkgraph = None
+        self._markers = None
+        self._sequencemarkers = None
+        self._timecode = None
+        if not self._released:
+            self._videolinks = None
+
+    def __repr__(self):
+        return "<XmemlSequence: {!r} ({!r})>".format(self.name, self.id)
+
+    def itermarkers(self):
+        """Iterator to get all sequence markers."""
+        for marker in self.sequencemarkers:
+            yield marker
+
+    @property
+    def markers(self):
+        """The MarkerIndex of this sequence, with sequence, clip and file markers.
+
+        Collected in one pass over the enabled clips on first access. Clip and file
+        markers are translated to sequence time. The same marker on several
+        linked clips is only included once, markers of clips that are not
+        linked are all kept.
+        """
+        self._checkopen(released="markers")
+        if self._markers is None:
+            markers = list(self.sequencemarkers)
+            seen = set()
+            for mediatype in ("video", "audio"):
+                for ci in self._iterclips(mediatype):
+                    # linked clips list the same links, so they share an owner
+                    links = frozenset([ci.id] + [l.linkclipref for l in ci.linkedclips])
+                    clipmarkers = [Marker(el) for el in ci.tree.iterchildren(tag="marker")]
+                    if ci.file is not None:
+                        clipmarkers.extend(ci.file.markers)
+                    for marker in clipmarkers:
+                        marker = marker.onclip(ci)
+                        if marker is None:
+                            continue
+                        owner = (links, ci.file.id if marker.source == "file" else None)
+                        key = (owner, marker.start, marker.end, marker.name, marker.comment)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        markers.append(marker)
+            self._markers = MarkerIndex(markers)
+        return self._markers
+
+    @property
+    def sequencemarkers(self):
+        if self._sequencemarkers is None:
+            self._sequencemarkers = [
+                Marker(el) for el in self.sequence.findall("marker")
+            ]
+        return self._sequencemarkers
+
+    def markersin(self, start, end):
+        """Get a list of all markers overlapping the frames start-end, in sequence time."""
+        return self.markers.window(start, end)
+
+    def nearestmarker(self, frame):
+        """Get the marker starting closest to frame, in sequence time."""
+        return self.markers.nearest(frame)
+
+    def _sequenceframerate(self):
+        seq_rate = self.sequence.find("rate")
+        return getframerate(
+            toframe(seq_rate.findtext("timebase")), seq_rate.findtext("ntsc") == "TRUE"
+        )
+
+    @property
+    def timecode(self):
+        """The TimecodeFormat of the sequence, to convert frames to and from
+        its timecode, e.g. xmeml.timecode.formatranges(ranges)."""
+        if self._timecode is None:
+            self._timecode = TimecodeFormat.fromsequence(self.sequence)
+        return self._timecode
+
+    def _checkopen(self, released=None):
+        """Raise XmemlError if the parser is closed, or, with released, if clips of
+        this sequence have been released, so released can't be built."""
+        if self.document.closed:
+            raise XmemlError("The XmemlParser of this sequence is closed")
+        if released is not None and self._released:
+            raise XmemlError(
+                "Clips of this sequence have been released, so the {} can't be used".format(
+                    released
+                )
+            )
+
+    def _itertracks(self, mediatype, enabledonly=True, sequence=None):
+        """Iterator to get (tracknumber, <track>) pairs for 'video' or 'audio'.
+
+        Tracks are numbered from 1, like V1/A1 in the editing application.
+        """
+        self._checkopen()
+        if sequence is None:
+            sequence = self.sequence
+        media = sequence.find("media/" + mediatype)
+        if media is None:
+            return
+        for number, track in enumerate(media.iterchildren(tag="track"), 1):
+            if enabledonly and not isenabled(track):
+                logging.info("Track is disabled, skipping")
+                continue
+            yield number, track
+
+    def _iterclips(
+        self,
+        mediatype,
+        enabledonly=True,
+        sequence=None,
+        _nesting=(),
+        release=False,
+        where=None,
+        tracks=None,
+    ):
+        """Iterator to get all clips of a media type, with nested sequences expanded.
+
+        Clips from nested sequences are mapped to the time of the parent clip,
+        see ClipItem.nestedin(). With release, see _release(). With where, a
+        ClipFilter, only the matching clips are built. With tracks, only the
+        clips of those track numbers.
+
+        A plain pass that turns out to see every clip (none was disabled) is
+        kept for the index, so the index doesn't traverse the xml again.
+        """
+        self._checkopen()
+        sequenceframerate = self._sequenceframerate()
+        logging.info(
+            "_iterclips(%s): got sequenceframerate: %r", mediatype, sequenceframerate
+        )
+        if release:
+            self._prepareforrelease()
+        if where is not None and not where.enabledonly:
+            enabledonly = False
+        indexed = None
+        if (
+            self._index is None
+            and mediatype not in self._indexed
+            and sequence is None
+            and not _nesting
+            and not release
+            and where is None
+            and tracks is None
+        ):
+            indexed = []
+            if enabledonly and not all(
+                isenabled(track) for _number, track in self._itertracks(mediatype, False)
+            ):
+                indexed = None
+        checks = where.compile(self.document.filelist) if where is not None else ()
+        for number, track in self._itertracks(mediatype, enabledonly, sequence):
+            if where is not None and not where.matchestrack(number):
+                continue
+            if tracks is not None and number not in tracks:
+                continue
+            if release:
+                clips = _itersiblings(track.find("clipitem"), "clipitem")
+            else:
+                clips = track.iterchildren(tag="clipitem")
+            for clip in clips:
+                if checks and clip.find("sequence") is None:
+                    if not all(check(clip) for check in checks):
+                        if release:
+                            clip.clear()
+                            clip.getparent().remove(clip)
+                        continue
+                ci = ClipItem(clip, sequenceframerate, self.document.filelist)
+                ci.tracknumber = number
+                ci.layers = (number,)
+                if enabledonly and not ci.enabled:
+                    logging.info("Clip %s/%s is disabled, skipping", ci.id, ci.name)
+                    if release:
+                        self._release(ci)
+                    indexed = None
+                    continue
+                if ci.isnestedsequence:
+                    if enabledonly:
+                        indexed = None  # disabled nested clips are skipped too
+                    nestedclips = self._nestedclips(
+                        ci.nestedsequenceid, mediatype, enabledonly, _nesting
+                    )
+                    if release:
+                        self._release(ci)
+                    for nestedci in nestedclips:
+                        if where is not None and not where.matches(nestedci):
+                            continue
+                        nestedci = nestedci.nestedin(ci)
+                        if nestedci is not None:
+                            nestedci.tracknumber = number
+                            if indexed is not None:
+                                indexed.append(nestedci)
+                            yield nestedci
+                    continue
+                if release:
+                    self._release(ci)
+                if indexed is not None:
+                    indexed.append(ci)
+                yield ci
+        if indexed is not None:
+            self._indexed[mediatype] = indexed
+
+    def _iterclipsin(
+        self, mediatype, release=False, where=None, start=None, end=None, tracks=None
+    ):
+        """Iterator to get the clips of a media type overlapping the frames start-end,
+        not trimmed. Without a window, this is _iterclips(). With one, the clips
+        come from a ClipWindowIndex of all enabled clips, built on first use."""
+        if start is None and end is None:
+            for ci in self._iterclips(
+                mediatype, release=release, where=where, tracks=tracks
+            ):
+                yield ci
+            return
+        if release:
+            raise XmemlError("Clips can't be released from a window of the sequence")
+        if where is not None:
+            where.compile(self.document.filelist)
+        enabledonly = where is None or where.enabledonly
+        for ci in self._windowindex(mediatype, enabledonly).window(start, end):
+            if tracks is not None and ci.tracknumber not in tracks:
+                continue
+            if where is None or (where.matchestrack(ci.tracknumber) and where.matches(ci)):
+                yield ci
+
+    def _windowindex(self, mediatype, enabledonly=True):
+        "The ClipWindowIndex of a media type, built on first use"
+        self._checkopen(released="window index")
+        key = (mediatype, enabledonly)
+        if key not in self._windows:
+            self._windows[key] = ClipWindowIndex(self._iterclips(mediatype, enabledonly))
+        return self._windows[key]
+
+    def _prepareforrelease(self):
+        """Read what needs all clips, before the first clip is released: the nested
+        sequence definitions (they may be inside released clips), and which clips
+        are linked to video."""
+        if self._released:
+            return
+        self.document.sequencedefinitions
+        self._linkedtovideo()
+        self._released = True
+
+    def _linkedtovideo(self):
+        """The set of ids of the clips linked to a video clip, read once. From the
+        LinkGraph if it's built already, else from the <link> elements, so no
+        ClipItem is built for it."""
+        if self._videolinks is None:
+            if self._linkgraph is not None:
+                self._videolinks = set(
+                    clipid
+                    for clipid, group in self._linkgraph.groups.items()
+                    if group.hasvideo
+                )
+            else:
+                self._videolinks = self._scanvideolinks()
+        return self._videolinks
+
+    def _scanvideolinks(self):
+        """Return the set of ids of the clips linked to a video clip, like the
+        LinkGraph, but from the <link>s of the <clipitem> elements, without
+        building any ClipItem."""
+        parent = {}
+
+        def find(clipid):
+            root = clipid
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while parent[clipid] != root:  # path compression
+                parent[clipid], clipid = root, parent[clipid]
+            return root
+
+        links = []
+        video = set()
+        elements = [self.sequence]
+        scanned = set()
+        while elements:
+            for el in elements.pop().iter("clipitem"):
+                clipid = el.get("id")
+                find(clipid)
+                if el.getparent().getparent().tag == "video":
+                    video.add(clipid)
+                links.extend(
+                    (clipid, ref) for ref in el.xpath("link/linkclipref/text()")
+                )
+                nested = el.find("sequence")
+                if nested is not None and nested.get("id") not in scanned:
+                    # clips of nested sequences referenced by id are defined elsewhere
+                    scanned.add(nested.get("id"))
+                    definition = self.document.sequencedefinitions.get(nested.get("id"))
+                    if definition is not None and nested.find("media") is None:
+                        elements.append(definition)
+        for clipid, ref in links:
+            if ref in parent:
+                parent[find(clipid)] = find(ref)
+        roots = set(find(clipid) for clipid in video)
+        return set(clipid for clipid in list(parent) if find(clipid) in roots)
+
+    def _release(self, ci):
+        """Read what ClipItem ci needs from its <clipitem>, and clear and remove the
+        element from the tree to free its memory. ci.tree is set to None.
+
+        The index, link graph, markers and window indexes of the sequence can't
+        be used after clips have been released, and raise XmemlError."""
+        ci.getfilters()
+        el = ci.tree
+        el.clear()
+        el.getparent().remove(el)
+        ci.tree = None
+
+    def _nestedclips(self, sequenceid, mediatype, enabledonly=True, _nesting=()):
+        """Get a list of all clips of a nested sequence, in its own time.
+
+        Every nested sequence is expanded once, to any depth, and reused for all
+        the clips referencing it, in all sequences of the file. The cache is
+        filled under a lock, so threads share it too.
+        """
+        cache = self.document._nestedcache
+        key = (sequenceid, mediatype, enabledonly, self._sequenceframerate())
+        if key in cache:
+            return cache[key]
+        with self.document._nestedlock:  # reentrant, for sequences nested in nested ones
+            if key not in cache:
+                if sequenceid in _nesting:
+                    logging.warning("Sequence %r is nested in itself, skipping", sequenceid)
+                    return []
+                definition = self.document.sequencedefinitions.get(sequenceid)
+                if definition is None:
+                    logging.warning("Nested sequence %r is not defined", sequenceid)
+                    cache[key] = []
+                else:
+                    cache[key] = list(
+                        self._iterclips(
+                            mediatype, enabledonly, definition, _nesting + (sequenceid,)
+                        )
+                    )
+            return cache[key]
+
+    def itervideoclips(self, release=False, where=None, start=None, end=None):
+        """Iterator to get all video clips.
+
+        With release, each <clipitem> is cleared and removed from the tree as soon
+        as its ClipItem is built, so a pass over a huge sequence only keeps the
+        current clips in memory. Only the links between the clips are read
+        first. The released clips are gone from the tree, for every later
+        iteration and edit, and the index, the link graph, the markers and
+        windows of the sequence raise XmemlError from then on.
+
+        With where, a ClipFilter, only the clips matching it are built and
+        returned, e.g. where=ClipFilter(tracks=[1, 2]) for V1 and V2.
+
+        With start or end, only the clips overlapping the sequence frames
+        start-end (end not included) are returned, trimmed to them, see
+        ClipItem.trimmed(). The clips are looked up in an index of the sequence,
+        so after the first call, a window costs the clips in it. Windows can't
+        be released.
+        """
+        for ci in self._iterclipsin("video", release, where, start, end):
+            if start is not None or end is not None:
+                ci = ci.trimmed(start, end)
+                if ci is None:
+                    continue
+            yield ci
+
+    def visiblesegments(self):
+        """Return the clip on screen at every frame of the sequence, as a sorted list
+        of (start, end, ClipItem) segments, where each segment is as long as possible.
+        Frames without any clip on screen have no segment.
+
+        The clip on the top-most track wins. Clips of a nested sequence are
+        layered by their tracks, within the track of their parent clip. Disabled
+        tracks and clips, and clips hidden by their Opacity filter, don't count.
+        """
+        clips = [
+            ci
+            for ci in self._iterclips("video")
+            if 0 <= ci.start < ci.end and ci.isvisible()
+        ]
+        # sweep over the start and end frames, with the clips on screen in a heap,
+        # top-most first. Clips that have ended are only removed from the heap
+        # when they come to the top
+        events = sorted(
+            [(ci.end, 0, i) for i, ci in enumerate(clips)]
+            + [(ci.start, 1, i) for i, ci in enumerate(clips)]
+        )
+        priorities = [
+            tuple(-layer for layer in ci.layers or (ci.tracknumber,)) for ci in clips
+        ]
+        heap = []
+        ended = set()
+        segments = []
+        previous = None
+        for frame, starts, i in events:
+            if previous is not None and frame > previous:
+                while heap and heap[0][1] in ended:
+                    heappop(heap)
+                if heap:
+                    top = clips[heap[0][1]]
+                    if segments and segments[-1][2] is top and segments[-1][1] == previous:
+                        segments[-1] = (segments[-1][0], frame, top)
+                    else:
+                        segments.append((previous, frame, top))
+            previous = frame
+            if starts:
+                heappush(heap, (priorities[i], i))
+            else:
+                ended.add(i)
+        return segments
+
+    def iteraudioclips(
+        self, onlypureaudio=True, release=False, where=None, start=None, end=None
+    ):
+        """Iterator to get all audio clips.
+
+        onlypureaudio parameter controls whether to limit to clips that have no video
+        clip assosiated with it (i.e. music, sound effects). Defaults to true.
+        Linked clips are checked against the link graph, other clips by the
+        media type of their file. For release, where, start and end, see
+        itervideoclips().
+        """
+        for ci in self._iterclipsin("audio", release, where, start, end):
+            if onlypureaudio and not self._ispureaudio(ci):
+                continue
+            if start is not None or end is not None:
+                ci = ci.trimmed(start, end)
+                if ci is None:
+                    continue
+            yield ci
+
+    def _ispureaudio(self, ci):
+        if ci.file is None:
+            # clip without a valid file reference
+            # TODO: figure out the cause of this
+            logging.debug("Clip without a file reference: %s (from %s)", ci.id, ci.name)
+            return False
+        if ci.islinked():
+            # sync sound may come from an audio file, so ask the links
+            return ci.id not in self._linkedtovideo()
+        return ci.file.mediatype == "audio"
+
+    @property
+    def index(self):
+        """The ClipIndex of this sequence.
+
+        It is built lazily on first access, from the clips of an earlier
+        complete iteration if there was one, else with one traversal of all
+        clips (enabled or not). Later lookups don't touch the xml again.
+        """
+        self._checkopen(released="index")
+        if self._index is None:
+            index = ClipIndex()
+            for mediatype in ("video", "audio"):
+                clips = self._indexed.get(mediatype)
+                if clips is None:
+                    clips = self._iterclips(mediatype, enabledonly=False)
+                for ci in clips:
+                    index.add(ci)
+            self._index = index
+            self._indexed = {}
+        return self._index
+
+    @property
+    def linkgraph(self):
+        """The LinkGraph of this sequence, built once on first access."""
+        self._checkopen(released="link graph")
+        if self._linkgraph is None:
+            self._linkgraph = LinkGraph(self.index)
+        return self._linkgraph
+
+    def linkgroup(self, clip):
+        """Get the LinkGroup (all linked clips) of a ClipItem or clip id."""
+        return self.linkgraph.group(clip)
+
+    def islinkedtovideo(self, clip):
+        """Returns True if a ClipItem or clip id is linked to any video clip."""
+        group = self.linkgraph.group(clip)
+        return group is not None and group.hasvideo
+
+    def getclip(self, clipid):
+        """Get the ClipItem with <clipitem id="clipid">, or None."""
+        return self.index.byid.get(clipid)
+
+    def getclipsbyfile(self, fileid):
+        """Get a list of all ClipItems using <file id="fileid">."""
+        return self.index.byfileid.get(fileid, [])
+
+    def getclipsbypathurl(self, pathurl):
+        """Get a list of all ClipItems using a file with this <pathurl>."""
+        return self.index.bypathurl.get(pathurl, [])
+
+    def getclipsbyname(self, name):
+        """Get a list of all ClipItems with this <name>."""
+        return self.index.byname.get(name, [])
+
+    def getclipsbymasterclipid(self, masterclipid):
+        """Get a list of all ClipItems with this <masterclipid>."""
+        return self.index.bymasterclipid.get(masterclipid, [])
+
+    def diff(self, other):
+        """Compare this sequence (the old version) with other (the new version).
+        Returns a SequenceDiff, see xmeml.diff."""
+        from .diff import diff
+
+        return diff(self, other)
+
+    def fingerprint(self):
+        """Return the SequenceFingerprint of this sequence, see xmeml.fingerprint."""
+        from .fingerprint import fingerprint
+
+        return fingerprint(self)
+
+    def writesnapshot(self, output):
+        """Write a binary snapshot of the clips, files, effects and markers of
+        this sequence to output, a filename. See xmeml.snapshot."""
+        from .snapshot import writesnapshot
+
+        return writesnapshot(self, output)
+
+    def audibleranges(
+        self,
+        threshold=AUDIOTHRESHOLD,
+        release=False,
+        workers=None,
+        processes=False,
+        where=None,
+        start=None,
+        end=None,
+    ):
+        """Return the audible Ranges and the File of every audio clip name, as two dicts.
+
+        With workers > 1, the audio tracks are analyzed by a pool of threads, one
+        task per track: each task reads its clips from the xml, builds them and
+        analyzes them. The work is mostly Python, so threads only speed it up
+        where lxml or the file system let go of the GIL. With processes=True, a
+        pool of processes is used instead, which scales with the cores: each
+        worker parses the file once by its name, and analyzes whole tracks. A
+        file parsed from a file-like object can't be parsed again, so then the
+        AudioPayloads of each track are read here and sent to the workers.
+        Either way, the Ranges are merged in the same order as the serial path,
+        so the result is the same.
+        For release, where, start and end, see itervideoclips(): with a window,
+        only the clips in it are analyzed, and their Ranges are trimmed to it.
+        Process workers never touch the clips of this sequence, so release
+        doesn't release anything in the workers with a filename.
+        """
+        if workers is not None and workers > 1:
+            if processes:
+                return self._processaudibleranges(threshold, release, workers, where, start, end)
+            return self._parallelaudibleranges(threshold, release, workers, where, start, end)
+        clips = {}
+        files = {}
+        for clip, _file, ranges in self.iteraudibleranges(
+            threshold, release=release, where=where, start=start, end=end
+        ):
+            if clip.name in clips:
+                clips[clip.name] += ranges
+            else:
+                clips[clip.name] = ranges
+            files.update({clip.name: _file})
+        return clips, files
+
+    def iteraudibleranges(
+        self,
+        threshold=AUDIOTHRESHOLD,
+        grouped=False,
+        release=False,
+        where=None,
+        start=None,
+        end=None,
+    ):
+        """Iterator to get (ClipItem, File, Ranges) for every pure audio clip, as soon
+        as it is analyzed, in the order of audibleranges().
+
+        With grouped, get (name, File, Ranges) instead, with the Ranges of all the
+        clips with that name merged, like audibleranges(). A name is returned as
+        soon as its last clip is analyzed, found by counting the names of the
+        <clipitem>s first. For release, where, start and end, see audibleranges().
+        """
+        window = start is not None or end is not None
+        clips = self._iterclipsin("audio", release, where, start, end)
+        if grouped:
+            if window:
+                clips = list(clips)  # the index is built, so count the clips
+                remaining = {}
+                for clip in clips:
+                    remaining[clip.name] = remaining.get(clip.name, 0) + 1
+            else:
+                remaining = self._countaudionames(where)
+            merged = {}
+        for clip in clips:
+            if self._ispureaudio(clip):
+                ranges = self._audibleframesin(clip, threshold, start, end)
+                if not grouped:
+                    yield clip, clip.file, ranges
+                elif clip.name in merged:
+                    merged[clip.name][0] = clip.file
+                    merged[clip.name][1] += ranges
+                else:
+                    merged[clip.name] = [clip.file, ranges]
+            if grouped:
+                remaining[clip.name] = remaining.get(clip.name, 1) - 1
+                if remaining[clip.name] <= 0 and clip.name in merged:
+                    _file, ranges = merged.pop(clip.name)
+                    yield clip.name, _file, ranges
+        if grouped:
+            # names counted too often, e.g. clips of nested sequences cut by their parent
+            for name, (_file, ranges) in merged.items():
+                yield name, _file, ranges
+
+    @staticmethod
+    def _audibleframesin(clip, threshold, start=None, end=None):
+        # analyze the whole clip, then trim, so the levels are read the same way
+        ranges = clip.audibleframes(threshold)
+        if (start is not None or end is not None) and ranges is not None:
+            ranges = ranges.within(start, end)
+        return ranges
+
+    def _countaudionames(self, where=None):
+        """Count the names of the audio clips _iterclips() will return, from the
+        <clipitem> elements and the nested sequences, which are cached anyway.
+        Clips of nested sequences that are cut away by their parent are counted."""
+        counts = {}
+        checks = where.compile(self.document.filelist) if where is not None else ()
+        enabledonly = where is None or where.enabledonly
+        for number, track in self._itertracks("audio", enabledonly):
+            if where is not None and not where.matchestrack(number):
+                continue
+            for clip in track.iterchildren(tag="clipitem"):
+                if enabledonly and not isenabled(clip):
+                    continue
+                nested = clip.find("sequence")
+                if nested is not None:
+                    names = [
+                        ci.name
+                        for ci in self._nestedclips(nested.get("id"), "audio", enabledonly)
+                        if where is None or where.matches(ci)
+                    ]
+                elif checks and not all(check(clip) for check in checks):
+                    continue
+                else:
+                    names = [clip.findtext("name")]
+                for name in names:
+                    counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def audiblereport(self, threshold=AUDIOTHRESHOLD, **kwargs):
+        """Return audibleranges() as a dict of plain values, ready for json.dumps().
+        Keyword arguments are passed on to audibleranges()."""
+        clips, files = self.audibleranges(threshold, **kwargs)
+        try:
+            timecode = self.timecode
+        except ValueError:  # no rate, no timecode
+            timecode = None
+        report = {"sequence": self.id, "name": self.name, "clips": []}
+        for name, ranges in clips.items():
+            _file = files.get(name)
+            clip = {
+                "name": name,
+                "pathurl": _file.pathurl if _file is not None else None,
+                "frames": len(ranges),
+                "seconds": float(ranges.seconds()) if ranges.framerate else None,
+                "ranges": [list(r) for r in ranges],
+            }
+            if timecode is not None:
+                clip["timecodes"] = [list(tc) for tc in timecode.formatranges(ranges)]
+            report["clips"].append(clip)
+        return report
+
+    def _parallelaudibleranges(self, threshold, release, workers, where, start, end):
+        # read what the tasks share before fanning out
+        if release:
+            self._prepareforrelease()
+        else:
+            self._linkedtovideo()
+        if start is not None or end is not None:
+            self._windowindex("audio", where is None or where.enabledonly)
+        if where is not None:
+            where.compile(self.document.filelist)
+        numbers = [
+            number
+            for number, _track in self._itertracks("audio", where is None or where.enabledonly)
+            if where is None or where.matchestrack(number)
+        ]
+
+        def analyzetrack(number):
+            return [
+                (clip.name, clip.file, self._audibleframesin(clip, threshold, start, end))
+                for clip in self._iterclipsin(
+                    "audio", release, where, start, end, tracks=(number,)
+                )
+                if self._ispureaudio(clip)
+            ]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(analyzetrack, numbers))
+        logging.info(
+            "audibleranges: %i tracks on %i workers", len(numbers), workers
+        )
+        return self._mergeaudibleranges(results)
+
+    @staticmethod
+    def _mergeaudibleranges(results):
+        # merge the (name, File, Ranges) lists of the tracks in the order of the serial path
+        clips = {}
+        files = {}
+        for result in results:
+            for name, _file, ranges in result:
+                if name in clips:
+                    clips[name] += ranges
+                else:
+                    clips[name] = ranges
+                files.update({name: _file})
+        return clips, files
+
+    def _processaudibleranges(self, threshold, release, workers, where, start, end):
+        filename = self.document.filename
+        if filename is None:
+            return self._payloadaudibleranges(threshold, release, workers, where, start, end)
+        self._checkopen()
+        numbers = [
+            number
+            for number, _track in self._itertracks("audio", where is None or where.enabledonly)
+            if where is None or where.matchestrack(number)
+        ]
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initaudioworker,
+            initargs=(filename, self.document.profile),
+        ) as pool:
+            tasks = [
+                pool.submit(_audibletrack, self.id, number, threshold, where, start, end)
+                for number in numbers
+            ]
+            results = [task.result() for task in tasks]
+        logging.info(
+            "audibleranges: %i tracks on %i processes", len(numbers), workers
+        )
+        filelist = self.document.filelist
+        return self._mergeaudibleranges(
+            [(name, filelist.get(fileid), ranges) for name, fileid, ranges in result]
+            for result in results
+        )
+
+    def _payloadaudibleranges(self, threshold, release, workers, where, start, end):
+        # read the AudioPayloads of each track here, and only analyze them in the pool
+        tracks = {}
+        clips = []
+        for clip in self._iterclipsin("audio", release, where, start, end):
+            if self._ispureaudio(clip):
+                tracks.setdefault(clip.tracknumber, []).append(clip.audiopayload())
+                clips.append(clip)
+        numbers = sorted(tracks)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = dict(
+                zip(
+                    numbers,
+                    pool.map(
+                        _audibleframesmany,
+                        [tracks[number] for number in numbers],
+                        [threshold] * len(numbers),
+                    ),
+                )
+            )
+        logging.info(
+            "audibleranges: %i clips of %i tracks on %i processes",
+            len(clips),
+            len(numbers),
+            workers,
+        )
+        positions = dict((number, iter(results[number])) for number in numbers)
+        merged = []
+        for clip in clips:  # in the order they were read
+            ranges = next(positions[clip.tracknumber])
+            if (start is not None or end is not None) and ranges is not None:
+                ranges = ranges.within(start, end)
+            merged.append((clip.name, clip.file, ranges))
+        return self._mergeaudibleranges([merged])
+
+
+class ParserProfile(object):
+    """How XmemlParser reads a file, to save memory and time on big exports.
+
+    Whitespace and comments are dropped, and the subtrees in prune (tags that
+    xmeml.iter never reads) are removed as soon as they are parsed, so the
+    tree never holds more than one of them. Set huge_tree for files with
+    very deep trees or very long texts, which libxml2 refuses by default.
+
+        xmeml = XmemlParser(filename, profile=ParserProfile())
+    """
+
+    PRUNE = (
+        "itemhistory",
+        "logginginfo",
+        "appspecificdata",
+        "privatestate",
+        "samplecharacteristics",
+    )
+
+    def __init__(
+        self, prune=PRUNE, remove_blank_text=True, remove_comments=True, huge_tree=False
+    ):
+        self.prune = tuple(prune)
+        self.remove_blank_text = remove_blank_text
+        self.remove_comments = remove_comments
+        self.huge_tree = huge_tree
+
+    def __repr__(self):
+        return "<ParserProfile prune={!r}>".format(self.prune)
+
+    @property
+    def lossy(self):
+        "True if parsing with this profile drops more than whitespace"
+        return bool(self.prune) or self.remove_comments
+
+    def parse(self, source):
+        """Parse source, a filename or a file-like object, and return the ElementTree."""
+        options = dict(
+            remove_blank_text=self.remove_blank_text,
+            remove_comments=self.remove_comments,
+            huge_tree=self.huge_tree,
+        )
+        if not self.prune:
+            return etree.parse(source, etree.XMLParser(**options))
+        context = etree.iterparse(source, events=("end",), tag=self.prune, **options)
+        pruned = 0
+        for _event, el in context:
+            parent = el.getparent()
+            if parent is None:
+                continue
+            if el.tail:  # keep the text that follows it
+                previous = el.getprevious()
+                if previous is not None:
+                    previous.tail = (previous.tail or "") + el.tail
+                else:
+                    parent.text = (parent.text or "") + el.tail
+            parent.remove(el)
+            pruned += 1
+        logging.debug("ParserProfile.parse: pruned %i elements", pruned)
+        return context.root.getroottree()
+
+
+class XmemlParser(XmemlSequence):
+    def __init__(self, filename, profile=None):
+        """Parse filename, a filename or a file-like object. Give a ParserProfile
+        to read big files with less memory."""
+        self.profile = profile
+        # parsed again by name in the workers of audibleranges(processes=True)
+        self.filename = None if hasattr(filename, "read") else filename
         try:
-            self.tree = etree.parse(filename)
+            if profile is None:
+                self.tree = etree.parse(filename)
+            else:
+                self.tree = profile.parse(filename)
         except AttributeError:
             raise XmemlFileError("Parsing xml failed. Seems like a broken XMEML file.")
         if not self.tree.getroot().tag == "xmeml":
@@ -618,122 +2004,130 @@ class XmemlParser(object):
         ):  # fcp7 and Premiere cc encodes the whole project like this
             self.root = self.tree.getroot().find("project/children/bin/children")
         try:
-            self.name = self.root.find("sequence").get("id")
+            super(XmemlParser, self).__init__(self, self.root.find("sequence"))
         except AttributeError:
             raise XmemlFileError("No sequence found. Nothing to do.")
+        self.name = self.id
         if self.tree.find("enabled") is not None:
             # from the spec:
             # Notes If you do not specify enabled, the default setting is TRUE.
             if str(self.tree.findtext("enabled")).upper() == "FALSE":
                 raise XmemlFileError("Sequence is not enabled. Nothing to do.")
+        self._sequencedefinitions = None
+        self._nestedcache = {}
+        self._nestedlock = threading.RLock()
+        self._sequences = {self.id: self}
         # find all file references
-        File.filelist = {
-            f.get("id"): File(f)
-            for f in self.root.iter("file")
-            if f.findtext("name") is not None
-        }
+        # File registers itself in our own filelist, so clips of this file get the
+        # right File while other files are parsed, in other threads too
+        self.filelist = {}
+        for f in self.root.iter("file"):
+            if f.findtext("name") is not None:
+                File(f, self.filelist)
+        File.filelist = self.filelist
+        self.closed = False
+
+    def __enter__(self):
+        return self
 
-    def itermarkers(self):
-        """Iterator to get all sequence markers."""
-        for _marker in self.root.findall("sequence/marker"):
-            yield Marker(_marker)
-
-    def itervideoclips(self):
-        """Iterator to get all video clips."""
-        video = self.root.find("sequence/media/video")
-        seq_rate = self.root.find("sequence/rate")
-        sequenceframerate = getframerate(
-            float(seq_rate.findtext("timebase")), seq_rate.findtext("ntsc") == "TRUE"
-        )
-        logging.info("itervideoclips: got sequenceframerate: %r", sequenceframerate)
-        for track in video.iterchildren(tag="track"):
-            if track.find("enabled") is not None:
-                # from the spec:
-                # Notes If you do not specify enabled, the default setting is TRUE.
-                if str(track.findtext("enabled")).upper() == "FALSE":
-                    logging.info("Track is disabled, skipping")
-                    continue
+    def __exit__(self, *exc):
+        self.close()
 
-            for clip in track.iterchildren(tag="clipitem"):
-                ci = ClipItem(clip, sequenceframerate)
-                if not ci.enabled:
-                    logging.info("Clip %s/%s is disabled, skipping", ci.id, ci.name)
-                    continue
-                if ci.isnestedsequence:
-                    # print clip.find('sequence').get('name')
-                    for nestedtrack in clip.find("sequence/media/video").iterchildren(
-                        tag="track"
-                    ):
-                        for nestedclip in nestedtrack.iterchildren(tag="clipitem"):
-                            nestedci = ClipItem(nestedclip, sequenceframerate)
-                            # from pprint import pprint
-                            # pprint(vars(nestedci))
-                            yield nestedci
-                    continue
-                yield ci
+    def close(self):
+        """Drop the tree, the file registry and everything cached from them, so
+        their memory can be freed. ClipItems and Files already handed out stay
+        usable, but the parser and its sequences can't iterate any more.
 
-    def iteraudioclips(self, onlypureaudio=True):
-        """Iterator to get all audio clips.
+        Also called at the end of a with block:
 
-        onlypureaudio parameter controls whether to limit to clips that have no video
-        clip assosiated with it (i.e. music, sound effects). Defaults to true.
+            with XmemlParser(filename) as xmeml:
+                ranges = xmeml.audibleranges()
         """
-        audio = self.root.find("sequence/media/audio")
-        seq_rate = audio.xpath("../../rate")[0]
-        sequenceframerate = getframerate(
-            float(seq_rate.findtext("timebase")), seq_rate.findtext("ntsc") == "TRUE"
-        )
-        logging.info("iteraudioclips: got sequenceframerate: %r", sequenceframerate)
-        for track in audio.iterchildren(tag="track"):
-            if track.find("enabled") is not None:
-                # from the spec:
-                # Notes If you do not specify enabled, the default setting is TRUE.
-                if str(track.findtext("enabled")).upper() == "FALSE":
-                    logging.info("Track is disabled, skipping")
-                    continue
-
-            for clip in track.iterchildren(tag="clipitem"):
-                ci = ClipItem(clip, sequenceframerate)
-                if not ci.enabled:
-                    logging.info("Clip %s/%s is disabled, skipping", ci.id, ci.name)
+        for sequence in self._sequences.values():
+            sequence._clearcaches()
+        self._sequences = {}
+        self._nestedcache = {}
+        self._sequencedefinitions = None
+        if File.filelist is self.filelist:
+            File.filelist = {}
+        self.filelist = {}
+        self.tree = self.root = self.sequence = None
+        self.closed = True
+
+    @property
+    def sequencedefinitions(self):
+        """Dict of all <sequence> definitions in the file, by id.
+
+        A nested sequence is written out in full once, and referenced by id
+        (<sequence id="..."/>) in the other clips using it.
+        """
+        self._checkopen()
+        if self._sequencedefinitions is None:
+            self._sequencedefinitions = {
+                el.get("id"): el
+                for el in self.tree.iter("sequence")
+                if el.find("media") is not None
+            }
+        return self._sequencedefinitions
+
+    def itersequences(self, ids=None, names=None):
+        """Iterator to get an XmemlSequence for every sequence in the file.
+
+        This includes all sequences of a project export, in bins or not, but not
+        the nested sequences inside clips. Pass a list of ids and/or names to
+        only get those. Other sequences are skipped without being looked at.
+        """
+        self._checkopen()
+        seen = set()
+        for el in self.tree.iter("sequence"):
+            if el.getparent().tag == "clipitem":
+                continue  # nested sequence
+            sequenceid = el.get("id")
+            if sequenceid in seen:
+                continue
+            seen.add(sequenceid)
+            if el.find("media") is None:
+                # a reference to a sequence defined elsewhere
+                el = self.sequencedefinitions.get(sequenceid)
+                if el is None:
                     continue
-                if ci.isnestedsequence:
-                    # print clip.find('sequence').get('name')
-                    for nestedtrack in clip.find("sequence/media/audio").iterchildren(
-                        tag="track"
-                    ):
-                        for nestedclip in nestedtrack.iterchildren(tag="clipitem"):
-                            nestedci = ClipItem(nestedclip, sequenceframerate)
-                            # from pprint import pprint
-                            # pprint(vars(nestedci))
-                            if not onlypureaudio:
-                                yield nestedci
-                            elif nestedci.file is None:
-                                # clip without a valid file reference
-                                # TODO: figure out the cause of this
-                                logging.warning(
-                                    "Nested clip without a file reference: %s (from %s)"
-                                    % (nestedci.id, nestedci.name)
-                                )
-                                continue
-                            elif nestedci.file.mediatype == "audio":
-                                yield nestedci
+            if ids is not None or names is not None:
+                if not (
+                    (ids is not None and sequenceid in ids)
+                    or (names is not None and el.findtext("name") in names)
+                ):
                     continue
-                if not onlypureaudio:
-                    yield ci
-                elif ci.file is not None and ci.file.mediatype == "audio":
-                    yield ci
+            if sequenceid not in self._sequences:
+                self._sequences[sequenceid] = XmemlSequence(self, el)
+            yield self._sequences[sequenceid]
 
-    def audibleranges(self, threshold=AUDIOTHRESHOLD):
-        clips = {}
-        files = {}
-        for clip in self.iteraudioclips():
-            if clip.name in clips:
-                clips[clip.name] += clip.audibleframes(threshold)
-            else:
-                clips[clip.name] = clip.audibleframes(threshold)
-            files.update({clip.name: clip.file})
-        return clips, files
+    def edit(self):
+        """Get an XmemlEditor, to make batched edits and write them to a new file."""
+        from .edit import XmemlEditor
+
+        return XmemlEditor(self)
+
+    def analyzesequences(
+        self, threshold=AUDIOTHRESHOLD, ids=None, names=None, workers=None
+    ):
+        """Iterator to get (XmemlSequence, audibleranges) for every sequence in the file.
+
+        ids and names select sequences, like in itersequences(). With workers > 1, the
+        sequences are analyzed in parallel by a pool of threads. The analysis is
+        mostly Python, so threads only help where lxml or I/O let go of the GIL,
+        not with the number of cores. Results are always returned in file order.
+        """
+        sequences = self.itersequences(ids=ids, names=names)
+        if not workers or workers < 2:
+            for sequence in sequences:
+                yield sequence, sequence.audibleranges(threshold)
+            return
+        self.sequencedefinitions  # build it once, before the threads need it
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            sequences = list(sequences)
+            results = pool.map(lambda seq: seq.audibleranges(threshold), sequences)
+            for sequence, result in zip(sequences, results):
+                yield sequence, result
 
 
 if __name__ == "__main__":
@@ -0,0 +1,367 @@
+# -*- encoding: utf-8 -*-
+#
+# A long-running analysis service on a local Unix socket.
+#
+# Clients send requests as JSON lines, and get one JSON line back per
+# request, in order. A client may send many requests without waiting for
+# the answers (pipelining). The requests of all clients are analyzed by
+# one pool of warm worker threads, and results are kept in an LRU cache,
+# so a call costs a parse at most, not a Python process start.
+#
+#   python -m xmeml.service /tmp/xmeml.sock
+#
+# Needs Python 3: socketserver, queue and st_mtime_ns.
+#
+# A request:
+#   {"id": 1, "path": "/exports/a.xml", "analysis": "report", "threshold": 0.0001}
+# or with the file content in "xml" instead of "path". Analyses are the
+# keys of ANALYSES. The answer:
+#   {"id": 1, "ok": true, "result": ..., "cached": false, "elapsed": 0.02}
+# or {"id": 1, "ok": false, "error": "..."}
+#
+# (C) 2011-2020 havard.gulldahl@nrk.no
+# License: BSD
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import stat
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from .iter import AUDIOTHRESHOLD, ParserProfile, XmemlParser
+
+
+def _report(xmeml, request):
+    threshold = request.get("threshold", AUDIOTHRESHOLD)
+    return [sequence.audiblereport(threshold) for sequence in xmeml.itersequences()]
+
+
+def _clips(xmeml, request):
+    return [
+        {
+            "sequence": sequence.id,
+            "name": sequence.name,
+            "clips": [
+                {
+                    "id": clip.id,
+                    "name": clip.name,
+                    "track": "{}{}".format(
+                        (clip.tracktype or "?")[0].upper(), clip.tracknumber or ""
+                    ),
+                    "start": clip.start,
+                    "end": clip.end,
+                    "in": clip.inpoint,
+                    "out": clip.outpoint,
+                    "pathurl": clip.file.pathurl if clip.file is not None else None,
+                }
+                for clips in (
+                    sequence.itervideoclips(),
+                    sequence.iteraudioclips(onlypureaudio=False),
+                )
+                for clip in clips
+            ],
+        }
+        for sequence in xmeml.itersequences()
+    ]
+
+
+def _fingerprint(xmeml, request):
+    fingerprint = xmeml.fingerprint()
+    return {
+        "sequence": fingerprint.sequence,
+        "tracks": {
+            "{}{}".format(mediatype[0].upper(), number): fp
+            for (mediatype, number), fp in fingerprint.tracks.items()
+        },
+    }
+
+
+# analysis name -> function(XmemlParser, request) returning plain values
+ANALYSES = {"report": _report, "clips": _clips, "fingerprint": _fingerprint}
+
+
+class ServiceError(Exception):
+    pass
+
+
+def _socketid(path):
+    "(device, inode) of the socket at path, or None if there is none"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(st.st_mode):
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _removestalesocket(path):
+    """Remove a stale socket left at path by a service that is gone. Raises
+    ServiceError if path is not a socket, or a service still answers on it."""
+    if not os.path.lexists(path):
+        return
+    if _socketid(path) is None:
+        raise ServiceError("{} exists, and is not a socket".format(path))
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise ServiceError("Can't tell if {} is in use: {}".format(path, e))
+        os.unlink(path)  # nobody is listening
+        return
+    finally:
+        probe.close()
+    raise ServiceError("Another service is listening on {}".format(path))
+
+
+class LRUCache(object):
+    "A thread safe dict that keeps the maxsize most recently used items"
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+class AnalysisService(object):
+    """Analyze xmeml files for the clients of a Unix socket at path.
+
+    workers is the number of requests analyzed at a time, over all clients,
+    and pipeline the number of requests a client may have waiting for an
+    answer before the service stops reading from it.
+
+        service = AnalysisService('/tmp/xmeml.sock')
+        service.start()  # in a thread, or service.serve() to block
+        ...
+        service.close()
+    """
+
+    def __init__(self, path, workers=4, pipeline=16, cachesize=128, profile=None):
+        self.path = path
+        self.workers = workers
+        self.pipeline = pipeline
+        self.cache = LRUCache(cachesize)
+        self.profile = profile if profile is not None else ParserProfile()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._thread = None
+        self._serving = False
+        _removestalesocket(path)
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                service._handle(self.rfile, self.wfile)
+
+        self.server = _UnixServer(path, Handler)
+        self._socketid = _socketid(path)  # close() only removes the socket it made
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def serve(self):
+        "Answer requests until close() is called"
+        self._serving = True
+        try:
+            self.server.serve_forever()
+        finally:
+            self._serving = False
+
+    def start(self):
+        "Answer requests in a background thread"
+        self._thread = threading.Thread(target=self.serve, name="xmeml.service")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        if self._serving:  # shutdown() waits for serve() to return
+            self.server.shutdown()
+        self.server.server_close()
+        self._pool.shutdown(wait=True)
+        if self._thread is not None:
+            self._thread.join()
+        if self._socketid is not None and _socketid(self.path) == self._socketid:
+            os.unlink(self.path)
+        self._socketid = None
+
+    def _handle(self, rfile, wfile):
+        # read requests and hand them to the pool, while a writer answers them in order
+        answers = queue.Queue()
+        slots = threading.BoundedSemaphore(self.pipeline)
+
+        def write():
+            while True:
+                future = answers.get()
+                if future is None:
+                    return
+                response = future.result()
+                try:
+                    wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                    wfile.flush()
+                except (IOError, OSError):  # the client is gone
+                    pass
+                slots.release()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for line in rfile:
+                if not line.strip():
+                    continue
+                slots.acquire()
+                answers.put(self._pool.submit(self.answer, line))
+        finally:
+            answers.put(None)
+            writer.join()
+
+    def answer(self, line):
+        "Return the response to a request, a JSON line or a dict"
+        started = time.time()
+        request = {}
+        try:
+            request = json.loads(line) if not isinstance(line, dict) else line
+            result, cached = self._analyze(request)
+            response = {"ok": True, "result": result, "cached": cached}
+        except Exception as e:
+            logging.info("AnalysisService: request failed: %s", e)
+            response = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        response["elapsed"] = time.time() - started
+        return response
+
+    def _analyze(self, request):
+        analysis = request.get("analysis", "report")
+        if analysis == "ping":
+            return "pong", False
+        if analysis not in ANALYSES:
+            raise ServiceError("Unknown analysis: {!r}".format(analysis))
+        if "xml" in request:
+            data = request["xml"].encode("utf-8")
+            source = hashlib.sha1(data).hexdigest()
+        elif "path" in request:
+            data = None
+            st = os.stat(request["path"])
+            source = (request["path"], st.st_size, st.st_mtime_ns)
+        else:
+            raise ServiceError("A request needs a 'path' or 'xml'")
+        key = (source, analysis, request.get("threshold", AUDIOTHRESHOLD))
+        result = self.cache.get(key)
+        if result is not None:
+            return result, True
+        with XmemlParser(
+            BytesIO(data) if data is not None else request["path"], profile=self.profile
+        ) as xmeml:
+            result = ANALYSES[analysis](xmeml, request)
+        self.cache.put(key, result)
+        return result, False
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ServiceClient(object):
+    """A client of an AnalysisService.
+
+        with ServiceClient('/tmp/xmeml.sock') as client:
+            report = client.request(path='/exports/a.xml')['result']
+    """
+
+    def __init__(self, path, timeout=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self._rfile = self.socket.makefile("rb")
+        self._ids = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, request):
+        self._ids += 1
+        request.setdefault("id", self._ids)
+        self.socket.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+    def _receive(self):
+        line = self._rfile.readline()
+        if not line:
+            raise ServiceError("The service closed the connection")
+        return json.loads(line.decode("utf-8"))
+
+    def request(self, **request):
+        "Send one request and return the response"
+        self._send(request)
+        return self._receive()
+
+    def pipeline(self, requests):
+        """Send all requests (dicts) before reading any response, and return
+        the responses, in the same order."""
+        for request in requests:
+            self._send(dict(request))
+        return [self._receive() for _request in requests]
+
+    def close(self):
+        self._rfile.close()
+        self.socket.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Analyze xmeml files for local clients")
+    parser.add_argument(dest="socket", help="path of the Unix socket")
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    parser.add_argument("-c", "--cachesize", type=int, default=128)
+    parser.add_argument(
+        "-l",
+        "--loglevel",
+        choices=("debug", "info", "warning", "error"),
+        default="warning",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    service = AnalysisService(args.socket, workers=args.workers, cachesize=args.cachesize)
+    try:
+        service.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
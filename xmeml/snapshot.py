@@ -0,0 +1,366 @@
+# -*- encoding: utf-8 -*-
+#
+# Compact binary snapshots of sequences parsed with xmeml.iter.
+#
+# A snapshot holds the extracted model of a sequence in fixed-width
+# columns: one table each for clips, files, effects, keyframes and
+# markers, plus a string table. Readers mmap the file and get
+# zero-copy memoryviews of the columns, so a warm process can keep
+# thousands of snapshots open without deserializing any of them.
+#
+# Layout (native byte order, flagged in the header):
+#
+#   header     magic, format version, byte order, column count
+#   directory  table name, column name, typecode, row count, offset
+#              for each column
+#   columns    the column arrays, each aligned to 8 bytes
+#
+# (C) 2011-2020 havard.gulldahl@nrk.no
+# License: BSD
+
+from builtins import str  # be py2+py3 proof. pip install future
+import array
+import logging
+import mmap
+import struct
+import sys
+
+from .iter import XmemlError
+
+MAGIC = b"XMEMLSNP"
+VERSION = 2
+
+_HEADER = struct.Struct("<8sIBxxxI")  # magic, version, byte order, column count
+_COLUMN = struct.Struct("<16s16scxxxxxxxQQ")  # table, column, typecode, count, offset
+_BYTEORDER = {"little": 1, "big": 2}
+
+MEDIATYPES = ("video", "audio")
+MARKERSOURCES = ("sequence", "clipitem", "file")
+
+# table -> list of (column, typecode). Strings are indexes into the string table, -1 is None
+TABLES = (
+    (
+        "clips",
+        (
+            ("id", "i"),
+            ("name", "i"),
+            ("masterclipid", "i"),
+            ("file", "i"),  # row in files, or -1
+            ("tracktype", "b"),  # index in MEDIATYPES, or -1
+            ("tracknumber", "i"),
+            ("start", "q"),
+            ("end", "q"),
+            ("inpoint", "q"),
+            ("outpoint", "q"),
+            ("enabled", "b"),
+            ("firsteffect", "i"),  # row in effects
+            ("effectcount", "i"),
+        ),
+    ),
+    (
+        "files",
+        (
+            ("id", "i"),
+            ("name", "i"),
+            ("pathurl", "i"),
+            ("mediatype", "b"),
+            ("duration", "q"),
+            ("timebase", "d"),  # NaN if unknown
+        ),
+    ),
+    (
+        "effects",
+        (
+            ("clip", "i"),
+            ("name", "i"),
+            ("effectid", "i"),
+            ("enabled", "b"),
+            ("value", "d"),  # NaN if unknown
+            ("firstkeyframe", "i"),  # row in keyframes
+            ("keyframecount", "i"),
+        ),
+    ),
+    ("keyframes", (("when", "q"), ("value", "d"))),
+    (
+        "markers",
+        (
+            ("start", "q"),
+            ("end", "q"),
+            ("name", "i"),
+            ("comment", "i"),
+            ("source", "b"),  # index in MARKERSOURCES
+            ("clip", "i"),  # row in clips, or -1
+        ),
+    ),
+    ("strings", (("offsets", "Q"), ("data", "B"))),
+)
+
+
+class SnapshotError(XmemlError):
+    pass
+
+
+class SnapshotVersionError(SnapshotError):
+    pass
+
+
+def _float(value):
+    return float("nan") if value is None else float(value)
+
+
+class _StringTable(object):
+    def __init__(self):
+        self.index = {}
+        self.offsets = array.array("Q", [0])
+        self.data = bytearray()
+
+    def add(self, s):
+        if s is None:
+            return -1
+        if s not in self.index:
+            self.index[s] = len(self.index)
+            self.data.extend(s.encode("utf-8"))
+            self.offsets.append(len(self.data))
+        return self.index[s]
+
+
+def writesnapshot(sequence, output):
+    """Write a snapshot of an XmemlSequence (or XmemlParser) to output, a
+    filename. Returns the number of clips written."""
+    columns = {
+        (table, column): array.array(typecode)
+        for table, _columns in TABLES
+        for column, typecode in _columns
+    }
+    strings = _StringTable()
+
+    def add(table, **values):
+        for column, value in values.items():
+            columns[(table, column)].append(value)
+
+    files = {}
+    for fileid, _file in sorted(sequence.document.filelist.items()):
+        files[fileid] = len(files)
+        add(
+            "files",
+            id=strings.add(fileid),
+            name=strings.add(_file.name),
+            pathurl=strings.add(_file.pathurl),
+            mediatype=MEDIATYPES.index(_file.mediatype),
+            duration=_file.duration,
+            timebase=_float(_file.timebase),
+        )
+    clips = {}
+    effects = keyframes = 0
+    for mediatype in MEDIATYPES:
+        for ci in sequence._iterclips(mediatype):
+            # the row of the first clip with an id, for the clip column of markers
+            clips.setdefault(ci.id, len(columns[("clips", "id")]))
+            filters = ci.getfilters()
+            add(
+                "clips",
+                id=strings.add(ci.id),
+                name=strings.add(ci.name),
+                masterclipid=strings.add(ci.masterclipid),
+                file=files.get(ci.file.id, -1) if ci.file is not None else -1,
+                tracktype=MEDIATYPES.index(ci.tracktype)
+                if ci.tracktype in MEDIATYPES
+                else -1,
+                tracknumber=ci.tracknumber or 0,
+                start=ci.start,
+                end=ci.end,
+                inpoint=ci.inpoint,
+                outpoint=ci.outpoint,
+                enabled=int(ci.enabled),
+                firsteffect=effects,
+                effectcount=len(filters),
+            )
+            for effect in filters:
+                add(
+                    "effects",
+                    clip=len(columns[("clips", "id")]) - 1,
+                    name=strings.add(effect.name),
+                    effectid=strings.add(effect.effectid),
+                    enabled=int(effect.enabled),
+                    value=_float(effect.value),
+                    firstkeyframe=keyframes,
+                    keyframecount=len(effect.parameters),
+                )
+                for when, value in effect.parameters:
+                    add("keyframes", when=when, value=value)
+                keyframes += len(effect.parameters)
+            effects += len(filters)
+    for marker in sequence.markers:
+        add(
+            "markers",
+            start=marker.start,
+            end=marker.end,
+            name=strings.add(marker.name),
+            comment=strings.add(marker.comment),
+            source=MARKERSOURCES.index(marker.source),
+            clip=clips.get(marker.clip.id, -1) if marker.clip is not None else -1,
+        )
+    columns[("strings", "offsets")] = strings.offsets
+    columns[("strings", "data")] = array.array("B", bytes(strings.data))
+
+    # lay out the columns after the header and directory
+    layout = [
+        (table, column, typecode)
+        for table, _columns in TABLES
+        for column, typecode in _columns
+    ]
+    offset = _HEADER.size + _COLUMN.size * len(layout)
+    directory = []
+    for table, column, typecode in layout:
+        offset += -offset % 8
+        data = columns[(table, column)]
+        directory.append((table, column, typecode, len(data), offset))
+        offset += len(data) * data.itemsize
+    with open(output, "wb") as f:
+        f.write(
+            _HEADER.pack(MAGIC, VERSION, _BYTEORDER[sys.byteorder], len(directory))
+        )
+        for table, column, typecode, count, _offset in directory:
+            f.write(
+                _COLUMN.pack(
+                    table.encode("ascii"),
+                    column.encode("ascii"),
+                    typecode.encode("ascii"),
+                    count,
+                    _offset,
+                )
+            )
+        for table, column, typecode, count, _offset in directory:
+            f.write(b"\0" * (_offset - f.tell()))
+            columns[(table, column)].tofile(f)
+    clipcount = len(columns[("clips", "id")])
+    logging.info("writesnapshot: wrote %i clips to %r", clipcount, output)
+    return clipcount
+
+
+class SnapshotTable(object):
+    """A table of a Snapshot. table['column'] is a zero-copy memoryview of that
+    column, e.g. for numpy.frombuffer()."""
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns  # column name -> memoryview
+
+    def __repr__(self):
+        return "<SnapshotTable {}: {} rows>".format(self.name, len(self))
+
+    def __len__(self):
+        for view in self.columns.values():
+            return len(view)
+        return 0
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def row(self, i):
+        "Get row i as a dict. Mostly for debugging, this copies"
+        return {column: view[i] for column, view in self.columns.items()}
+
+
+class Snapshot(object):
+    """A snapshot file, opened read-only with mmap.
+
+        with Snapshot("sequence.snap") as snap:
+            starts = snap.clips["start"]
+            name = snap.string(snap.clips["name"][0])
+
+    Raises SnapshotVersionError if the file was written by another format version.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._file.close()
+            raise SnapshotError("Not a snapshot: {!r}".format(filename))
+        self._views = []
+        self.tables = {}
+        try:
+            self._read()
+        except Exception:
+            self.close()
+            raise
+
+    def _read(self):
+        if len(self._mmap) < _HEADER.size:
+            raise SnapshotError("Not a snapshot, file is too short")
+        magic, version, byteorder, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise SnapshotError("Not a snapshot, wrong magic {!r}".format(magic))
+        if version != VERSION:
+            raise SnapshotVersionError(
+                "Snapshot format version {} is not supported, expected {}".format(
+                    version, VERSION
+                )
+            )
+        if byteorder != _BYTEORDER[sys.byteorder]:
+            raise SnapshotError("Snapshot was written with another byte order")
+        memory = memoryview(self._mmap)
+        self._views.append(memory)
+        columns = {}
+        for i in range(count):
+            table, column, typecode, rows, offset = _COLUMN.unpack_from(
+                self._mmap, _HEADER.size + i * _COLUMN.size
+            )
+            table = table.rstrip(b"\0").decode("ascii")
+            column = column.rstrip(b"\0").decode("ascii")
+            typecode = typecode.decode("ascii")
+            size = array.array(typecode).itemsize
+            view = memory[offset : offset + rows * size].cast(typecode)
+            self._views.append(view)
+            columns.setdefault(table, {})[column] = view
+        for table, _columns in columns.items():
+            self.tables[table] = SnapshotTable(table, _columns)
+        self._stringoffsets = self.tables["strings"]["offsets"]
+        self._stringdata = self.tables["strings"]["data"]
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["tables"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, i):
+        "Get string number i from the string table, None for -1"
+        if i < 0:
+            return None
+        start, end = self._stringoffsets[i], self._stringoffsets[i + 1]
+        return bytes(self._stringdata[start:end]).decode("utf-8")
+
+    def close(self):
+        """Release the columns and close the file.
+
+        Drop arrays made from the columns (e.g. with numpy.frombuffer()) first:
+        the columns they use can't be released, so the mmap is left to be
+        unmapped when the last of them is gone."""
+        try:
+            busy = 0
+            for view in reversed(self._views):
+                try:
+                    view.release()
+                except BufferError:  # exported to an array that is still alive
+                    busy += 1
+            self._views = []
+            self.tables = {}
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            if busy:
+                logging.warning(
+                    "Snapshot.close: %i columns are still in use, the mmap stays open", busy
+                )
+        finally:
+            self._file.close()
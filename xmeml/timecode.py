@@ -0,0 +1,177 @@
+# -*- encoding: utf-8 -*-
+#
+# SMPTE timecode for xmeml sequences.
+#
+# Converts between sequence frames and timecode strings, with
+# drop-frame timecode for 29.97 and 59.94 fps and the <timecode>
+# offset of the sequence (the frame number of its first frame).
+# Many values at once are converted with NumPy when it is installed,
+# and with plain lists when it is not.
+#
+# (C) 2011-2020 havard.gulldahl@nrk.no
+# License: BSD
+
+from builtins import str  # be py2+py3 proof. pip install future
+import re
+
+try:
+    import numpy
+except ImportError:  # optional, pip install numpy
+    numpy = None
+
+TIMECODE = re.compile(r"^\s*(\d+)[:;.,](\d\d)[:;.,](\d\d)[:;.,](\d+)\s*$")
+
+
+class TimecodeFormat(object):
+    """How frames of a sequence are shown as timecode.
+
+    timebase is the nominal frame rate (e.g. 30 for 29.97 fps), and offset is
+    the frame number of sequence frame 0, as in <timecode><frame>.
+    Drop-frame timecode is only defined for NTSC rates with timebase 30 or 60.
+
+        >>> tc = TimecodeFormat(25, offset=900000)
+        >>> tc.format(50)
+        '10:00:02:00'
+        >>> tc.parse('10:00:02:00')
+        50
+    """
+
+    def __init__(self, timebase, dropframe=False, offset=0):
+        self.timebase = int(round(float(timebase)))
+        self.dropframe = bool(dropframe)
+        self.offset = int(offset)
+        if self.dropframe and self.timebase not in (30, 60):
+            raise ValueError(
+                "Drop-frame timecode is not defined for timebase {}".format(timebase)
+            )
+        # frames dropped at the start of each minute, except every tenth
+        self.dropped = self.timebase // 15 if self.dropframe else 0
+        self.framesperminute = self.timebase * 60 - self.dropped
+        self.framesper10minutes = self.timebase * 600 - self.dropped * 9
+        self.framesperday = 144 * self.framesper10minutes
+
+    def __repr__(self):
+        return "<TimecodeFormat {}{} offset {}>".format(
+            self.timebase, " DF" if self.dropframe else "", self.offset
+        )
+
+    @classmethod
+    def fromsequence(cls, sequence):
+        """Get the TimecodeFormat of a <sequence> element, from its <timecode>
+        (or its <rate> if there is no <timecode>, like in older xmeml versions)."""
+        timecode = sequence.find("timecode")
+        if timecode is None or timecode.find("rate/timebase") is None:
+            rate = sequence.find("rate")
+        else:
+            rate = timecode.find("rate")
+        timebase = rate.findtext("timebase") if rate is not None else None
+        if timebase is None:
+            raise ValueError("No <rate> found for sequence {!r}".format(sequence.get("id")))
+        ntsc = rate.findtext("ntsc") == "TRUE"
+        offset = 0
+        dropframe = False
+        if timecode is not None:
+            offset = int(float(timecode.findtext("frame", 0)))
+            dropframe = ntsc and timecode.findtext("displayformat") == "DF"
+        return cls(timebase, dropframe, offset)
+
+    def parse(self, timecode):
+        """Get the sequence frame of a timecode string, like '01:00:00:00' or
+        '00:59:59;29'. Raises ValueError for malformed timecodes."""
+        match = TIMECODE.match(timecode)
+        if match is None:
+            raise ValueError("Not a timecode: {!r}".format(timecode))
+        hours, minutes, seconds, frames = (int(field) for field in match.groups())
+        return self._absoluteframe(hours, minutes, seconds, frames) - self.offset
+
+    def _absoluteframe(self, hours, minutes, seconds, frames):
+        totalminutes = 60 * hours + minutes
+        return (
+            (3600 * hours + 60 * minutes + seconds) * self.timebase
+            + frames
+            - self.dropped * (totalminutes - totalminutes // 10)
+        )
+
+    def format(self, frame):
+        """Get the timecode string of a sequence frame."""
+        return self._join(*self._split(int(frame) + self.offset))
+
+    def _split(self, frame):
+        # works on ints and numpy arrays alike
+        frame = frame % self.framesperday
+        if self.dropped:
+            tens, rest = divmod(frame, self.framesper10minutes)
+            # add back the frame numbers that were skipped
+            skipped = (rest - self.dropped) // self.framesperminute
+            if numpy is not None and isinstance(skipped, numpy.ndarray):
+                skipped = numpy.maximum(skipped, 0)
+            else:
+                skipped = max(skipped, 0)
+            frame = frame + self.dropped * 9 * tens + self.dropped * skipped
+        seconds, frames = divmod(frame, self.timebase)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return hours, minutes, seconds, frames
+
+    def _join(self, hours, minutes, seconds, frames):
+        return "{:02d}:{:02d}:{:02d}{}{:02d}".format(
+            int(hours), int(minutes), int(seconds), ";" if self.dropframe else ":", int(frames)
+        )
+
+    def split(self, frames):
+        """Get the (hours, minutes, seconds, frames) fields of many sequence frames.
+        With NumPy, these are four integer arrays, otherwise four lists."""
+        if numpy is not None:
+            return self._split(numpy.asarray(frames, dtype=numpy.int64) + self.offset)
+        fields = [self._split(int(frame) + self.offset) for frame in frames]
+        return tuple(list(field) for field in zip(*fields)) if fields else ([], [], [], [])
+
+    def formatmany(self, frames):
+        """Get the timecode strings of many sequence frames. With NumPy,
+        this is an array of strings built with vectorized operations."""
+        if numpy is None:
+            return [self.format(frame) for frame in frames]
+        fields = self.split(frames)
+        separators = (":", ":", ";" if self.dropframe else ":", "")
+        timecodes = numpy.char.zfill(fields[0].astype(str), 2)
+        for separator, field in zip(separators, fields[1:]):
+            timecodes = numpy.char.add(timecodes, separator)
+            timecodes = numpy.char.add(timecodes, numpy.char.zfill(field.astype(str), 2))
+        return timecodes
+
+    def parsemany(self, timecodes):
+        """Get the sequence frames of many timecode strings. With NumPy and
+        timecodes of the common 'HH:MM:SS:FF' width, the digits are
+        converted as one array."""
+        if numpy is None or not len(timecodes):
+            return [self.parse(timecode) for timecode in timecodes]
+        try:
+            codes = numpy.asarray(timecodes, dtype="S")
+        except UnicodeEncodeError:
+            codes = None
+        if codes is None or codes.ndim != 1 or codes.dtype.itemsize != 11:
+            return numpy.array([self.parse(str(timecode)) for timecode in timecodes])
+        chars = codes.view(numpy.uint8).reshape(-1, 11).astype(numpy.int64)
+        digits = chars[:, [0, 1, 3, 4, 6, 7, 9, 10]] - ord("0")
+        separators = chars[:, [2, 5, 8]]
+        if (
+            ((digits < 0) | (digits > 9)).any()
+            or not numpy.isin(separators, [ord(c) for c in ":;.,"]).all()
+        ):
+            # let parse() say which one is malformed
+            return numpy.array([self.parse(str(timecode)) for timecode in timecodes])
+        hours, minutes, seconds, frames = (
+            digits[:, i] * 10 + digits[:, i + 1] for i in (0, 2, 4, 6)
+        )
+        return self._absoluteframe(hours, minutes, seconds, frames) - self.offset
+
+    def formatranges(self, ranges):
+        """Get the timecodes of a Ranges (or a list of Range) as a list of
+        (start, end) string tuples."""
+        if hasattr(ranges, "arrays"):
+            starts, ends = ranges.arrays()
+        else:
+            ranges = list(ranges)
+            starts, ends = [r.start for r in ranges], [r.end for r in ranges]
+        starts, ends = self.formatmany(starts), self.formatmany(ends)
+        return [(str(start), str(end)) for start, end in zip(starts, ends)]
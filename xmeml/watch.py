@@ -0,0 +1,401 @@
+# -*- encoding: utf-8 -*-
+#
+# Watch a folder for xmeml exports, and analyze new and changed files.
+#
+# Changes are picked up with inotify on linux, and by polling the folder
+# elsewhere. A file is analyzed when it has not changed for a while
+# (editors and file servers write big exports in many steps), and only
+# if its content has not been analyzed before. Files are analyzed by a
+# bounded pool of threads, and the results are appended to a sink,
+# e.g. a JSON lines file.
+#
+#   python -m xmeml.watch /exports /var/log/xmeml.jsonl
+#
+# Needs Python 3: os.fsencode, move_to_end and st_mtime_ns.
+#
+# (C) 2011-2020 havard.gulldahl@nrk.no
+# License: BSD
+
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import os.path
+import select
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .iter import AUDIOTHRESHOLD, ParserProfile, XmemlParser
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class Inotify(object):
+    """The names of files changed in a directory, from inotify via ctypes.
+    Raises OSError where inotify is not available.
+
+    If the kernel queue overflowed, events are lost, and overflowed is set
+    to True until the caller resets it, and looks at the directory itself.
+    """
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            init, addwatch = libc.inotify_init1, libc.inotify_add_watch
+        except AttributeError:
+            raise OSError("inotify is not available")
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if addwatch(self.fd, os.fsencode(directory), self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed", directory)
+        self.overflowed = False
+
+    def read(self, timeout):
+        "Wait up to timeout seconds for changes, and return the changed names"
+        names = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:  # EAGAIN, the events were read already
+            return names
+        offset = 0
+        while offset < len(data):
+            _wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("Inotify: the event queue overflowed, changes were lost")
+                self.overflowed = True
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class JsonLinesSink(object):
+    """Append each result as one line of JSON to a file. Thread safe."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            with open(self.filename, "a") as f:
+                f.write(line + "\n")
+
+
+class WatcherMetrics(object):
+    """Counters and timings of a Watcher. Latency is from the first sign of a
+    change to a file, to its result being written. The mean and max latency
+    are over all files, the median over the last window files."""
+
+    def __init__(self, window=1000):
+        self.started = time.time()
+        self.seen = 0  # changes that settled
+        self.skipped = 0  # content analyzed before
+        self.processed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=window)  # the most recent ones
+        self.latencycount = 0
+        self.latencytotal = 0.0
+        self.latencymax = None
+        self.busy = 0.0  # seconds spent analyzing
+        self._lock = threading.Lock()
+
+    def add(self, status, latency=None, busy=0.0):
+        with self._lock:
+            setattr(self, status, getattr(self, status) + 1)
+            if latency is not None:
+                self.latencies.append(latency)
+                self.latencycount += 1
+                self.latencytotal += latency
+                if self.latencymax is None or latency > self.latencymax:
+                    self.latencymax = latency
+            self.busy += busy
+
+    def summary(self):
+        "Return the metrics as a dict"
+        with self._lock:
+            latencies = sorted(self.latencies)
+            count = self.latencycount
+            elapsed = time.time() - self.started
+            return {
+                "seen": self.seen,
+                "skipped": self.skipped,
+                "processed": self.processed,
+                "failed": self.failed,
+                "elapsed": elapsed,
+                "throughput": self.processed / elapsed if elapsed > 0 else 0.0,
+                "busy": self.busy,
+                "latency_mean": self.latencytotal / count if count else None,
+                "latency_median": latencies[len(latencies) // 2] if latencies else None,
+                "latency_max": self.latencymax,
+            }
+
+
+def filedigest(filename, blocksize=1 << 20):
+    "Return the sha1 hex digest of the content of a file"
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analyze(filename, threshold=AUDIOTHRESHOLD):
+    """The default analysis of a Watcher: the audiblereport() of each sequence."""
+    with XmemlParser(filename, profile=ParserProfile()) as xmeml:
+        return [sequence.audiblereport(threshold) for sequence in xmeml.itersequences()]
+
+
+class Watcher(object):
+    """Watch directory for new and changed .xml files, and analyze them.
+
+    sink is called with a dict for every analyzed file: its path, digest,
+    latency and the result of analysis(path), or the error.
+    A file is analyzed when it has been unchanged for settle seconds, and
+    its content (by digest) has not been analyzed before. At most workers
+    files are analyzed at a time, and the watcher waits when that many more
+    are waiting. The digests of the last history files are remembered.
+
+        watcher = Watcher('/exports', JsonLinesSink('/var/log/xmeml.jsonl'))
+        watcher.run()  # until watcher.stop()
+
+    Use step() and drain() to drive it yourself, e.g. in tests.
+    """
+
+    def __init__(
+        self,
+        directory,
+        sink,
+        analysis=analyze,
+        workers=2,
+        settle=1.0,
+        interval=1.0,
+        useinotify=True,
+        existing=True,
+        suffix=".xml",
+        history=10000,
+    ):
+        self.directory = directory
+        self.sink = sink
+        self.analysis = analysis
+        self.workers = workers
+        self.settle = settle
+        self.interval = interval
+        self.suffix = suffix.lower()
+        self.metrics = WatcherMetrics()
+        self.history = history
+        self.digests = OrderedDict()  # content analyzed (or being analyzed), oldest first
+        self._pending = {}  # path -> [signature, changed since, first seen]
+        self._signatures = {}  # path -> signature when it was last handed on
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._futures = set()
+        self._stopped = threading.Event()
+        self.inotify = None
+        if useinotify:
+            try:
+                self.inotify = Inotify(directory)
+            except OSError as e:
+                logging.info("Watcher: no inotify (%s), polling %r", e, directory)
+        if existing:
+            self._scan()
+        else:
+            for path in self._listfiles():
+                self._signatures[path] = self._signature(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _listfiles(self):
+        for name in os.listdir(self.directory):
+            if name.lower().endswith(self.suffix) and not name.startswith("."):
+                yield os.path.join(self.directory, name)
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:  # gone again
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def _changed(self, path, now):
+        if path not in self._pending:
+            self._pending[path] = [self._signature(path), now, now]
+
+    def _scan(self, now=None):
+        now = time.time() if now is None else now
+        for path in self._listfiles():
+            if path in self._pending:
+                continue
+            signature = self._signature(path)
+            if signature is not None and signature != self._signatures.get(path):
+                self._pending[path] = [signature, now, now]
+
+    def step(self, timeout=None):
+        """Look for changes (waiting up to timeout seconds for inotify events), and
+        hand the files that have settled to the pool. Returns the number of files
+        handed on."""
+        timeout = self.interval if timeout is None else timeout
+        if self.inotify is not None:
+            names = self.inotify.read(timeout if not self._pending else min(timeout, self.settle))
+            now = time.time()
+            for name in names:
+                if name.lower().endswith(self.suffix) and not name.startswith("."):
+                    self._changed(os.path.join(self.directory, name), now)
+            if self.inotify.overflowed:
+                # the lost events may have been anything, so look at every file
+                self.inotify.overflowed = False
+                self._scan(now)
+        else:
+            self._stopped.wait(min(timeout, self.settle) if self._pending else timeout)
+            self._scan()
+        now = time.time()
+        ready = []
+        for path, pending in list(self._pending.items()):
+            signature = self._signature(path)
+            if signature is None:
+                del self._pending[path]
+            elif signature != pending[0]:
+                pending[0], pending[1] = signature, now  # still being written
+            elif now - pending[1] >= self.settle:
+                ready.append((path, signature, pending[2]))
+                del self._pending[path]
+        for path, signature, firstseen in ready:
+            self._signatures[path] = signature
+            self.metrics.add("seen")
+            self._slots.acquire()  # wait for a free slot
+            future = self._pool.submit(self._process, path, firstseen)
+            with self._lock:
+                self._futures.add(future)
+            future.add_done_callback(self._done)
+        return len(ready)
+
+    def _done(self, future):
+        self._slots.release()
+        with self._lock:
+            self._futures.discard(future)
+
+    def _process(self, path, firstseen):
+        started = time.time()
+        try:
+            digest = filedigest(path)
+        except (IOError, OSError) as e:
+            logging.warning("Watcher: could not read %r: %s", path, e)
+            self.metrics.add("failed")
+            return
+        with self._lock:
+            if digest in self.digests:
+                logging.info("Watcher: %r has been analyzed before, skipping", path)
+                self.digests.move_to_end(digest)
+                self.metrics.add("skipped")
+                return
+            self.digests[digest] = None
+            while len(self.digests) > self.history:
+                self.digests.popitem(last=False)
+        record = {"path": path, "digest": digest, "started": started}
+        try:
+            record["result"] = self.analysis(path)
+            status = "processed"
+        except Exception as e:
+            logging.exception("Watcher: analysis of %r failed", path)
+            record["error"] = "{}: {}".format(type(e).__name__, e)
+            status = "failed"
+            with self._lock:
+                self.digests.pop(digest, None)  # try again if the file is saved again
+        finished = time.time()
+        record["finished"] = finished
+        record["latency"] = finished - firstseen
+        self.sink(record)
+        self.metrics.add(status, finished - firstseen, finished - started)
+
+    def drain(self, timeout=None):
+        "Wait until the files handed on are analyzed"
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.exception(timeout)
+
+    def run(self, duration=None):
+        """Watch until stop() is called (from another thread or a signal handler),
+        or for duration seconds."""
+        deadline = None if duration is None else time.time() + duration
+        while not self._stopped.is_set():
+            if deadline is not None and time.time() >= deadline:
+                break
+            self.step()
+        self.drain()
+
+    def stop(self):
+        self._stopped.set()
+
+    def close(self):
+        "Stop, wait for the running analyses, and release the pool and inotify"
+        self.stop()
+        self._pool.shutdown(wait=True)
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Analyze xmeml exports in a folder")
+    parser.add_argument(dest="directory")
+    parser.add_argument(dest="output", help="JSON lines file to append results to")
+    parser.add_argument("-w", "--workers", type=int, default=2)
+    parser.add_argument("-s", "--settle", type=float, default=2.0)
+    parser.add_argument("--poll", action="store_true", help="poll instead of inotify")
+    parser.add_argument(
+        "-l",
+        "--loglevel",
+        choices=("debug", "info", "warning", "error"),
+        default="warning",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    watcher = Watcher(
+        args.directory,
+        JsonLinesSink(args.output),
+        workers=args.workers,
+        settle=args.settle,
+        useinotify=not args.poll,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        logging.warning("Watcher: %r", watcher.metrics.summary())